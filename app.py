@@ -3,18 +3,11 @@ from datetime import datetime
 import os
 import asyncio
 import uvicorn
-import subprocess
-import shutil
 import uuid
 import time
-try:
-    import httpx
-except ImportError:
-    httpx = None
-import urllib.request
 from fastapi import FastAPI, HTTPException, Form, Request, Depends, Response, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse, JSONResponse
 # Importar o middleware de sessão
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -22,37 +15,60 @@ from pydantic import BaseModel
 from typing import Optional
 from services import (
     registrar_entrada, registrar_saida, listar_veiculos, listar_saidas,
+    registrar_entradas_lote, registrar_saidas_lote, MAX_EVENTOS_LOTE, MAX_TAMANHO_ID_EVENTO,
+    limpar_eventos_processados, listar_cameras, salvar_camera, excluir_camera,
     resetar_banco, obter_estatisticas, registrar_cadastro,
     listar_cadastros as service_listar_cadastros,
     excluir_cadastro as service_excluir_cadastro,
     get_cadastro_por_id as service_get_cadastro_por_id,
-    atualizar_cadastro as service_atualizar_cadastro, get_empresa_por_cnpj, get_empresa_por_id,
+    atualizar_cadastro as service_atualizar_cadastro,
     setup_usuarios,
-    get_usuario,
-    verificar_senha,
     criar_usuario,
     listar_usuarios,
     excluir_usuario,
     atualizar_usuario,
     executar_sql_raw,
     salvar_css_personalizado,
-    ler_css_personalizado,
     salvar_config_visual,
-    ler_config_visual, get_protocols_for_user_history,
+    get_protocols_for_user_history,
     get_open_protocol_for_user, get_messages_by_protocol, save_chat_message,
     create_protocol_and_message, list_protocols,
     get_protocol_by_id,
     set_app_version,
     get_app_version,
-    importar_usuarios_csv,
     update_protocol_status,
     get_global_last_message_id, registrar_log, listar_historico,
-    gerar_excel_historico, listar_usuarios_do_historico,
-    close_protocols_bulk, salvar_arquivo_db, listar_arquivos_db,
+    iterar_historico, iterar_movimentacoes, listar_usuarios_do_historico,
+    close_protocols_bulk, salvar_arquivo_db, formatar_tamanho, listar_arquivos_db,
     get_arquivo_por_id, excluir_arquivo_db, criar_backup_sistema,
-    get_system_health, salvar_historico_performance, 
-    obter_historico_performance, limpar_historico_performance
+    salvar_historico_performance, 
+    obter_historico_performance, limpar_historico_performance,
+    estatisticas_pool, reconciliar_estatisticas, listar_mensagens_desde, atualizar_hash_senha,
+    get_backup_file_path
 )
+from db import fechar_conexoes
+from executores import executar_io, executar_cpu, executar_senha, estatisticas_executores, encerrar_executores
+from senhas import calibrar, custo_atual, verificar_e_atualizar
+from ocr_placas import fila_ocr, ocr_disponivel, FilaCheia, MAX_BYTES_IMAGEM
+from cameras import servico_cameras
+from placas import normalizar_placa, placa_valida
+from auditoria import fila_auditoria
+from exportacao import gerar_exportacao
+from monitoramento import coletor_status
+from config_cache import cache_config
+from cache_usuarios import cache_usuarios
+from transferencias import (
+    ErroUpload, MAX_TAMANHO_BLOCO, criar_sessao, obter_sessao, gravar_bloco,
+    cancelar_sessao, limpar_sessoes_expiradas, salvar_upload_inteiro
+)
+from fila_jobs import fila_jobs, obter_job, listar_jobs, cancelar_job, job_em_andamento
+from autorizacao import (
+    get_logged_user, exigir_papel, somente_admin, somente_gerencia, somente_dev, PAPEIS_ADMIN, PAPEIS_GERENCIA
+)
+from series_performance import atualizar_series, consultar_serie
+from datas import intervalo_de_datas
+from migrations import aplicar_migracoes, preencher_timestamps_legados
+from eventos import barramento, formatar_sse, topico_patio, topico_chat, TOPICO_CHAT_SUPORTE
 
 
 class CadastroModel(BaseModel):
@@ -89,6 +105,29 @@ class BulkCloseRequest(BaseModel):
     ids: list[int]
 
 
+class EventoEntradaModel(BaseModel):
+    placa: str
+    tipo: str
+    capturado_em: Optional[float] = None  # epoch (segundos) da leitura no aparelho
+    id_evento: Optional[str] = None  # gerado no aparelho; reenvios não registram de novo
+    responsavel: Optional[str] = None
+    cpf_responsavel: Optional[str] = None
+
+
+class EventoSaidaModel(BaseModel):
+    placa: str
+    capturado_em: Optional[float] = None
+    id_evento: Optional[str] = None
+
+
+class LoteEntradaModel(BaseModel):
+    eventos: list[EventoEntradaModel]
+
+
+class LoteSaidaModel(BaseModel):
+    eventos: list[EventoSaidaModel]
+
+
 class CssModel(BaseModel):
     css: str
 
@@ -97,6 +136,14 @@ class VisualConfigModel(BaseModel):
     config: dict
 
 
+class CameraModel(BaseModel):
+    nome: str
+    url: str  # rtsp://... ou caminho de um arquivo de vídeo no servidor
+    direcao: str  # "entrada" ou "saida"
+    tipo: str = "Carro"
+    ativa: bool = True
+
+
 class AppVersionModel(BaseModel):
     version: str
     changelog: str
@@ -108,32 +155,50 @@ async def log_performance_periodically():
         # A tarefa agora espera 5 minutos.
         await asyncio.sleep(300)
         try:
-            health = get_system_health()
-            ping_railway = 0
-            
-            # Só tenta medir ping externo se o httpx estiver instalado
-            if httpx:
-                try:
-                    async with httpx.AsyncClient() as client:
-                        start_time = time.time()
-                        await client.get(
-                            "https://projeto-sistema-de-veiculos-production.up.railway.app/app-version", timeout=10)
-                        ping_railway = int((time.time() - start_time) * 1000)
-                except Exception:
-                    ping_railway = 0  # Marca como 0 se falhar
-
+            # Média das amostras do coletor nos últimos 5 minutos (não um instante isolado)
+            media = coletor_status.media(300)
             salvar_historico_performance(
-                health.get("cpu_usage", 0),
-                health.get("ram_usage", 0),
-                health.get("disk_usage", 0),
+                media.get("cpu_usage", 0),
+                media.get("ram_usage", 0),
+                media.get("disk_usage", 0),
                 1,  # Ping local (irrelevante no servidor)
-                ping_railway
+                coletor_status.ping_railway
             )
         except Exception as e:
             # Imprime o erro no console do servidor para debug, mas não para a tarefa
             print(f"ERRO NA TAREFA DE HISTÓRICO: {e}")
 
 
+async def consolidar_series_periodically():
+    """Tarefa de fundo que grava os agregados de 1 minuto e consolida horas/dias (ver series_performance.py)."""
+    while True:
+        await asyncio.sleep(60)
+        try:
+            await executar_io(atualizar_series, coletor_status.amostras())
+        except Exception as e:
+            print(f"ERRO NA CONSOLIDAÇÃO DAS SÉRIES: {e}")
+
+
+async def limpar_eventos_periodically():
+    """Tarefa de fundo que apaga, a cada hora, as chaves de idempotência antigas do scanner."""
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            await executar_io(limpar_eventos_processados)
+        except Exception as e:
+            print(f"ERRO NA LIMPEZA DOS EVENTOS PROCESSADOS: {e}")
+
+
+async def limpar_uploads_periodically():
+    """Tarefa de fundo que apaga, a cada hora, as sessões de upload abandonadas (e suas partes no disco)."""
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            await executar_io(limpar_sessoes_expiradas)
+        except Exception as e:
+            print(f"ERRO NA LIMPEZA DAS SESSÕES DE UPLOAD: {e}")
+
+
 async def auto_backup_periodically():
     """Tarefa de fundo que faz backup do código e banco a cada 30 minutos."""
     while True:
@@ -141,7 +206,7 @@ async def auto_backup_periodically():
         await asyncio.sleep(1800)
         try:
             print("⏳ Iniciando backup automático...")
-            res = criar_backup_sistema()
+            res = await executar_cpu(criar_backup_sistema)
             print(f"✅ {res.get('status')} - {res.get('arquivo')}")
         except Exception as e:
             print(f"❌ Erro no backup automático: {e}")
@@ -170,13 +235,44 @@ def on_startup():
     # Cria o usuário 'admin' com senha 'admin' no primeiro boot
     global START_TIME
     START_TIME = datetime.now()
+    # Custo do bcrypt para esta máquina (gravado em configuracoes na primeira subida),
+    # antes de gravar qualquer hash (ver senhas.py)
+    aplicar_migracoes()
+    print(f"Custo do bcrypt: {calibrar()}")
     setup_usuarios()
+    # Fila de jobs em segundo plano (backup, exportações, importação...); ver fila_jobs.py
+    fila_jobs.iniciar()
+    # Configurações (CSS, visual, versão) ficam em memória; ver config_cache.py
+    cache_config.carregar()
+    # Converte em segundo plano (em lotes) as datas antigas de movimentacoes para epoch
+    asyncio.create_task(asyncio.to_thread(preencher_timestamps_legados))
+    # Processos de leitura das câmeras cadastradas (ver cameras.py)
+    asyncio.create_task(asyncio.to_thread(servico_cameras.iniciar))
+    # Coletor de status do servidor (CPU, RAM, rede, processos, ping) em thread própria
+    coletor_status.iniciar()
     # Inicia a tarefa de fundo para coletar dados de performance continuamente
     asyncio.create_task(log_performance_periodically())
+    asyncio.create_task(consolidar_series_periodically())
+    asyncio.create_task(limpar_eventos_periodically())
+    asyncio.create_task(limpar_uploads_periodically())
     # Inicia a tarefa de backup automático
     asyncio.create_task(auto_backup_periodically())
-    # Faz um backup imediato ao ligar o servidor (segurança extra)
-    criar_backup_sistema()
+    # Faz um backup imediato ao ligar o servidor (segurança extra), sem atrasar o boot
+    asyncio.create_task(executar_cpu(criar_backup_sistema))
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Primeiro para quem ainda grava no banco ou no histórico: jobs, coletor,
+    # câmeras e os pools (esperam o que já está rodando)
+    await fila_jobs.encerrar()
+    coletor_status.encerrar()
+    servico_cameras.encerrar()
+    encerrar_executores()
+    # Grava os registros de auditoria pendentes antes de fechar o banco
+    fila_auditoria.encerrar()
+    # Por último, fecha as conexões do pool (faz o checkpoint final do WAL)
+    fechar_conexoes()
 
 
 # Adicionar o middleware de sessão
@@ -204,21 +300,6 @@ async def get_current_user(request: Request):
         return None
     return username
 
-# Dependência para exigir login nas rotas da API
-
-
-async def get_logged_user(request: Request):
-    user = request.session.get("user")
-    if not user:
-        raise HTTPException(
-            status_code=401, detail="Você precisa estar logado para realizar esta ação.")
-    
-    empresa_id = request.session.get("empresa_id")
-    if not empresa_id:
-        raise HTTPException(
-            status_code=401, detail="Sessão inválida. Empresa não identificada.")
-    return {"user": user, "empresa_id": empresa_id}
-
 
 @app.get("/")
 def login_page(request: Request):
@@ -239,33 +320,39 @@ async def login_form(request: Request):
         # Validação básica para campos que são sempre obrigatórios
         return RedirectResponse(url="/?error=1", status_code=303)
 
-    # 1. Validar a empresa
-    empresa = None
+    # 1. Empresa e usuário DENTRO dela, numa única consulta (ou do cache de autenticação)
     special_users = ['admin', 'neto@dev.com']
 
     if username in special_users and not cnpj:
         # Se for admin/dev e não digitou CNPJ, usa a empresa padrão (ID 1)
-        empresa = get_empresa_por_id(1)
+        empresa, user = await executar_io(cache_usuarios.login, username, 1)
     else:
         if not cnpj:  # Se não for usuário especial, CNPJ é obrigatório
             return RedirectResponse(url="/?error=1", status_code=303)
         cnpj_limpo = "".join(filter(str.isdigit, cnpj))
-        empresa = get_empresa_por_cnpj(cnpj_limpo)
+        empresa, user = await executar_io(cache_usuarios.login, username, None, cnpj_limpo)
 
     if not empresa:
         return RedirectResponse(url="/?error=1", status_code=303)
 
-    # 2. Validar o usuário DENTRO da empresa encontrada
-    user = get_usuario(username, empresa['id'])
-    if not user or not verificar_senha(password, user["password_hash"]):
+    # 2. Validar a senha
+    # bcrypt leva dezenas de ms de CPU: verifica no pool de processos das senhas
+    if not user:
         return RedirectResponse(url="/?error=1", status_code=303)
+    senha_ok, novo_hash = await executar_senha(verificar_e_atualizar, password, user["password_hash"], custo_atual())
+    if not senha_ok:
+        return RedirectResponse(url="/?error=1", status_code=303)
+    if novo_hash:
+        # Hash gravado com custo do bcrypt menor que o calibrado: regrava (ver senhas.py)
+        await executar_io(atualizar_hash_senha, user["id"], empresa["id"], novo_hash)
 
     request.session["user"] = user["username"]
     request.session["role"] = user["role"]
     request.session["empresa_id"] = empresa["id"]
     request.session["nome_empresa"] = empresa["nome_empresa"]
 
-    registrar_log(user["username"], "LOGIN", empresa["id"], "Acesso ao sistema realizado.")
+    # Fila de auditoria cheia faz quem registra esperar: fora do event loop
+    await executar_io(registrar_log, user["username"], "LOGIN", empresa["id"], "Acesso ao sistema realizado.")
     
     # Se for vigilante, manda direto para o scanner
     if request.session["role"] == "vigilante":
@@ -278,7 +365,7 @@ async def login_form(request: Request):
 async def logout(request: Request):
     user = request.session.get("user", "Desconhecido")
     empresa_id = request.session.get("empresa_id", 0)
-    registrar_log(user, "LOGOUT", empresa_id, "Saída do sistema.")
+    await executar_io(registrar_log, user, "LOGOUT", empresa_id, "Saída do sistema.")
     request.session.clear()
     return RedirectResponse(url="/")
 
@@ -314,38 +401,172 @@ def get_me(request: Request):
     return {"authenticated": True, "username": user, "role": role, "nome_empresa": nome_empresa}
 
 
+def _validar_id_evento(id_evento):
+    if id_evento is not None and not 0 < len(id_evento) <= MAX_TAMANHO_ID_EVENTO:
+        raise HTTPException(status_code=400,
+                            detail=f"id_evento deve ter de 1 a {MAX_TAMANHO_ID_EVENTO} caracteres.")
+
+
+def _registrado_agora(res):
+    """Sucesso que não é repetição de um id_evento já processado (só esses vão para o log)."""
+    return "status" in res and not res.get("duplicado")
+
+
 @app.post("/entrada")
-def entrada(placa: str, tipo: str, auth_data: dict = Depends(get_logged_user)):
-    res = registrar_entrada(placa, tipo, auth_data["empresa_id"])
-    if "status" in res:
+def entrada(placa: str, tipo: str, id_evento: Optional[str] = None,
+            auth_data: dict = Depends(get_logged_user)):
+    _validar_id_evento(id_evento)
+    placa = normalizar_placa(placa)
+    if not placa_valida(placa):
+        return {"erro": "Placa inválida. Ex: ABC1234 ou ABC1D23"}
+    res = registrar_entrada(placa, tipo, auth_data["empresa_id"], id_evento=id_evento)
+    if _registrado_agora(res):
         registrar_log(auth_data["user"], "ENTRADA VEÍCULO", auth_data["empresa_id"],
                       f"Placa: {placa} | Tipo: {tipo}")
     return res
 
 
 @app.post("/saida")
-def saida(placa: str, auth_data: dict = Depends(get_logged_user)):
-    registrar_log(auth_data["user"], "SAÍDA VEÍCULO", auth_data["empresa_id"], f"Placa: {placa}")
-    return registrar_saida(placa, auth_data["empresa_id"])
+def saida(placa: str, id_evento: Optional[str] = None, auth_data: dict = Depends(get_logged_user)):
+    _validar_id_evento(id_evento)
+    res = registrar_saida(normalizar_placa(placa), auth_data["empresa_id"], id_evento=id_evento)
+    if _registrado_agora(res):
+        # A placa gravada na entrada (pode estar no outro formato), não a digitada
+        registrar_log(auth_data["user"], "SAÍDA VEÍCULO", auth_data["empresa_id"], f"Placa: {res['placa']}")
+    return res
 
 
-@app.get("/veiculos")
-def veiculos(auth_data: dict = Depends(get_logged_user)):
-    dados = listar_veiculos(auth_data["empresa_id"])
+def _validar_lote(eventos):
+    if not eventos:
+        raise HTTPException(status_code=400, detail="Nenhum evento enviado.")
+    if len(eventos) > MAX_EVENTOS_LOTE:
+        raise HTTPException(status_code=413, detail=f"Máximo de {MAX_EVENTOS_LOTE} eventos por lote.")
+    for evento in eventos:
+        _validar_id_evento(evento.id_evento)
+
+
+@app.post("/entrada/lote")
+def entrada_lote(dados: LoteEntradaModel, auth_data: dict = Depends(get_logged_user)):
+    """Várias entradas numa transação (portão ou scanner enviando leituras feitas offline)."""
+    _validar_lote(dados.eventos)
+    eventos = [e.dict() for e in dados.eventos]
+    resultados = registrar_entradas_lote(eventos, auth_data["empresa_id"])
+    for evento, res in zip(eventos, resultados):
+        if _registrado_agora(res):
+            registrar_log(auth_data["user"], "ENTRADA VEÍCULO", auth_data["empresa_id"],
+                          f"Placa: {res['placa']} | Tipo: {evento['tipo']} (lote)")
+    return {"resultados": resultados, "registrados": sum(map(_registrado_agora, resultados))}
+
+
+@app.post("/saida/lote")
+def saida_lote(dados: LoteSaidaModel, auth_data: dict = Depends(get_logged_user)):
+    """Várias saídas numa transação (ver /entrada/lote)."""
+    _validar_lote(dados.eventos)
+    eventos = [e.dict() for e in dados.eventos]
+    resultados = registrar_saidas_lote(eventos, auth_data["empresa_id"])
+    for res in resultados:
+        if _registrado_agora(res):
+            registrar_log(auth_data["user"], "SAÍDA VEÍCULO", auth_data["empresa_id"],
+                          f"Placa: {res['placa']} (lote)")
+    return {"resultados": resultados, "registrados": sum(map(_registrado_agora, resultados))}
+
+
+@app.post("/api/ocr/placa")
+async def api_ocr_placa(imagem: UploadFile = File(...), auth_data: dict = Depends(get_logged_user)):
+    """Lê a placa de uma foto no servidor (ver ocr_placas.py); 503 se o OCR não estiver instalado."""
+    if not ocr_disponivel():
+        raise HTTPException(status_code=503, detail="OCR de placas indisponível no servidor.")
+    dados = await imagem.read(MAX_BYTES_IMAGEM + 1)
+    if not dados:
+        raise HTTPException(status_code=400, detail="Imagem vazia.")
+    if len(dados) > MAX_BYTES_IMAGEM:
+        raise HTTPException(status_code=413, detail="Imagem muito grande.")
+    try:
+        return await fila_ocr.reconhecer(dados)
+    except FilaCheia:
+        raise HTTPException(status_code=503, detail="OCR ocupado, tente novamente.",
+                            headers={"Retry-After": "2"})
+
+
+def formatar_veiculos(dados):
     return [
         {"placa": v[0], "tipo": v[1], "entrada": v[2], "responsavel": v[3]}
         for v in dados
     ]
 
 
+@app.get("/veiculos")
+def veiculos(auth_data: dict = Depends(get_logged_user)):
+    return formatar_veiculos(listar_veiculos(auth_data["empresa_id"]))
+
+
+def snapshot_patio(empresa_id):
+    return {
+        "veiculos": formatar_veiculos(listar_veiculos(empresa_id)),
+        "estatisticas": obter_estatisticas(empresa_id),
+    }
+
+
+@app.get("/veiculos/stream")
+async def veiculos_stream(request: Request, last_event_id: Optional[int] = None,
+                          auth_data: dict = Depends(get_logged_user)):
+    """Feed ao vivo do pátio (Server-Sent Events).
+
+    Envia um snapshot inicial (veículos + estatísticas) e depois só os
+    eventos `entrada`, `saida`, `estatisticas` e `reset` da empresa. Ao
+    reconectar, o navegador manda o header Last-Event-ID e recebe apenas o
+    que perdeu (ou um snapshot novo se o buffer já descartou esses eventos).
+    """
+    empresa_id = auth_data["empresa_id"]
+    topico = topico_patio(empresa_id)
+    header_id = request.headers.get("last-event-id", "")
+    ultimo_id = int(header_id) if header_id.isdigit() else last_event_id
+
+    async def gerar():
+        ultimo = ultimo_id
+        yield "retry: 3000\n\n"
+        eventos = barramento.eventos_desde(topico, ultimo) if ultimo is not None else None
+        while True:
+            if eventos is None:
+                # Cliente novo ou que perdeu eventos demais: manda o estado completo
+                ultimo = barramento.ultimo_id()
+                snapshot = await asyncio.to_thread(snapshot_patio, empresa_id)
+                yield formatar_sse(ultimo, "snapshot", snapshot)
+                eventos = barramento.eventos_desde(topico, ultimo) or []
+            for evento_id, tipo, dados in eventos:
+                yield formatar_sse(evento_id, tipo, dados)
+                ultimo = evento_id
+            if await request.is_disconnected():
+                break
+            eventos = await barramento.aguardar(topico, ultimo, timeout=15)
+            if eventos == []:
+                # Keep-alive para proxies não derrubarem a conexão ociosa
+                yield ": ping\n\n"
+
+    return StreamingResponse(gerar(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
 @app.get("/saidas")
-def saidas(auth_data: dict = Depends(get_logged_user)):
-    dados = listar_saidas(auth_data["empresa_id"])
-    return [
-        {"placa": v[0], "tipo": v[1], "entrada": v[2],
-            "saida": v[3], "responsavel": v[4]}
-        for v in dados
-    ]
+def saidas(cursor: Optional[int] = None, limite: int = 50, placa: Optional[str] = None,
+           tipo: Optional[str] = None, data_inicio: Optional[str] = None, data_fim: Optional[str] = None,
+           auth_data: dict = Depends(get_logged_user)):
+    """Saídas paginadas: passe o next_cursor da resposta como ?cursor= para a próxima página."""
+    try:
+        dados, next_cursor = listar_saidas(auth_data["empresa_id"], cursor, limite, placa, tipo,
+                                           data_inicio, data_fim)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida (use AAAA-MM-DD).")
+    return {
+        "itens": [
+            {"placa": v[0], "tipo": v[1], "entrada": v[2],
+                "saida": v[3], "responsavel": v[4]}
+            for v in dados
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 @app.post("/reset")
@@ -367,8 +588,9 @@ def atualizar_cadastro_endpoint(cadastro_id: int, dados: CadastroModel, auth_dat
 
 
 @app.get("/cadastros")
-def listar_cadastros_endpoint(busca: Optional[str] = None, auth_data: dict = Depends(get_logged_user)):
-    registros = service_listar_cadastros(auth_data["empresa_id"], busca)
+def listar_cadastros_endpoint(busca: Optional[str] = None, limite: int = 50,
+                              auth_data: dict = Depends(get_logged_user)):
+    registros = service_listar_cadastros(auth_data["empresa_id"], busca, min(max(limite, 1), 500))
     return [
         {
             "id": r[0], "nome": r[1], "cpf": r[2], "telefone": r[3],
@@ -396,139 +618,223 @@ def excluir_cadastro_endpoint(cadastro_id: int, auth_data: dict = Depends(get_lo
 def estatisticas(auth_data: dict = Depends(get_logged_user)):
     return obter_estatisticas(auth_data["empresa_id"])
 
-# --- Rotas de Histórico (Logs) ---
 
-@app.get("/api/relatorio/evolucao")
-def api_download_relatorio_evolucao(user: str = Depends(get_logged_user)):
-    """Gera e baixa o Excel com as atualizações do sistema."""
-    import pandas as pd
-    
-    # Dados do Realizado
-    dados_realizado = [
-        {"Recurso": "Monitoramento de Servidor", "Detalhes": "Painel com CPU, RAM, Disco, Ping (Local/Railway) e Gráficos Históricos.", "Status": "Concluído"},
-        {"Recurso": "Interface Responsiva Inteligente", "Detalhes": "Ajuste automático de escala: 'Zoom Out' (Placa de Vídeo) no PC e Normal no Mobile.", "Status": "Concluído"},
-        {"Recurso": "Indicadores de Rede Avançados", "Detalhes": "Detecção automática de WiFi vs Cabo e velocímetro no Navbar.", "Status": "Concluído"},
-        {"Recurso": "Sistema de Chat/Suporte", "Detalhes": "Chat interno com geração de protocolos, status (aberto/fechado) e avaliação.", "Status": "Concluído"},
-        {"Recurso": "Leitura de Placa (OCR)", "Detalhes": "Integração com câmera e Tesseract.js para leitura automática de placas.", "Status": "Concluído"},
-        {"Recurso": "Gestão de Arquivos (Nuvem)", "Detalhes": "Upload e download de arquivos internos no servidor.", "Status": "Concluído"},
-        {"Recurso": "Controle de Acesso (Roles)", "Detalhes": "Níveis hierárquicos: Admin, Gerente, Operador, Vigilante, Dev.", "Status": "Concluído"},
-        {"Recurso": "Editor Visual (No-Code)", "Detalhes": "Ferramenta para alterar textos e cores clicando com botão direito (Modo Dev).", "Status": "Concluído"},
-        {"Recurso": "Monitoramento 24/7", "Detalhes": "Tarefa de fundo para manter histórico de performance mesmo sem acesso ao site.", "Status": "Concluído"},
-        {"Recurso": "Painel SQL", "Detalhes": "Ferramenta para execução de queries e correção de banco direto pelo navegador.", "Status": "Concluído"},
-        {"Recurso": "Copyright Dinâmico", "Detalhes": "Ano e versão atualizados automaticamente no rodapé de todas as telas.", "Status": "Concluído"},
-        {"Recurso": "Widgets de Utilidade", "Detalhes": "Previsão do tempo e Calendário integrados ao topo do sistema.", "Status": "Concluído"},
-        {"Recurso": "Scanner Mobile (Vigilante)", "Detalhes": "Interface simplificada e leve focada apenas na leitura de placas.", "Status": "Concluído"},
-    ]
+@app.post("/estatisticas/reconciliar")
+def estatisticas_reconciliar(auth_data: dict = Depends(somente_admin)):
+    """Confere os contadores incrementais com a contagem real e corrige divergências."""
+    return reconciliar_estatisticas(auth_data["empresa_id"])
 
-    # Dados do Futuro
-    dados_futuro = [
-        {"Recurso": "Integração Câmeras IP (RTSP)", "Detalhes": "Ler placas automaticamente de câmeras de segurança (sem precisar clicar/tirar foto).", "Prioridade": "Alta"},
-        {"Recurso": "Módulo Financeiro", "Detalhes": "Cálculo de valor por tempo de estadia, gestão de mensalistas e integração Pix.", "Prioridade": "Alta"},
-        {"Recurso": "App Mobile Nativo", "Detalhes": "Aplicativo .apk/.ipa instalado no celular com notificações push reais.", "Prioridade": "Média"},
-        {"Recurso": "Controle de Hardware (IoT)", "Detalhes": "Abrir cancelas e portões automaticamente via Arduino/ESP32 ao reconhecer placa.", "Prioridade": "Média"},
-        {"Recurso": "Reconhecimento Facial", "Detalhes": "Identificar motoristas e funcionários pela câmera na entrada.", "Prioridade": "Baixa"},
-        {"Recurso": "Dashboard BI Avançado", "Detalhes": "Gráficos de fluxo de veículos, horários de pico e previsão de faturamento.", "Prioridade": "Baixa"},
-        {"Recurso": "Backup em Nuvem Externa", "Detalhes": "Salvar banco de dados no Google Drive/AWS S3 automaticamente para segurança total.", "Prioridade": "Baixa"},
-    ]
-
-    df_realizado = pd.DataFrame(dados_realizado)
-    df_futuro = pd.DataFrame(dados_futuro)
-
-    nome_arquivo = "Relatorio_Evolucao_Sistema.xlsx"
-    caminho_completo = os.path.join("uploads", nome_arquivo)
-
-    # Salvar o Excel
-    with pd.ExcelWriter(caminho_completo, engine='openpyxl') as writer:
-        df_realizado.to_excel(writer, sheet_name='Realizado', index=False)
-        df_futuro.to_excel(writer, sheet_name='Futuro (Roadmap)', index=False)
-        
-        # Ajuste visual das colunas
-        for sheet in writer.sheets.values():
-            sheet.column_dimensions['A'].width = 35
-            sheet.column_dimensions['B'].width = 70
-            sheet.column_dimensions['C'].width = 15
+# --- Rotas de Histórico (Logs) ---
 
-    return FileResponse(caminho_completo, filename=nome_arquivo, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+@app.post("/api/relatorio/evolucao")
+def api_relatorio_evolucao(auth_data: dict = Depends(get_logged_user)):
+    """Enfileira a geração do Excel com as atualizações do sistema; o arquivo sai em /api/jobs/{id}/arquivo."""
+    job = fila_jobs.enfileirar("relatorio_evolucao", auth_data["empresa_id"], auth_data["user"])
+    return {"status": "Relatório em geração.", "job_id": job["id"]}
 
 
 @app.get("/api/historico")
-def api_get_historico(request: Request, usuario: Optional[str] = None, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['gerente', 'admin', 'dev']:
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    return listar_historico(auth_data["empresa_id"], usuario)
+def api_get_historico(usuario: Optional[str] = None, acao: Optional[str] = None,
+                      data_inicio: Optional[str] = None, data_fim: Optional[str] = None,
+                      cursor: Optional[int] = None, limite: int = 50,
+                      auth_data: dict = Depends(somente_gerencia)):
+    """Histórico paginado: passe o next_cursor da resposta como ?cursor= para a próxima página."""
+    try:
+        itens, next_cursor = listar_historico(auth_data["empresa_id"], usuario, acao,
+                                              data_inicio, data_fim, cursor, limite)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida (use AAAA-MM-DD).")
+    return {"itens": itens, "next_cursor": next_cursor}
 
 
 @app.get("/api/historico/usuarios")
-def api_get_historico_usuarios(request: Request, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['gerente', 'admin', 'dev']:
-        raise HTTPException(status_code=403, detail="Acesso negado")
+def api_get_historico_usuarios(auth_data: dict = Depends(somente_gerencia)):
     return listar_usuarios_do_historico(auth_data["empresa_id"])
 
 
-@app.get("/api/historico/exportar")
-def api_exportar_historico(request: Request, usuario: Optional[str] = None, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['gerente', 'admin', 'dev']:
-        raise HTTPException(status_code=403, detail="Acesso negado")
+def _resposta_exportacao(formato, nome_base, cabecalho, linhas, nome_planilha, larguras):
+    """StreamingResponse de uma exportação (o arquivo é gerado enquanto é baixado)."""
+    gerador, media_type = gerar_exportacao(formato, cabecalho, linhas, nome_planilha, larguras)
+    return StreamingResponse(gerador, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{nome_base}.{formato}"'})
+
+
+def _validar_exportacao(formato, data_inicio, data_fim):
+    if formato not in ("xlsx", "csv"):
+        raise HTTPException(status_code=400, detail="Formato inválido (use xlsx ou csv).")
+    # Valida antes de começar a resposta: depois dos cabeçalhos não dá mais para devolver 400
+    try:
+        intervalo_de_datas(data_inicio, data_fim)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida (use AAAA-MM-DD).")
 
-    caminho, nome_arquivo = gerar_excel_historico(auth_data["empresa_id"], usuario)
+
+def _preparar_exportacao_historico(usuario, acao, data_inicio, data_fim, formato, auth_data):
+    """Valida os filtros, registra a exportação no histórico e devolve o nome base do arquivo."""
+    _validar_exportacao(formato, data_inicio, data_fim)
+
+    if usuario:
+        safe_usuario = "".join(c for c in usuario if c.isalnum() or c in ('-', '_')).rstrip()
+        nome_base = f"historico_{safe_usuario}"
+    else:
+        nome_base = "historico_completo"
 
     log_details = f"Exportou histórico de ações para o usuário '{usuario}'." if usuario else "Exportou histórico de ações completo."
-    registrar_log(user, "EXPORTAÇÃO", log_details)
+    if data_inicio or data_fim:
+        log_details += f" Período: {data_inicio or '...'} a {data_fim or '...'}."
+    registrar_log(auth_data["user"], "EXPORTAÇÃO", auth_data["empresa_id"], log_details)
+    return nome_base
 
-    return FileResponse(caminho, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename=nome_arquivo)
+
+@app.get("/api/historico/exportar")
+def api_exportar_historico(usuario: Optional[str] = None, acao: Optional[str] = None,
+                           data_inicio: Optional[str] = None, data_fim: Optional[str] = None,
+                           formato: str = "xlsx", auth_data: dict = Depends(somente_gerencia)):
+    """Exporta o histórico filtrado (mesmos filtros de /api/historico) em XLSX ou CSV."""
+    nome_base = _preparar_exportacao_historico(usuario, acao, data_inicio, data_fim, formato, auth_data)
+    linhas = iterar_historico(auth_data["empresa_id"], usuario, acao, data_inicio, data_fim)
+    return _resposta_exportacao(formato, nome_base, ["Data/Hora", "Usuário", "Ação", "Detalhes"],
+                                linhas, "Histórico", [20, 20, 22, 80])
+
+
+@app.post("/api/historico/exportar")
+def api_exportar_historico_job(usuario: Optional[str] = None, acao: Optional[str] = None,
+                               data_inicio: Optional[str] = None, data_fim: Optional[str] = None,
+                               formato: str = "xlsx", auth_data: dict = Depends(somente_gerencia)):
+    """Mesma exportação, em segundo plano: o arquivo sai em /api/jobs/{id}/arquivo (só para a gerência)."""
+    nome_base = _preparar_exportacao_historico(usuario, acao, data_inicio, data_fim, formato, auth_data)
+    job = fila_jobs.enfileirar("exportar_historico", auth_data["empresa_id"], auth_data["user"],
+                               empresa_id=auth_data["empresa_id"], nome_base=nome_base, formato=formato,
+                               usuario=usuario, acao=acao, data_inicio=data_inicio, data_fim=data_fim)
+    return {"status": "Exportação iniciada.", "job_id": job["id"]}
+
+
+@app.get("/api/movimentacoes/exportar")
+def api_exportar_movimentacoes(data_inicio: Optional[str] = None,
+                               data_fim: Optional[str] = None, formato: str = "xlsx",
+                               auth_data: dict = Depends(somente_gerencia)):
+    """Exporta as movimentações com entrada no período (AAAA-MM-DD, fim inclusivo) em XLSX ou CSV."""
+    _validar_exportacao(formato, data_inicio, data_fim)
+
+    nome_base = f"movimentacoes_{data_inicio or 'inicio'}_{data_fim or 'hoje'}"
+    registrar_log(auth_data["user"], "EXPORTAÇÃO", auth_data["empresa_id"],
+                  f"Exportou movimentações. Período: {data_inicio or '...'} a {data_fim or '...'}.")
+
+    linhas = iterar_movimentacoes(auth_data["empresa_id"], data_inicio, data_fim)
+    return _resposta_exportacao(formato, nome_base, ["Placa", "Tipo", "Entrada", "Saída", "Responsável", "CPF"],
+                                linhas, "Movimentações", [12, 10, 20, 20, 30, 16])
 
 
 # --- Rotas de Gestão de Usuários (Apenas Gerente/Admin) ---
 
 
 @app.get("/usuarios")
-def api_listar_usuarios(request: Request, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['gerente', 'admin', 'dev']:
-        raise HTTPException(status_code=403, detail="Acesso negado")
+def api_listar_usuarios(auth_data: dict = Depends(somente_gerencia)):
     return listar_usuarios(auth_data["empresa_id"])
 
 
 @app.post("/usuarios")
-def novo_usuario(dados: UsuarioModel, request: Request, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['gerente', 'admin', 'dev']:
-        raise HTTPException(
-            status_code=403, detail="Apenas gerentes podem criar usuários.")
+def novo_usuario(dados: UsuarioModel, auth_data: dict = Depends(
+        exigir_papel("gerente", "admin", "dev", detalhe="Apenas gerentes podem criar usuários."))):
     registrar_log(auth_data["user"], "CRIAR USUÁRIO", auth_data["empresa_id"],
                   f"Novo user: {dados.username} | Cargo: {dados.role}")
     return criar_usuario(dados.username, dados.password, dados.role, auth_data["empresa_id"])
 
 
 @app.put("/usuarios/{user_id}")
-def api_atualizar_usuario(user_id: int, dados: UsuarioModel, request: Request, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['gerente', 'admin', 'dev']:
-        raise HTTPException(status_code=403, detail="Acesso negado")
+def api_atualizar_usuario(user_id: int, dados: UsuarioModel, auth_data: dict = Depends(somente_gerencia)):
     # Passamos a senha (pode ser vazia se não for alterar)
     registrar_log(auth_data["user"], "EDITAR USUÁRIO", auth_data["empresa_id"], f"ID: {user_id}")
     return atualizar_usuario(user_id, dados.username, dados.password, dados.role, auth_data["empresa_id"])
 
 
 @app.delete("/usuarios/{user_id}")
-def api_excluir_usuario(user_id: int, request: Request, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['gerente', 'admin', 'dev']:
-        raise HTTPException(status_code=403, detail="Acesso negado")
+def api_excluir_usuario(user_id: int, auth_data: dict = Depends(somente_gerencia)):
     registrar_log(auth_data["user"], "EXCLUIR USUÁRIO", auth_data["empresa_id"], f"ID: {user_id}")
     return excluir_usuario(user_id, auth_data["empresa_id"])
 
 
 @app.post("/usuarios/importar")
-def api_importar_usuarios(request: Request, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['gerente', 'admin', 'dev']:
-        raise HTTPException(status_code=403, detail="Acesso negado")
+def api_importar_usuarios(auth_data: dict = Depends(somente_gerencia)):
+    """Enfileira a importação do CSV; acompanhe por /api/jobs/{job_id}."""
+    if not os.path.exists(get_backup_file_path()):
+        return {"erro": "Arquivo usuarios_backup.csv não encontrado."}
+    # Uma importação por empresa: se já há uma na fila, devolve a mesma
+    job = job_em_andamento("importar_usuarios", auth_data["empresa_id"])
+    if job:
+        return {"status": "Já existe uma importação em andamento.", "job_id": job["id"]}
+    job = fila_jobs.enfileirar("importar_usuarios", auth_data["empresa_id"], auth_data["user"],
+                               empresa_id=auth_data["empresa_id"], custo=custo_atual())
     registrar_log(auth_data["user"], "IMPORTAR USUÁRIOS", auth_data["empresa_id"], "Via CSV Backup")
-    return importar_usuarios_csv()
+    return {"status": "Importação iniciada.", "job_id": job["id"]}
+
+
+# --- Rotas de Jobs em Segundo Plano ---
+
+# Papéis que veem, cancelam e baixam o arquivo de cada tipo de job: os mesmos da
+# rota que o enfileira (None = qualquer usuário logado; ver _pode_cancelar_job)
+PAPEIS_JOB = {
+    "backup": PAPEIS_ADMIN,
+    "git_pull": PAPEIS_ADMIN,
+    "exportar_historico": PAPEIS_GERENCIA,
+    "importar_usuarios": PAPEIS_GERENCIA,
+    "relatorio_evolucao": None,
+}
+
+
+def _pode_ver_job(tipo, role):
+    papeis = PAPEIS_JOB[tipo]
+    return papeis is None or role in papeis
+
+
+def _pode_cancelar_job(job, auth_data):
+    """Tipos abertos a todos só podem ser cancelados por quem pediu ou pelo admin."""
+    if PAPEIS_JOB[job["tipo"]] is None:
+        return job["usuario"] == auth_data["user"] or auth_data["role"] in PAPEIS_ADMIN
+    return _pode_ver_job(job["tipo"], auth_data["role"])
+
+
+def _job_autorizado(job_id, auth_data):
+    """Job da empresa, se o papel do usuário permite vê-lo (404/403 se não)."""
+    job = obter_job(job_id, auth_data["empresa_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    if not _pode_ver_job(job["tipo"], auth_data["role"]):
+        raise HTTPException(status_code=403, detail="Acesso negado.")
+    return job
+
+
+
+@app.get("/api/jobs")
+def api_listar_jobs(auth_data: dict = Depends(get_logged_user)):
+    """Jobs da empresa dos tipos que o papel do usuário pode ver."""
+    tipos = [tipo for tipo in PAPEIS_JOB if _pode_ver_job(tipo, auth_data["role"])]
+    return listar_jobs(auth_data["empresa_id"], tipos)
+
+
+@app.get("/api/jobs/{job_id}")
+def api_obter_job(job_id: int, auth_data: dict = Depends(get_logged_user)):
+    """Status, progresso e resultado do job (arquivo gerado: baixar por /api/jobs/{job_id}/arquivo)."""
+    return _job_autorizado(job_id, auth_data)
+
+
+@app.get("/api/jobs/{job_id}/arquivo")
+def api_baixar_arquivo_job(job_id: int, request: Request, auth_data: dict = Depends(get_logged_user)):
+    """Arquivo gerado pelo job (exportação, relatório); não aparece na lista de Arquivos."""
+    job = _job_autorizado(job_id, auth_data)
+    arquivo = job["arquivo_id"] and get_arquivo_por_id(job["arquivo_id"], auth_data["empresa_id"], job_id=job_id)
+    if not arquivo:
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    return _resposta_download(arquivo, request)
+
+
+@app.post("/api/jobs/{job_id}/cancelar")
+def api_cancelar_job(job_id: int, auth_data: dict = Depends(get_logged_user)):
+    job = _job_autorizado(job_id, auth_data)
+    if not _pode_cancelar_job(job, auth_data):
+        raise HTTPException(status_code=403, detail="Apenas quem pediu o job ou o admin pode cancelá-lo.")
+    registrar_log(auth_data["user"], "CANCELAR JOB", auth_data["empresa_id"], f"ID: {job_id}")
+    return cancelar_job(job_id, auth_data["empresa_id"])
 
 
 # --- Rotas do Chat (Nova Lógica com Protocolos) ---
@@ -546,11 +852,9 @@ def get_my_open_protocol(request: Request, auth_data: dict = Depends(get_logged_
 
 
 @app.post("/chat/send-message")
-def send_chat_message(dados: ChatMessage, request: Request, auth_data: dict = Depends(get_logged_user)):
+def send_chat_message(dados: ChatMessage, auth_data: dict = Depends(get_logged_user)):
     """Envia uma mensagem. Cria um protocolo se não existir."""
     try:
-        role = request.session.get("role")
-
         # Se vier um ID de protocolo (resposta do dev ou continuação), usa ele
         if dados.protocolo_id:
             return save_chat_message(dados.protocolo_id, auth_data["user"], dados.texto, auth_data["empresa_id"])
@@ -568,19 +872,12 @@ def send_chat_message(dados: ChatMessage, request: Request, auth_data: dict = De
 
 
 @app.get("/chat/protocols")
-def get_all_protocols(request: Request, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['dev', 'admin']:
-        raise HTTPException(status_code=403, detail="Acesso negado.")
+def get_all_protocols(auth_data: dict = Depends(somente_admin)):
     return list_protocols()
 
 
 @app.get("/chat/protocols/{protocol_id}")
-def get_protocol_messages(protocol_id: int, request: Request, auth_data: dict = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ['dev', 'admin']:
-        raise HTTPException(status_code=403, detail="Acesso negado.")
-
+def get_protocol_messages(protocol_id: int, auth_data: dict = Depends(somente_admin)):
     messages = get_messages_by_protocol(protocol_id, auth_data["empresa_id"])
 
     proto = get_protocol_by_id(protocol_id, auth_data["empresa_id"])
@@ -590,14 +887,9 @@ def get_protocol_messages(protocol_id: int, request: Request, auth_data: dict =
 
 
 @app.post("/chat/protocol/{protocol_id}/close")
-def close_protocol_endpoint(protocol_id: int, request: Request, auth_data: dict = Depends(get_logged_user)):
+def close_protocol_endpoint(protocol_id: int, auth_data: dict = Depends(
+        exigir_papel("dev", "admin", "gerente", detalhe="Apenas suporte pode encerrar."))):
     """Encerra o atendimento e solicita avaliação (Apenas Admin/Dev)."""
-    role = request.session.get("role")
-    # Garante que cliente não possa encerrar
-    if role not in ['dev', 'admin', 'gerente']:
-        raise HTTPException(
-            status_code=403, detail="Apenas suporte pode encerrar.")
-
     update_protocol_status(protocol_id, 'avaliando', auth_data["empresa_id"])
     return {"status": "Protocolo enviado para avaliação"}
 
@@ -611,65 +903,130 @@ def rate_protocol_endpoint(protocol_id: int, dados: dict, request: Request, auth
 
 
 @app.post("/chat/protocols/bulk-close")
-def bulk_close_endpoint(dados: BulkCloseRequest, request: Request, auth_data: dict = Depends(get_logged_user)):
+def bulk_close_endpoint(dados: BulkCloseRequest, auth_data: dict = Depends(somente_admin)):
     """Encerra múltiplos protocolos selecionados (Brute-force)."""
-    role = request.session.get("role")
-    if role not in ['dev', 'admin']:
-        raise HTTPException(status_code=403, detail="Acesso negado.")
-
     result = close_protocols_bulk(dados.ids, auth_data["empresa_id"])
     return {"status": f"{result['count']} protocolos encerrados."}
 
 
 # --- Rotas de Arquivos (Nuvem) ---
 
+class SessaoUploadModel(BaseModel):
+    nome: str
+    tamanho: int
+
+
+def _erro_upload(e):
+    headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else None
+    return HTTPException(status_code=e.status, detail=str(e), headers=headers)
+
+
 @app.post("/api/arquivos/upload")
 async def upload_arquivo(file: UploadFile = File(...), auth_data: dict = Depends(get_logged_user)):
+    """Upload de uma vez (multipart). Para arquivos grandes ou conexão instável use as sessões abaixo."""
     try:
         # Gera nome único para não sobrescrever
         filename = file.filename or "unknown"
         extensao = os.path.splitext(filename)[1]
         nome_fisico = f"{uuid.uuid4()}{extensao}"
-        caminho_completo = os.path.join("uploads", nome_fisico)
-
-        # Salva no disco
-        with open(caminho_completo, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # Calcula tamanho legível
-        tamanho_bytes = os.path.getsize(caminho_completo)
-        if tamanho_bytes < 1024:
-            tamanho_str = f"{tamanho_bytes} B"
-        elif tamanho_bytes < 1024 * 1024:
-            tamanho_str = f"{round(tamanho_bytes/1024, 1)} KB"
-        else:
-            tamanho_str = f"{round(tamanho_bytes/(1024*1024), 1)} MB"
 
-        salvar_arquivo_db(file.filename, nome_fisico, tamanho_str, auth_data["user"], auth_data["empresa_id"])
-        registrar_log(auth_data["user"], "UPLOAD ARQUIVO", auth_data["empresa_id"], f"Arquivo: {file.filename}")
+        # Salva no disco (cópia feita numa thread de IO, fora do event loop), com limite de tamanho
+        tamanho_bytes, sha256 = await executar_io(salvar_upload_inteiro, file.file, nome_fisico)
+
+        await executar_io(salvar_arquivo_db, file.filename, nome_fisico, formatar_tamanho(tamanho_bytes),
+                          auth_data["user"], auth_data["empresa_id"], tamanho_bytes, sha256)
+        await executar_io(registrar_log, auth_data["user"], "UPLOAD ARQUIVO", auth_data["empresa_id"],
+                          f"Arquivo: {file.filename}")
 
         return {"status": "Upload realizado com sucesso!"}
     except Exception as e:
         return {"erro": str(e)}
 
 
+# Upload em blocos com retomada (ver transferencias.py)
+
+@app.post("/api/arquivos/upload/sessoes")
+def api_criar_sessao_upload(dados: SessaoUploadModel, auth_data: dict = Depends(get_logged_user)):
+    try:
+        return criar_sessao(dados.nome, dados.tamanho, auth_data["user"], auth_data["empresa_id"])
+    except ErroUpload as e:
+        raise _erro_upload(e)
+
+
+@app.get("/api/arquivos/upload/sessoes/{sessao_id}")
+def api_obter_sessao_upload(sessao_id: str, auth_data: dict = Depends(get_logged_user)):
+    """Até onde o servidor já gravou (offset): o cliente retoma dali."""
+    sessao = obter_sessao(sessao_id, auth_data["empresa_id"])
+    if not sessao:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada ou expirada.")
+    return sessao
+
+
+async def _ler_bloco(request):
+    """Corpo da requisição, recusando (413) blocos acima de MAX_TAMANHO_BLOCO sem ler tudo."""
+    if int(request.headers.get("content-length") or 0) > MAX_TAMANHO_BLOCO:
+        raise HTTPException(status_code=413, detail="Bloco maior que o permitido.")
+    partes, total = [], 0
+    async for parte in request.stream():
+        total += len(parte)
+        if total > MAX_TAMANHO_BLOCO:
+            raise HTTPException(status_code=413, detail="Bloco maior que o permitido.")
+        partes.append(parte)
+    return b"".join(partes)
+
+
+@app.put("/api/arquivos/upload/sessoes/{sessao_id}")
+async def api_enviar_bloco(sessao_id: str, offset: int, request: Request,
+                           auth_data: dict = Depends(get_logged_user)):
+    """Corpo = bytes do bloco; cabeçalho X-Bloco-Crc32 = CRC32 do bloco em hexadecimal."""
+    try:
+        crc32 = int(request.headers.get("x-bloco-crc32", ""), 16)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cabeçalho X-Bloco-Crc32 ausente ou inválido.")
+    dados = await _ler_bloco(request)
+    try:
+        resultado = await executar_io(gravar_bloco, sessao_id, offset, dados, crc32,
+                                      auth_data["user"], auth_data["empresa_id"])
+    except ErroUpload as e:
+        raise _erro_upload(e)
+    if "arquivo_id" in resultado:
+        await executar_io(registrar_log, auth_data["user"], "UPLOAD ARQUIVO", auth_data["empresa_id"],
+                          f"Arquivo ID: {resultado['arquivo_id']} (em blocos)")
+    return resultado
+
+
+@app.delete("/api/arquivos/upload/sessoes/{sessao_id}")
+def api_cancelar_sessao_upload(sessao_id: str, auth_data: dict = Depends(get_logged_user)):
+    return cancelar_sessao(sessao_id, auth_data["empresa_id"])
+
+
 @app.get("/api/arquivos")
 def api_listar_arquivos(auth_data: dict = Depends(get_logged_user)):
     return listar_arquivos_db(auth_data["empresa_id"])
 
 
 @app.get("/api/arquivos/download/{arquivo_id}")
-def download_arquivo(arquivo_id: int, auth_data: dict = Depends(get_logged_user)):
+def download_arquivo(arquivo_id: int, request: Request, auth_data: dict = Depends(get_logged_user)):
     arquivo = get_arquivo_por_id(arquivo_id, auth_data["empresa_id"])
     if not arquivo:
         raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    return _resposta_download(arquivo, request)
 
+
+def _resposta_download(arquivo, request):
     caminho = os.path.join("uploads", arquivo['caminho_salvo'])
     if not os.path.exists(caminho):
         raise HTTPException(
             status_code=404, detail="Arquivo físico não encontrado no servidor")
 
-    return FileResponse(caminho, filename=arquivo['nome_original'])
+    # ETag pelo conteúdo (arquivos antigos, sem sha256, ficam com o ETag do FileResponse).
+    # O FileResponse atende Range/If-Range: download interrompido continua de onde parou.
+    headers = {"Cache-Control": "private, no-cache"}
+    if arquivo['sha256']:
+        headers["ETag"] = f'"{arquivo["sha256"]}"'
+        if _etag_confere(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+    return FileResponse(caminho, filename=arquivo['nome_original'], headers=headers)
 
 
 @app.delete("/api/arquivos/{arquivo_id}")
@@ -688,6 +1045,79 @@ def delete_arquivo(arquivo_id: int, request: Request, auth_data: dict = Depends(
     return {"status": "Arquivo excluído"}
 
 
+@app.get("/chat/stream")
+async def chat_stream(request: Request, last_id: Optional[int] = None,
+                      auth_data: dict = Depends(get_logged_user)):
+    """Canal de chat em tempo real (Server-Sent Events).
+
+    Clientes recebem só as mensagens/mudanças de status dos próprios
+    protocolos; dev/admin recebem todos (painel de suporte). O id de cada
+    evento `mensagem` é o id da mensagem no banco, então ao reconectar
+    (Last-Event-ID ou ?last_id=) o que foi perdido vem direto do banco.
+    """
+    user, empresa_id = auth_data["user"], auth_data["empresa_id"]
+    suporte = auth_data["role"] in ['dev', 'admin']
+    topico = TOPICO_CHAT_SUPORTE if suporte else topico_chat(empresa_id)
+    header_id = request.headers.get("last-event-id", "")
+    if header_id.isdigit():
+        last_id = int(header_id)
+
+    def visivel(dados):
+        return suporte or dados.get("usuario_cliente") == user
+
+    def pendentes_do_banco(desde):
+        if suporte:
+            return listar_mensagens_desde(desde)
+        return listar_mensagens_desde(desde, empresa_id, user)
+
+    async def gerar():
+        yield "retry: 3000\n\n"
+        # O piso vem do banco antes do cursor do barramento, e a recuperação pelo banco
+        # roda logo depois: uma mensagem gravada entre as duas leituras sai pelo banco
+        # e, se chegar também pelo barramento, é descartada pelo id
+        piso_cliente = last_id or 0
+        ultima_msg = last_id if last_id is not None else await asyncio.to_thread(get_global_last_message_id)
+        cursor_bus = barramento.ultimo_id()
+        recuperar = True
+        enviadas = set()  # ids enviados pela recuperação que ainda podem vir pelo barramento
+        while True:
+            if recuperar:
+                enviadas = set()
+                for msg in await asyncio.to_thread(pendentes_do_banco, ultima_msg):
+                    yield formatar_sse(msg["id"], "mensagem", msg)
+                    enviadas.add(msg["id"])
+                    ultima_msg = max(ultima_msg, msg["id"])
+                recuperar = False
+            if await request.is_disconnected():
+                break
+            eventos = await barramento.aguardar(topico, cursor_bus, timeout=15)
+            if eventos is None:
+                # Buffer do barramento estourou: recupera pelo banco
+                cursor_bus = barramento.ultimo_id()
+                recuperar = True
+                continue
+            if not eventos:
+                yield ": ping\n\n"
+                continue
+            for evento_id, tipo, dados in eventos:
+                cursor_bus = evento_id
+                if not visivel(dados):
+                    continue
+                if tipo == "mensagem":
+                    if dados["id"] in enviadas or dados["id"] <= piso_cliente:
+                        enviadas.discard(dados["id"])
+                        continue  # já enviada na recuperação pelo banco (ou antes da reconexão)
+                    ultima_msg = max(ultima_msg, dados["id"])
+                    yield formatar_sse(dados["id"], tipo, dados)
+                else:
+                    yield formatar_sse(None, tipo, dados)
+
+    return StreamingResponse(gerar(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
 @app.get("/chat/last-message-id")
 def get_last_msg_id(user: str = Depends(get_logged_user)):
     """Retorna o ID da última mensagem para notificação."""
@@ -702,35 +1132,44 @@ def get_my_protocol_history(request: Request, auth_data: dict = Depends(get_logg
 # --- Rotas de Layout Dinâmico (Apenas DEV) ---
 
 
+def _etag_confere(request: Request, etag: str):
+    """O navegador já tem essa versão (If-None-Match)?"""
+    enviados = request.headers.get("if-none-match", "")
+    return etag in (e.strip().removeprefix("W/") for e in enviados.split(","))
+
+
+def _resposta_com_etag(request: Request, etag: str, conteudo):
+    """JSON com ETag; 304 sem corpo se o navegador já tem essa versão (If-None-Match)."""
+    # no-cache: o navegador guarda, mas sempre revalida (a resposta 304 é quase de graça)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_confere(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(conteudo, headers=headers)
+
+
 @app.get("/config/css")
-def get_custom_css():
+def get_custom_css(request: Request):
     # Aberto para todos lerem (para o cliente ver o design novo)
-    return {"css": ler_css_personalizado()}
+    config = cache_config.obter()
+    return _resposta_com_etag(request, config.etag_css, {"css": config.css})
 
 
 @app.post("/config/css")
-def post_custom_css(dados: CssModel, request: Request, user: str = Depends(get_logged_user)):
-    # Apenas o DEV pode salvar alterações de layout
-    role = request.session.get("role")
-    if role != 'dev':
-        raise HTTPException(
-            status_code=403, detail="Apenas o desenvolvedor pode alterar o layout do sistema.")
+def post_custom_css(dados: CssModel, user: str = Depends(
+        exigir_papel("dev", detalhe="Apenas o desenvolvedor pode alterar o layout do sistema."))):
     return salvar_css_personalizado(dados.css)
 
 # --- Rotas de Configuração Visual (No-Code) ---
 
 
 @app.get("/config/visual")
-def get_visual_config():
-    return ler_config_visual()
+def get_visual_config(request: Request):
+    config = cache_config.obter()
+    return _resposta_com_etag(request, config.etag_visual, config.visual)
 
 
 @app.post("/config/visual")
-def post_visual_config(dados: VisualConfigModel, request: Request, user: str = Depends(get_logged_user)):
-    # Apenas DEV pode salvar
-    role = request.session.get("role")
-    if role != 'dev':
-        raise HTTPException(status_code=403, detail="Acesso negado.")
+def post_visual_config(dados: VisualConfigModel, user: str = Depends(somente_dev)):
     return salvar_config_visual(dados.config)
 
 # --- Rotas de Versionamento do App (Apenas DEV) ---
@@ -742,53 +1181,31 @@ def app_version():
 
 
 @app.post("/dev/publish-update")
-def publish_update(dados: AppVersionModel, request: Request, user: str = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role != 'dev':
-        raise HTTPException(
-            status_code=403, detail="Apenas o desenvolvedor pode publicar atualizações.")
+def publish_update(dados: AppVersionModel, user: str = Depends(
+        exigir_papel("dev", detalhe="Apenas o desenvolvedor pode publicar atualizações."))):
     return set_app_version(dados.version, dados.changelog)
 
 # --- Rota de Backup Manual ---
 
 @app.post("/system/backup-now")
-def trigger_manual_backup(auth_data: dict = Depends(get_logged_user)):
-    """Força a criação de um backup agora."""
-    role = get_usuario(auth_data["user"], auth_data["empresa_id"])['role']
-    if role not in ['admin', 'dev']:
-        raise HTTPException(status_code=403, detail="Acesso negado.")
-    
+def trigger_manual_backup(auth_data: dict = Depends(somente_admin)):
+    """Enfileira um backup agora; acompanhe por /api/jobs/{job_id}."""
     registrar_log(auth_data["user"], "BACKUP MANUAL", auth_data["empresa_id"], "Solicitou backup completo do sistema.")
-    return criar_backup_sistema()
+    job = fila_jobs.enfileirar("backup", auth_data["empresa_id"], auth_data["user"])
+    return {"status": "Backup iniciado.", "job_id": job["id"]}
 
 # --- Rota de Auto-Atualização (Git Pull) ---
 
 
 @app.post("/system/git-pull")
-def git_pull_system(user: str = Depends(get_logged_user)):
-    """Executa um reset forçado para atualizar o código com a versão do GitHub."""
-    try:
-        # 1. Busca as últimas informações do repositório remoto.
-        subprocess.check_output(
-            ["git", "fetch"], shell=True, stderr=subprocess.STDOUT)
-
-        # 2. Tenta fazer o reset para o branch 'main'.
-        result = subprocess.check_output(
-            ["git", "reset", "--hard", "origin/main"], shell=True, stderr=subprocess.STDOUT)
-        log_message = result.decode('utf-8')
-        return {"status": "Sistema atualizado com sucesso!", "log": log_message}
-    except subprocess.CalledProcessError as e:
-        # Se falhar com 'main', tenta com 'master' como alternativa.
-        try:
-            result = subprocess.check_output(
-                ["git", "reset", "--hard", "origin/master"], shell=True, stderr=subprocess.STDOUT)
-            log_message = result.decode('utf-8')
-            return {"status": "Sistema atualizado com sucesso (usando branch 'master')!", "log": log_message}
-        except subprocess.CalledProcessError as e2:
-            error_output = e2.output.decode('utf-8')
-            return {"erro": f"Falha ao atualizar. Não foi possível encontrar 'origin/main' ou 'origin/master'. Detalhes: {error_output}"}
-    except Exception as e:
-        return {"erro": f"Erro inesperado durante a atualização: {str(e)}"}
+def git_pull_system(auth_data: dict = Depends(somente_admin)):
+    """Enfileira a atualização do código com a versão do GitHub (ver jobs_admin.job_git_pull)."""
+    job = job_em_andamento("git_pull", auth_data["empresa_id"])
+    if job:
+        return {"status": "Já existe uma atualização em andamento.", "job_id": job["id"]}
+    registrar_log(auth_data["user"], "ATUALIZAR SISTEMA", auth_data["empresa_id"], "Solicitou git pull.")
+    job = fila_jobs.enfileirar("git_pull", auth_data["empresa_id"], auth_data["user"])
+    return {"status": "Atualização iniciada.", "job_id": job["id"]}
 
 # --- Rota do Painel do Desenvolvedor ---
 
@@ -807,21 +1224,51 @@ def dev_panel(request: Request, user: str = Depends(get_current_user)):
 
 
 @app.post("/dev/sql")
-def run_sql(dados: SqlQuery, request: Request, user: str = Depends(get_logged_user)):
-    role = request.session.get("role")
-    if role not in ["admin", "dev"]:
-        raise HTTPException(
-            status_code=403, detail="Acesso negado. Apenas admin.")
+def run_sql(dados: SqlQuery, user: str = Depends(
+        exigir_papel("admin", "dev", detalhe="Acesso negado. Apenas admin."))):
     return executar_sql_raw(dados.query)
 
 
+@app.get("/dev/db-stats")
+def db_pool_stats(user: str = Depends(somente_admin)):
+    """Contadores do pool de conexões (checkouts, esperas e retentativas por banco ocupado)."""
+    return estatisticas_pool()
+
+
+@app.get("/dev/executor-stats")
+def executor_stats(user: str = Depends(somente_admin)):
+    """Profundidade de fila e tempos dos pools de IO (threads) e CPU (processos)."""
+    return estatisticas_executores()
+
+
+@app.get("/dev/audit-stats")
+def audit_stats(user: str = Depends(somente_admin)):
+    """Contadores da fila de auditoria (pendentes, lotes gravados, esperas por fila cheia)."""
+    return fila_auditoria.estatisticas()
+
+
+@app.get("/dev/auth-cache-stats")
+def auth_cache_stats(user: str = Depends(somente_admin)):
+    """Acertos/faltas do cache de usuários e empresas usado no login e na autorização."""
+    return cache_usuarios.estatisticas()
+
+
+@app.post("/dev/senhas/recalibrar")
+def recalibrar_custo_senhas(auth_data: dict = Depends(somente_admin)):
+    """Mede o bcrypt de novo (ex.: depois de trocar o servidor) e grava o custo novo.
+
+    Hashes com custo menor sobem no próximo login; os de custo maior ficam como estão.
+    """
+    anterior = custo_atual()
+    custo = calibrar(recalibrar=True)
+    registrar_log(auth_data["user"], "RECALIBRAR SENHAS", auth_data["empresa_id"],
+                  f"Custo do bcrypt: {anterior} -> {custo}")
+    return {"status": "Custo recalibrado.", "custo_anterior": anterior, "custo": custo}
+
+
 @app.post("/dev/clear-visual-config")
-def clear_visual_config(request: Request, auth_data: dict = Depends(get_logged_user)):
+def clear_visual_config(auth_data: dict = Depends(somente_dev)):
     """Limpa as configurações salvas pelo editor visual (no-code)."""
-    role = request.session.get("role")
-    if role != 'dev':
-        raise HTTPException(status_code=403, detail="Acesso negado.")
-
     salvar_config_visual({})  # Salva um objeto JSON vazio, efetivamente limpando.
     registrar_log(auth_data["user"], "RESET VISUAL", auth_data["empresa_id"],
                   "Limpou as configurações visuais (no-code).")
@@ -847,6 +1294,48 @@ def monitor_panel(request: Request):
     response.headers["Expires"] = "0"
     return response
 
+# --- Rotas das Câmeras (ingestão automática) ---
+
+
+@app.get("/api/cameras")
+def api_listar_cameras(auth_data: dict = Depends(somente_admin)):
+    return listar_cameras(auth_data["empresa_id"])
+
+
+@app.get("/api/cameras/status")
+def api_status_cameras(auth_data: dict = Depends(somente_admin)):
+    """Situação dos processos de leitura (quadros lidos/descartados, leituras, eventos registrados)."""
+    return servico_cameras.estatisticas(auth_data["empresa_id"])
+
+
+def _salvar_camera(dados, auth_data, camera_id=None):
+    res = salvar_camera(auth_data["empresa_id"], dados.nome, dados.url, dados.direcao, dados.tipo,
+                        dados.ativa, camera_id)
+    if "status" in res:
+        servico_cameras.recarregar()
+        registrar_log(auth_data["user"], "CÂMERA SALVA", auth_data["empresa_id"],
+                      f"Câmera: {dados.nome} ({dados.direcao})")
+    return res
+
+
+@app.post("/api/cameras")
+def api_criar_camera(dados: CameraModel, auth_data: dict = Depends(somente_admin)):
+    return _salvar_camera(dados, auth_data)
+
+
+@app.put("/api/cameras/{camera_id}")
+def api_atualizar_camera(camera_id: int, dados: CameraModel, auth_data: dict = Depends(somente_admin)):
+    return _salvar_camera(dados, auth_data, camera_id)
+
+
+@app.delete("/api/cameras/{camera_id}")
+def api_excluir_camera(camera_id: int, auth_data: dict = Depends(somente_admin)):
+    res = excluir_camera(camera_id, auth_data["empresa_id"])
+    if "status" in res:
+        servico_cameras.recarregar()
+        registrar_log(auth_data["user"], "CÂMERA EXCLUÍDA", auth_data["empresa_id"], f"Câmera ID: {camera_id}")
+    return res
+
 # --- Rota do Scanner (Vigilante) ---
 @app.get("/scanner")
 def scanner_interface(request: Request):
@@ -856,96 +1345,59 @@ def scanner_interface(request: Request):
     return FileResponse("scanner.html")
 
 
-# Variável global para controlar a frequência de salvamento no banco (evitar spam)
-# LAST_DB_SAVE = 0 # REMOVIDO: A tarefa de fundo agora controla isso.
-LAST_NET_IO = None
-LAST_NET_TIME = None
-
-
 @app.get("/api/monitor/history")
 def api_monitor_history(date: str, user: str = Depends(get_logged_user)):
     """Retorna o histórico de performance para uma data específica (YYYY-MM-DD)."""
-    return obter_historico_performance(date)
+    try:
+        return obter_historico_performance(date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida (use AAAA-MM-DD).")
+
+
+@app.get("/api/monitor/series")
+def api_monitor_series(inicio: Optional[int] = None, fim: Optional[int] = None, pontos: int = 300,
+                       resolucao: Optional[int] = None, user: str = Depends(get_logged_user)):
+    """Série de CPU/RAM/disco/ping (min/avg/max) entre inicio e fim (epoch, padrão: últimas 24h).
+
+    A resolução (60, 3600 ou 86400 s) é escolhida pelo tamanho da janela para
+    caber em `pontos` pontos, a menos que seja informada.
+    """
+    fim = fim if fim is not None else int(time.time())
+    inicio = inicio if inicio is not None else fim - 86400
+    try:
+        return consultar_serie(inicio, fim, max(10, min(pontos, 2000)), resolucao)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/api/monitor/history/clear")
-def api_clear_monitor_history(user: str = Depends(get_logged_user)):
+def api_clear_monitor_history(user: str = Depends(
+        exigir_papel("admin", "dev", detalhe="Apenas admin/dev pode limpar histórico."))):
     """Limpa o histórico de performance."""
-    role = get_usuario(user)['role']
-    if role not in ['admin', 'dev']:
-        raise HTTPException(
-            status_code=403, detail="Apenas admin/dev pode limpar histórico.")
     return limpar_historico_performance()
 
 
 @app.get("/api/server-status")
 def api_server_status(user: str = Depends(get_logged_user)):
-    global LAST_NET_IO, LAST_NET_TIME
+    """Última amostra do coletor de status (ver monitoramento.py); não faz coleta na requisição."""
     # Calcula tempo de atividade (Uptime)
     now = datetime.now()
     uptime = now - START_TIME
 
-    # Dados do sistema
-    health = get_system_health()
-
-    # Medir Ping do Railway (Backend side)
-    ping_railway = 0
-    try:
-        start = time.time()
-        # Tenta conectar na raiz ou em um endpoint leve
-        urllib.request.urlopen(
-            "https://projeto-sistema-de-veiculos-production.up.railway.app/app-version", timeout=2)
-        ping_railway = int((time.time() - start) * 1000)
-    except:
-        ping_railway = 0  # Offline ou timeout
-
-    # --- Novos Recursos: Rede e Processos ---
-    upload_speed = 0
-    download_speed = 0
-    top_processes = []
-
-    # Verifica se psutil está disponível (importado no topo ou services)
-    # Como services.py importa psutil, podemos tentar usar aqui se estiver no escopo ou reimportar
-    try:
-        import psutil
-        # Cálculo de Velocidade de Rede
-        net_io = psutil.net_io_counters()
-        current_time = time.time()
-        if LAST_NET_IO and LAST_NET_TIME:
-            time_delta = current_time - LAST_NET_TIME
-            if time_delta > 0:
-                upload_speed = (net_io.bytes_sent -
-                                LAST_NET_IO.bytes_sent) / time_delta
-                download_speed = (net_io.bytes_recv -
-                                  LAST_NET_IO.bytes_recv) / time_delta
-        LAST_NET_IO = net_io
-        LAST_NET_TIME = current_time
-
-        # Top 5 Processos por Memória
-        for proc in psutil.process_iter(['pid', 'name', 'memory_percent']):
-            try:
-                top_processes.append(proc.info)
-            except:
-                pass
-        top_processes = sorted(
-            top_processes, key=lambda p: p['memory_percent'], reverse=True)[:5]
-    except:
-        pass
-
-    # O bloco de salvamento de histórico foi removido daqui e movido para a tarefa
-    # em segundo plano (log_performance_periodically) para garantir coleta contínua.
+    amostra = coletor_status.ultima_amostra() or coletor_status.coletar()
     return {
         "uptime": str(uptime).split('.')[0],  # Remove milissegundos
-        "db_size": f"{health['db_size_mb']} MB",
-        "db_status": health['db_status'],
+        "db_size": f"{amostra['db_size_mb']} MB",
+        "db_status": amostra['db_status'],
         "server_time": now.strftime("%H:%M:%S"),
-        "cpu_usage": health.get("cpu_usage", 0),
-        "ram_usage": health.get("ram_usage", 0),
-        "disk_usage": health.get("disk_usage", 0),
-        "railway_ping_backend": ping_railway,
-        "net_upload_kb": round(upload_speed / 1024, 1),
-        "net_download_kb": round(download_speed / 1024, 1),
-        "top_processes": top_processes
+        "sample_time": datetime.fromtimestamp(amostra["ts"]).strftime("%H:%M:%S"),
+        "cpu_usage": amostra["cpu_usage"],
+        "ram_usage": amostra["ram_usage"],
+        "disk_usage": amostra["disk_usage"],
+        "railway_ping_backend": amostra["railway_ping_backend"],
+        "net_upload_kb": amostra["net_upload_kb"],
+        "net_download_kb": amostra["net_download_kb"],
+        "top_processes": amostra["top_processes"]
     }
 
 
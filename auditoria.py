@@ -0,0 +1,182 @@
+# auditoria.py
+"""Fila de gravação do histórico de ações (historico_acoes).
+
+registrar_log só enfileira o registro; uma thread grava em lote (uma
+transação a cada INTERVALO_MS ou TAMANHO_LOTE registros), então entrada/saída
+de veículos não pagam um commit extra só pela auditoria.
+
+- Buffer limitado: com a fila cheia quem registra espera (backpressure) e,
+  se ainda assim não houver espaço, grava direto, sem perder o registro.
+  Por isso registrar() pode bloquear: rotas async chamam registrar_log por
+  executores.executar_io, nunca direto no event loop.
+- Lote que falha (banco travado, disco cheio) volta para o começo da fila,
+  na ordem, e é tentado de novo com espera crescente (até MAX_ESPERA_FALHA_S).
+  Nada é descartado; enquanto o banco não volta a fila pode passar de
+  MAX_PENDENTES (a gravação direta que falha também enfileira).
+- `descarregar()` garante que tudo o que foi enfileirado já está no banco
+  (usado antes de ler o histórico e no shutdown).
+- Modo síncrono (AUDITORIA_SINCRONA=1 ou configurar(sincrono=True)) grava
+  na hora, para testes e scripts.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+from db import get_db_connection
+
+INTERVALO_MS = 200
+TAMANHO_LOTE = 200
+MAX_PENDENTES = 10000
+ESPERA_BACKPRESSURE_S = 2
+MAX_ESPERA_FALHA_S = 30
+
+_SQL_INSERT = """
+    INSERT INTO historico_acoes (usuario, acao, detalhes, data_hora, empresa_id, data_ts)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+class FilaAuditoria:
+    def __init__(self, sincrono=False):
+        self.sincrono = sincrono
+        self._cond = threading.Condition()
+        self._pendentes = deque()
+        # Registros retirados da fila e ainda não confirmados no banco
+        self._gravando = 0
+        self._thread = None
+        self._pid = None
+        self._parar = False
+        self._stats = {
+            "enfileirados": 0,
+            "gravados": 0,
+            "lotes": 0,
+            "esperas_backpressure": 0,
+            "gravacoes_diretas": 0,
+            "lotes_com_falha": 0,
+        }
+
+    def _garantir_thread(self):
+        # Após um fork (pool de processos) a thread de gravação não existe no filho
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._parar = False
+            self._thread = threading.Thread(target=self._loop, name="auditoria", daemon=True)
+            self._thread.start()
+
+    def registrar(self, registro):
+        """Enfileira (usuario, acao, detalhes, data_hora, empresa_id, data_ts).
+
+        Pode esperar até ESPERA_BACKPRESSURE_S e gravar no banco: não chamar do event loop.
+        """
+        if self.sincrono:
+            self._gravar([registro])
+            return
+        with self._cond:
+            self._garantir_thread()
+            if len(self._pendentes) >= MAX_PENDENTES:
+                self._stats["esperas_backpressure"] += 1
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: len(self._pendentes) < MAX_PENDENTES,
+                                    ESPERA_BACKPRESSURE_S)
+            if len(self._pendentes) < MAX_PENDENTES:
+                self._pendentes.append(registro)
+                self._stats["enfileirados"] += 1
+                if len(self._pendentes) >= TAMANHO_LOTE:
+                    self._cond.notify_all()
+                return
+            self._stats["gravacoes_diretas"] += 1
+        # O gravador não deu conta a tempo: grava este registro aqui mesmo
+        try:
+            self._gravar([registro])
+        except Exception as e:
+            # Banco indisponível: fica na fila (acima do limite) até o gravador conseguir
+            print(f"Erro ao salvar log (registro mantido na fila): {e}")
+            with self._cond:
+                self._pendentes.append(registro)
+                self._stats["enfileirados"] += 1
+
+    def _gravar(self, lote):
+        with get_db_connection() as conn:
+            conn.executemany(_SQL_INSERT, lote)
+
+    def _loop(self):
+        intervalo = INTERVALO_MS / 1000
+        falhas = 0
+        while True:
+            with self._cond:
+                if not self._parar and len(self._pendentes) < TAMANHO_LOTE:
+                    self._cond.wait(intervalo)
+                if not self._pendentes:
+                    if self._parar:
+                        return
+                    continue
+                lote = [self._pendentes.popleft()
+                        for _ in range(min(TAMANHO_LOTE, len(self._pendentes)))]
+                self._gravando = len(lote)
+                self._cond.notify_all()  # libera quem esperava espaço
+
+            try:
+                self._gravar(lote)
+                gravado = True
+            except Exception as e:
+                gravado = False
+                falhas += 1
+                print(f"Erro ao salvar log (falha {falhas}; {len(lote)} registros voltam para a fila): {e}")
+
+            with self._cond:
+                self._gravando = 0
+                if gravado:
+                    self._stats["gravados"] += len(lote)
+                    self._stats["lotes"] += 1
+                else:
+                    # Volta para o começo da fila, na ordem original
+                    self._pendentes.extendleft(reversed(lote))
+                    self._stats["lotes_com_falha"] += 1
+                self._cond.notify_all()
+            if gravado:
+                falhas = 0
+            else:
+                time.sleep(min(intervalo * 2 ** (falhas - 1), MAX_ESPERA_FALHA_S))
+
+    def descarregar(self, timeout=10):
+        """Espera até que tudo o que foi enfileirado esteja gravado."""
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                return True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._pendentes and not self._gravando, timeout)
+
+    def encerrar(self, timeout=10):
+        """Grava o que falta e para a thread (shutdown do servidor)."""
+        with self._cond:
+            thread = self._thread
+            if thread is None or self._pid != os.getpid():
+                return
+            self._parar = True
+            self._cond.notify_all()
+        thread.join(timeout)
+        with self._cond:
+            self._thread = None
+            if self._pendentes or self._gravando:
+                print(f"AVISO: {len(self._pendentes) + self._gravando} registros de auditoria não gravados "
+                      "(banco indisponível no encerramento).")
+
+    def estatisticas(self):
+        with self._cond:
+            dados = dict(self._stats)
+            dados["pendentes"] = len(self._pendentes) + self._gravando
+        dados["sincrono"] = self.sincrono
+        return dados
+
+
+fila_auditoria = FilaAuditoria(sincrono=os.getenv("AUDITORIA_SINCRONA") == "1")
+atexit.register(fila_auditoria.encerrar)
+
+
+def configurar(sincrono):
+    """Liga/desliga o modo síncrono (grava tudo o que estava pendente antes)."""
+    fila_auditoria.descarregar()
+    fila_auditoria.sincrono = sincrono
@@ -0,0 +1,58 @@
+# autorizacao.py
+"""Dependências de autenticação e de papel para as rotas da API.
+
+get_logged_user confere a sessão contra o registro do usuário no cache de
+autenticação (cache_usuarios.py): o papel vem do banco, não do cookie, então
+uma troca de papel ou exclusão vale já na próxima requisição, sem consulta ao
+banco por requisição.
+
+As rotas declaram o papel exigido em vez de repetir o if/raise:
+
+    @app.get("/dev/db-stats")
+    def db_pool_stats(auth_data: dict = Depends(somente_admin)):
+        ...
+"""
+from fastapi import Depends, HTTPException, Request
+
+from cache_usuarios import cache_usuarios
+
+
+def get_logged_user(request: Request):
+    """Dependência para exigir login: {"user", "empresa_id", "role"} do usuário da sessão."""
+    user = request.session.get("user")
+    if not user:
+        raise HTTPException(
+            status_code=401, detail="Você precisa estar logado para realizar esta ação.")
+
+    empresa_id = request.session.get("empresa_id")
+    if not empresa_id:
+        raise HTTPException(
+            status_code=401, detail="Sessão inválida. Empresa não identificada.")
+
+    registro = cache_usuarios.usuario(user, empresa_id)
+    if not registro:
+        # Usuário excluído ou renomeado depois do login
+        request.session.clear()
+        raise HTTPException(status_code=401, detail="Sessão expirada. Faça login novamente.")
+
+    # Mantém a sessão em dia para as páginas que leem o papel direto dela (/app, /dev, /monitor)
+    if request.session.get("role") != registro["role"]:
+        request.session["role"] = registro["role"]
+    return {"user": user, "empresa_id": empresa_id, "role": registro["role"]}
+
+
+def exigir_papel(*papeis, detalhe="Acesso negado."):
+    """Dependência que exige login e um dos papéis informados (403 com `detalhe` se não)."""
+    def verificar(auth_data: dict = Depends(get_logged_user)):
+        if auth_data["role"] not in papeis:
+            raise HTTPException(status_code=403, detail=detalhe)
+        return auth_data
+    return verificar
+
+
+PAPEIS_ADMIN = ("admin", "dev")
+PAPEIS_GERENCIA = ("gerente", "admin", "dev")
+
+somente_admin = exigir_papel(*PAPEIS_ADMIN)
+somente_gerencia = exigir_papel(*PAPEIS_GERENCIA)
+somente_dev = exigir_papel("dev")
@@ -0,0 +1,347 @@
+# backup.py
+"""Backup incremental do sistema (código, planilhas e banco).
+
+Em vez de compactar o projeto inteiro num ZIP a cada execução, os arquivos
+são quebrados em blocos e cada bloco é guardado uma única vez, pelo hash
+(armazenamento endereçado por conteúdo):
+
+    backups/loja/objetos/ab/abcdef...   blocos comprimidos (zlib)
+    backups/loja/snapshots/<id>.json    manifesto: arquivo -> lista de blocos
+    backups/loja/indice.json            cache (mtime, tamanho) -> blocos
+
+Arquivos com mesmo mtime/tamanho do último backup nem são lidos; o banco é
+copiado de forma consistente com a API de backup do SQLite (nunca o arquivo
+.db ao vivo) e só quando mudou. Assim o custo acompanha o que mudou.
+
+Os ZIPs do formato anterior (backups/backup_auto_<data>.zip) entram na mesma
+retenção dos snapshots e são apagados conforme saem das janelas.
+
+Uso pela linha de comando:
+    python backup.py criar
+    python backup.py listar
+    python backup.py limpar                   # aplica a retenção
+    python backup.py restaurar <id> [destino]
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from datetime import datetime
+
+from db import DB_PATH
+
+PASTA_BACKUPS = "backups"
+PASTA_LOJA = os.path.join(PASTA_BACKUPS, "loja")
+PASTA_OBJETOS = os.path.join(PASTA_LOJA, "objetos")
+PASTA_SNAPSHOTS = os.path.join(PASTA_LOJA, "snapshots")
+ARQUIVO_INDICE = os.path.join(PASTA_LOJA, "indice.json")
+ARQUIVO_TRAVA = os.path.join(PASTA_LOJA, "backup.lock")
+
+TAMANHO_BLOCO = 512 * 1024
+EXTENSOES = ('.py', '.html', '.css', '.js', '.db', '.json', '.csv', '.txt')
+PASTAS_IGNORADAS = ('backups', 'venv', '.venv', '.git', '__pycache__', 'static')
+
+# Retenção: último snapshot de cada hora/dia/semana, nesta quantidade
+RETENCAO_HORARIA = 24
+RETENCAO_DIARIA = 7
+RETENCAO_SEMANAL = 8
+PREFIXO_ZIP_ANTIGO = "backup_auto_"
+# Trava mais velha que isso é de um backup que morreu no meio
+TRAVA_EXPIRADA_S = 3600
+
+
+def _gravar_atomico(caminho, dados):
+    temporario = caminho + ".tmp"
+    with open(temporario, "wb") as f:
+        f.write(dados)
+    os.replace(temporario, caminho)
+
+
+def _caminho_objeto(hash_bloco):
+    return os.path.join(PASTA_OBJETOS, hash_bloco[:2], hash_bloco)
+
+
+def _guardar_blocos(caminho, stats):
+    """Lê o arquivo em blocos, grava os que ainda não existem e retorna os hashes."""
+    blocos = []
+    with open(caminho, "rb") as f:
+        while True:
+            dados = f.read(TAMANHO_BLOCO)
+            if not dados:
+                break
+            hash_bloco = hashlib.sha256(dados).hexdigest()
+            destino = _caminho_objeto(hash_bloco)
+            if not os.path.exists(destino):
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                comprimido = zlib.compress(dados, 6)
+                _gravar_atomico(destino, comprimido)
+                stats["blocos_novos"] += 1
+                stats["bytes_gravados"] += len(comprimido)
+            blocos.append(hash_bloco)
+    return blocos
+
+
+def _ler_json(caminho, padrao):
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return padrao
+
+
+def _gravar_json(caminho, dados):
+    _gravar_atomico(caminho, json.dumps(dados, ensure_ascii=False).encode("utf-8"))
+
+
+class _Trava:
+    """Impede dois backups/limpezas simultâneos (ex.: automático + manual)."""
+
+    def __enter__(self):
+        os.makedirs(PASTA_LOJA, exist_ok=True)
+        try:
+            if time.time() - os.path.getmtime(ARQUIVO_TRAVA) > TRAVA_EXPIRADA_S:
+                os.remove(ARQUIVO_TRAVA)
+        except OSError:
+            pass
+        try:
+            self.fd = os.open(ARQUIVO_TRAVA, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise RuntimeError("Já existe um backup em andamento.")
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+        os.remove(ARQUIVO_TRAVA)
+
+
+def _listar_arquivos(raiz, caminho_banco):
+    for root, dirs, files in os.walk(raiz):
+        dirs[:] = [d for d in dirs if d not in PASTAS_IGNORADAS]
+        for file in files:
+            caminho = os.path.join(root, file)
+            if not file.endswith(EXTENSOES) or os.path.abspath(caminho) == caminho_banco:
+                continue
+            yield os.path.relpath(caminho, raiz).replace(os.sep, "/"), caminho
+
+
+def _assinatura_banco(caminho_banco):
+    """(mtime, tamanho) do banco e do WAL: se não mudou, o banco não mudou."""
+    partes = []
+    for sufixo in ("", "-wal"):
+        try:
+            st = os.stat(caminho_banco + sufixo)
+            partes += [st.st_mtime_ns, st.st_size]
+        except OSError:
+            partes += [0, 0]
+    return partes
+
+
+def _copiar_banco(caminho_banco, destino):
+    """Cópia consistente do banco em uso (API de backup do SQLite)."""
+    origem = sqlite3.connect(caminho_banco, timeout=30)
+    copia = sqlite3.connect(destino)
+    try:
+        origem.backup(copia)
+    finally:
+        copia.close()
+        origem.close()
+
+
+def criar_snapshot(raiz="."):
+    """Cria um snapshot incremental. Retorna o resumo (ou "erro")."""
+    stats = {"arquivos": 0, "arquivos_lidos": 0, "blocos_novos": 0, "bytes_gravados": 0}
+    caminho_banco = os.path.abspath(DB_PATH)
+    with _Trava():
+        os.makedirs(PASTA_SNAPSHOTS, exist_ok=True)
+        indice = _ler_json(ARQUIVO_INDICE, {})
+        novo_indice = {}
+        arquivos = {}
+
+        for rel, caminho in _listar_arquivos(raiz, caminho_banco):
+            try:
+                st = os.stat(caminho)
+                assinatura = [st.st_mtime_ns, st.st_size]
+                anterior = indice.get(rel)
+                if anterior and anterior["assinatura"] == assinatura:
+                    blocos = anterior["blocos"]
+                else:
+                    blocos = _guardar_blocos(caminho, stats)
+                    stats["arquivos_lidos"] += 1
+            except OSError:
+                continue  # Arquivo sumiu durante o backup
+            novo_indice[rel] = {"assinatura": assinatura, "blocos": blocos}
+            arquivos[rel] = {"tamanho": st.st_size, "mtime": st.st_mtime, "blocos": blocos}
+
+        if os.path.exists(caminho_banco):
+            rel = os.path.basename(caminho_banco)
+            assinatura = _assinatura_banco(caminho_banco)
+            anterior = indice.get(":banco")
+            if anterior and anterior["assinatura"] == assinatura:
+                blocos, tamanho = anterior["blocos"], anterior["tamanho"]
+            else:
+                copia = os.path.join(PASTA_LOJA, "banco.tmp")
+                _copiar_banco(caminho_banco, copia)
+                try:
+                    blocos = _guardar_blocos(copia, stats)
+                    tamanho = os.path.getsize(copia)
+                finally:
+                    os.remove(copia)
+                stats["arquivos_lidos"] += 1
+            novo_indice[":banco"] = {"assinatura": assinatura, "blocos": blocos, "tamanho": tamanho}
+            arquivos[rel] = {"tamanho": tamanho, "mtime": time.time(), "blocos": blocos}
+
+        stats["arquivos"] = len(arquivos)
+        _gravar_json(ARQUIVO_INDICE, novo_indice)
+
+        ultimo = listar_snapshots()[-1:] if stats["arquivos_lidos"] == 0 else []
+        if ultimo:
+            manifesto_anterior = _ler_json(os.path.join(PASTA_SNAPSHOTS, ultimo[0]["id"] + ".json"), {})
+            if {k: v["blocos"] for k, v in manifesto_anterior.get("arquivos", {}).items()} == \
+                    {k: v["blocos"] for k, v in arquivos.items()}:
+                return {"status": "Nenhuma alteração desde o último backup", "arquivo": ultimo[0]["id"], **stats}
+
+        agora = datetime.now()
+        snapshot_id = agora.strftime("%Y-%m-%d_%H-%M-%S")
+        _gravar_json(os.path.join(PASTA_SNAPSHOTS, snapshot_id + ".json"), {
+            "id": snapshot_id,
+            "criado_em": int(agora.timestamp()),
+            "arquivos": arquivos,
+        })
+    return {"status": "Backup criado com sucesso!", "arquivo": snapshot_id, **stats}
+
+
+def listar_snapshots():
+    """Snapshots existentes, do mais antigo para o mais novo."""
+    if not os.path.isdir(PASTA_SNAPSHOTS):
+        return []
+    snapshots = []
+    for nome in sorted(os.listdir(PASTA_SNAPSHOTS)):
+        if not nome.endswith(".json"):
+            continue
+        snapshot_id = nome[:-5]
+        criado_em = datetime.strptime(snapshot_id, "%Y-%m-%d_%H-%M-%S")
+        snapshots.append({"id": snapshot_id, "criado_em": int(criado_em.timestamp())})
+    return snapshots
+
+
+def _zips_antigos():
+    """Backups ZIP do formato anterior, do mais antigo para o mais novo (id = nome do arquivo)."""
+    if not os.path.isdir(PASTA_BACKUPS):
+        return []
+    zips = []
+    for nome in sorted(os.listdir(PASTA_BACKUPS)):
+        if not (nome.startswith(PREFIXO_ZIP_ANTIGO) and nome.endswith(".zip")):
+            continue
+        try:
+            criado_em = datetime.strptime(nome[len(PREFIXO_ZIP_ANTIGO):-4], "%Y-%m-%d_%H-%M-%S")
+        except ValueError:
+            continue
+        zips.append({"id": nome, "criado_em": int(criado_em.timestamp())})
+    return zips
+
+
+def _snapshots_mantidos(snapshots):
+    """IDs a manter: o mais novo de cada hora/dia/semana dentro da janela de retenção."""
+    mantidos = set()
+    regras = (
+        ("%Y-%m-%d %H", RETENCAO_HORARIA),
+        ("%Y-%m-%d", RETENCAO_DIARIA),
+        ("%G-%V", RETENCAO_SEMANAL),
+    )
+    for formato, quantidade in regras:
+        periodos = []
+        for s in reversed(snapshots):
+            periodo = datetime.fromtimestamp(s["criado_em"]).strftime(formato)
+            if periodo in periodos:
+                continue
+            if len(periodos) == quantidade:
+                break
+            periodos.append(periodo)
+            mantidos.add(s["id"])
+    if snapshots:
+        mantidos.add(snapshots[-1]["id"])
+    return mantidos
+
+
+def aplicar_retencao():
+    """Remove snapshots (e ZIPs antigos) fora da política de retenção e os blocos que ninguém mais usa."""
+    with _Trava():
+        snapshots = listar_snapshots()
+        zips = _zips_antigos()
+        mantidos = _snapshots_mantidos(sorted(zips + snapshots, key=lambda s: s["criado_em"]))
+        removidos = 0
+        for s in snapshots:
+            if s["id"] not in mantidos:
+                os.remove(os.path.join(PASTA_SNAPSHOTS, s["id"] + ".json"))
+                removidos += 1
+        zips_removidos = 0
+        for z in zips:
+            if z["id"] not in mantidos:
+                os.remove(os.path.join(PASTA_BACKUPS, z["id"]))
+                zips_removidos += 1
+
+        usados = set()
+        for snapshot_id in mantidos & {s["id"] for s in snapshots}:
+            manifesto = _ler_json(os.path.join(PASTA_SNAPSHOTS, snapshot_id + ".json"), {})
+            for arquivo in manifesto.get("arquivos", {}).values():
+                usados.update(arquivo["blocos"])
+        # Blocos do índice também ficam: o próximo backup reaproveita sem reler o arquivo
+        for item in _ler_json(ARQUIVO_INDICE, {}).values():
+            usados.update(item["blocos"])
+
+        blocos_removidos = 0
+        if os.path.isdir(PASTA_OBJETOS):
+            for pasta in os.listdir(PASTA_OBJETOS):
+                caminho_pasta = os.path.join(PASTA_OBJETOS, pasta)
+                for nome in os.listdir(caminho_pasta):
+                    if nome not in usados:
+                        os.remove(os.path.join(caminho_pasta, nome))
+                        blocos_removidos += 1
+    return {"status": "Retenção aplicada", "snapshots_removidos": removidos,
+            "zips_removidos": zips_removidos, "blocos_removidos": blocos_removidos}
+
+
+def restaurar_snapshot(snapshot_id, destino=None):
+    """Reconstrói os arquivos de um snapshot em `destino` (nunca por cima do sistema em uso)."""
+    manifesto = _ler_json(os.path.join(PASTA_SNAPSHOTS, snapshot_id + ".json"), None)
+    if manifesto is None:
+        return {"erro": f"Snapshot {snapshot_id} não encontrado."}
+    destino = destino or os.path.join(PASTA_BACKUPS, f"restauracao_{snapshot_id}")
+
+    for rel, arquivo in manifesto["arquivos"].items():
+        caminho = os.path.join(destino, *rel.split("/"))
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        temporario = caminho + ".tmp"
+        try:
+            with open(temporario, "wb") as f:
+                for hash_bloco in arquivo["blocos"]:
+                    with open(_caminho_objeto(hash_bloco), "rb") as objeto:
+                        dados = zlib.decompress(objeto.read())
+                    if hashlib.sha256(dados).hexdigest() != hash_bloco:
+                        return {"erro": f"Bloco corrompido em {rel}."}
+                    f.write(dados)
+            os.replace(temporario, caminho)
+        finally:
+            # Bloco corrompido ou ausente: não deixa o arquivo pela metade no destino
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        os.utime(caminho, (arquivo["mtime"], arquivo["mtime"]))
+    return {"status": "Snapshot restaurado", "destino": destino, "arquivos": len(manifesto["arquivos"])}
+
+
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else "criar"
+    if comando == "criar":
+        print(criar_snapshot())
+    elif comando == "listar":
+        for s in listar_snapshots():
+            print(s["id"])
+    elif comando == "limpar":
+        print(aplicar_retencao())
+    elif comando == "restaurar" and len(sys.argv) > 2:
+        print(restaurar_snapshot(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))
+    else:
+        print(__doc__)
@@ -0,0 +1,96 @@
+# benchmarks/bench_busca_cadastros.py
+"""Busca de cadastros: índice FTS5 contra o antigo LIKE '%busca%'.
+
+Cria um banco temporário com N cadastros (padrão 500 mil, nomes com acento,
+CPF e placa formatados) e mede p50/p99 de listar_cadastros para buscas
+típicas de quem digita no campo, comparando com a consulta LIKE anterior.
+
+Uso:
+    python benchmarks/bench_busca_cadastros.py            # 500 mil
+    python benchmarks/bench_busca_cadastros.py 100000
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+PASTA = tempfile.mkdtemp(prefix="bench_busca_")
+os.environ["DB_PATH"] = os.path.join(PASTA, "bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import get_db_connection  # noqa: E402
+from migrations import aplicar_migracoes  # noqa: E402
+from services import listar_cadastros  # noqa: E402
+
+EMPRESA = 1
+NOMES = ["João", "José", "Maria", "Ana", "Conceição", "Antônio", "Márcia", "Luís", "Fábio", "Inês",
+         "Pedro", "Paulo", "Lúcia", "Sérgio", "Cláudia", "Vitória", "Rafael", "Gabriel", "Letícia", "André"]
+SOBRENOMES = ["Silva", "Souza", "Conceição", "Araújo", "Gonçalves", "Ribeiro", "Simões", "Magalhães",
+              "Pereira", "Lima", "Carvalho", "Gomes", "Fernandes", "Brandão", "Assunção", "Rocha"]
+EMPRESAS = ["Acme Ltda", "Transportes Rápido", "Logística União", "Comércio São Jorge", "Indústria Ômega"]
+BUSCAS = ["joao", "conceicao", "CONCEIÇÃO silva", "mar", "123.45", "ABC-1", "acme", "zz9"]
+
+
+def popular(quantidade):
+    conn = get_db_connection()
+    lote = []
+    for i in range(quantidade):
+        nome = f"{random.choice(NOMES)} {random.choice(SOBRENOMES)} {random.choice(SOBRENOMES)}"
+        cpf = f"{random.randint(0, 999):03d}.{random.randint(0, 999):03d}.{random.randint(0, 999):03d}-{random.randint(0, 99):02d}"
+        placa = "".join(random.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=3)) + f"-{random.randint(0, 9)}" \
+            + random.choice("ABCDEFGHIJ0123456789") + f"{random.randint(0, 99):02d}"
+        email = f"{nome.split()[0].lower()}.{i}@exemplo.com"
+        lote.append((nome, cpf, email, random.choice(EMPRESAS), placa, EMPRESA))
+        if len(lote) == 50000:
+            with conn:
+                conn.executemany("""
+                    INSERT INTO cadastros (nome, cpf, email, empresa, placa, empresa_id)
+                    VALUES (?, ?, ?, ?, ?, ?)""", lote)
+            lote = []
+    if lote:
+        with conn:
+            conn.executemany("""
+                INSERT INTO cadastros (nome, cpf, email, empresa, placa, empresa_id)
+                VALUES (?, ?, ?, ?, ?, ?)""", lote)
+
+
+def busca_like(busca):
+    """Consulta usada antes do índice FTS5 (sem limite, sem índice)."""
+    conn = get_db_connection()
+    return conn.execute("""
+        SELECT id, nome, cpf, telefone, email, cargo, empresa, placa
+        FROM cadastros
+        WHERE empresa_id = ? AND (nome LIKE ? OR placa LIKE ?)
+        ORDER BY nome
+    """, (EMPRESA, f"%{busca}%", f"%{busca}%")).fetchall()
+
+
+def medir(funcao, busca, repeticoes):
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = funcao(busca)
+        tempos.append((time.perf_counter() - t0) * 1000)
+    tempos.sort()
+    return tempos[len(tempos) // 2], tempos[max(0, int(len(tempos) * 0.99) - 1)], len(resultado)
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    aplicar_migracoes()
+    t0 = time.perf_counter()
+    popular(quantidade)
+    print(f"Banco temporário: {os.environ['DB_PATH']}")
+    print(f"{quantidade:,} cadastros inseridos (com índice FTS5) em {time.perf_counter() - t0:.1f}s\n")
+    print(f"{'busca':<18} | {'FTS5 p50/p99 (ms)':>20} | {'achados':>7} | {'LIKE p50/p99 (ms)':>20} | {'achados':>7}")
+    for busca in BUSCAS:
+        fts = medir(lambda b: listar_cadastros(EMPRESA, b), busca, 50)
+        like = medir(busca_like, busca, 5)
+        print(f"{busca:<18} | {fts[0]:>9.2f} / {fts[1]:<8.2f} | {fts[2]:>7} | "
+              f"{like[0]:>9.2f} / {like[1]:<8.2f} | {like[2]:>7}")
+
+
+if __name__ == "__main__":
+    main()
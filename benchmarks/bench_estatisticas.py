@@ -0,0 +1,97 @@
+# benchmarks/bench_estatisticas.py
+"""Latência de /estatisticas conforme o histórico de movimentações cresce.
+
+Cria um banco temporário, vai inserindo movimentações (a maioria já com
+saída, ~200 veículos no pátio) e mede obter_estatisticas (contadores
+incrementais) contra a agregação direta em movimentacoes.
+
+Uso:
+    python benchmarks/bench_estatisticas.py                # até 1 milhão
+    python benchmarks/bench_estatisticas.py 10000000       # até 10 milhões
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+PASTA = tempfile.mkdtemp(prefix="bench_estat_")
+os.environ["DB_PATH"] = os.path.join(PASTA, "bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import get_db_connection  # noqa: E402
+from migrations import aplicar_migracoes  # noqa: E402
+from services import obter_estatisticas, calcular_estatisticas_agregadas  # noqa: E402
+
+EMPRESA = 1
+NO_PATIO = 200
+
+
+def inserir_historico(quantidade, inicio_id):
+    agora = int(time.time())
+    conn = get_db_connection()
+    lote = []
+    for i in range(quantidade):
+        entrada_ts = agora - random.randint(3600, 400 * 86400)
+        saida_ts = entrada_ts + random.randint(60, 8 * 3600)
+        tipo = "visitante" if i % 7 == 0 else "Carro"
+        lote.append((f"HIS{(inicio_id + i) % 10000:04d}", tipo,
+                     time.strftime("%d-%m-%Y %H:%M:%S", time.localtime(entrada_ts)), entrada_ts,
+                     time.strftime("%d-%m-%Y %H:%M:%S", time.localtime(saida_ts)), saida_ts, EMPRESA))
+        if len(lote) == 50000:
+            with conn:
+                conn.executemany("""
+                    INSERT INTO movimentacoes (placa, tipo, entrada, entrada_ts, saida, saida_ts, empresa_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""", lote)
+            lote = []
+    if lote:
+        with conn:
+            conn.executemany("""
+                INSERT INTO movimentacoes (placa, tipo, entrada, entrada_ts, saida, saida_ts, empresa_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""", lote)
+
+
+def inserir_patio():
+    agora = int(time.time())
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("""
+            INSERT INTO movimentacoes (placa, tipo, entrada, entrada_ts, empresa_id)
+            VALUES (?, ?, ?, ?, ?)""", [
+            (f"PAT{i:04d}", "visitante" if i % 5 == 0 else "Carro", "", agora - i * 600, EMPRESA)
+            for i in range(NO_PATIO)
+        ])
+
+
+def medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        funcao(EMPRESA)
+        tempos.append((time.perf_counter() - t0) * 1000)
+    tempos.sort()
+    return tempos[len(tempos) // 2], tempos[int(len(tempos) * 0.99) - 1]
+
+
+def main():
+    maximo = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    aplicar_migracoes()
+    inserir_patio()
+
+    print(f"Banco temporário: {os.environ['DB_PATH']}")
+    print(f"{'histórico':>12} | {'contadores p50/p99 (ms)':>24} | {'agregação p50/p99 (ms)':>24}")
+    total = 0
+    alvo = 1000
+    while alvo <= maximo:
+        inserir_historico(alvo - total, total)
+        total = alvo
+        contadores = medir(obter_estatisticas, 300)
+        agregado = medir(calcular_estatisticas_agregadas, 30)
+        assert obter_estatisticas(EMPRESA) == calcular_estatisticas_agregadas(EMPRESA)
+        print(f"{total:>12,} | {contadores[0]:>11.3f} / {contadores[1]:<10.3f} | "
+              f"{agregado[0]:>11.3f} / {agregado[1]:<10.3f}")
+        alvo *= 10
+
+
+if __name__ == "__main__":
+    main()
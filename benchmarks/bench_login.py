@@ -0,0 +1,77 @@
+# benchmarks/bench_login.py
+"""Troca de turno: logins por segundo com N vigilantes logando ao mesmo tempo.
+
+Mede só a verificação de senha (o que domina o login), disparando N
+verificações simultâneas do event loop como o /login faz:
+
+- antes: hashes com o custo padrão do bcrypt (12), verificação no pool de CPU;
+- primeiro login depois da mudança: custo calibrado, hashes ainda em 12
+  (verifica + regrava no custo novo);
+- depois: hashes já no custo calibrado, pool de senhas (MAX_PROCESSOS_SENHA).
+
+Para cada cenário: logins/s e latência p50/p99 de um login.
+
+Uso:
+    python benchmarks/bench_login.py            # 40 logins simultâneos
+    python benchmarks/bench_login.py 100
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executores import MAX_PROCESSOS_CPU, MAX_PROCESSOS_SENHA  # noqa: E402
+from senhas import CUSTO_PADRAO, TEMPO_ALVO_MS, calibrar_custo, get_hash_senha, verificar_e_atualizar  # noqa: E402
+
+
+async def rajada(pool, senhas, hashes, custo):
+    loop = asyncio.get_running_loop()
+    latencias = []
+
+    async def login(senha, senha_hash):
+        t0 = time.perf_counter()
+        ok, _ = await loop.run_in_executor(pool, verificar_e_atualizar, senha, senha_hash, custo)
+        assert ok
+        latencias.append((time.perf_counter() - t0) * 1000)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(login(s, h) for s, h in zip(senhas, hashes)))
+    total = time.perf_counter() - inicio
+    latencias.sort()
+    return len(senhas) / total, latencias[len(latencias) // 2], latencias[int(len(latencias) * 0.99)]
+
+
+def medir(nome, workers, senhas, hashes, custo):
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Aquece os workers (spawn + import) fora da medição
+        list(pool.map(abs, range(workers)))
+        por_s, p50, p99 = asyncio.run(rajada(pool, senhas, hashes, custo))
+    print(f"{nome:<34} | {workers:>7} | {por_s:>8.1f} | {p50:>8.0f} | {p99:>8.0f}")
+    return por_s
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    custo = calibrar_custo()
+    print(f"{quantidade} logins simultâneos | custo calibrado {custo} (alvo {TEMPO_ALVO_MS:.0f} ms), "
+          f"padrão {CUSTO_PADRAO} | {os.cpu_count()} núcleos\n")
+
+    senhas = [f"senha-vigilante-{i}" for i in range(quantidade)]
+    hashes_antigos = [get_hash_senha(s, CUSTO_PADRAO) for s in senhas]
+    hashes_novos = [get_hash_senha(s, custo) for s in senhas]
+
+    print(f"{'cenário':<34} | {'workers':>7} | {'logins/s':>8} | {'p50 ms':>8} | {'p99 ms':>8}")
+    antes = medir(f"antes (custo {CUSTO_PADRAO}, pool de CPU)", MAX_PROCESSOS_CPU, senhas, hashes_antigos,
+                  CUSTO_PADRAO)
+    medir(f"1º login (verifica {CUSTO_PADRAO} + regrava)", MAX_PROCESSOS_SENHA, senhas, hashes_antigos, custo)
+    depois = medir(f"depois (custo {custo}, pool de senhas)", MAX_PROCESSOS_SENHA, senhas, hashes_novos, custo)
+    print(f"\nGanho: {depois / antes:.1f}x logins/s "
+          f"(pool de senhas usa {MAX_PROCESSOS_SENHA} de {os.cpu_count()} núcleos)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# benchmarks/bench_ocr_placas.py
+"""OCR de placas no servidor: quadros por segundo por núcleo.
+
+Gera fotos sintéticas (placa Mercosul ou antiga sobre fundo com ruído, em
+tamanhos e posições variados, JPEG 1280x960 como as do celular) e mede:
+
+- pré-processamento + detecção da placa num processo (não depende do Tesseract);
+- o pipeline completo num processo (quadros/s por núcleo) e a taxa de acerto;
+- o pipeline completo no pool de processos, em lotes de TAMANHO_LOTE, com
+  1..N workers (quadros/s totais e por worker).
+
+Sem o Tesseract instalado, só a primeira medição é feita.
+
+Uso:
+    python benchmarks/bench_ocr_placas.py            # 60 fotos
+    python benchmarks/bench_ocr_placas.py 200
+"""
+import io
+import multiprocessing
+import os
+import random
+import string
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from ocr_placas import (TAMANHO_LOTE, detectar_regioes, ocr_disponivel, preprocessar,  # noqa: E402
+                        reconhecer_imagem, reconhecer_lote)
+
+
+def placa_aleatoria():
+    letras = "".join(random.choices(string.ascii_uppercase, k=3))
+    meio = random.choice(string.ascii_uppercase + string.digits)
+    return f"{letras}{random.randint(0, 9)}{meio}{random.randint(0, 99):02d}"
+
+
+def gerar_foto(placa):
+    imagem = Image.new("L", (1280, 960), random.randint(60, 140))
+    desenho = ImageDraw.Draw(imagem)
+    for _ in range(300):
+        x, y = random.randint(0, 1280), random.randint(0, 960)
+        desenho.rectangle([x, y, x + random.randint(5, 80), y + random.randint(5, 80)],
+                          fill=random.randint(40, 160))
+    fonte = ImageFont.load_default(size=random.randint(45, 90))
+    x, y = random.randint(0, 700), random.randint(0, 800)
+    caixa = desenho.textbbox((x + 15, y + 10), placa, font=fonte)
+    desenho.rectangle([x, y, caixa[2] + 15, caixa[3] + 12], fill=235, outline=20, width=3)
+    desenho.text((x + 15, y + 10), placa, fill=15, font=fonte)
+    saida = io.BytesIO()
+    imagem.convert("RGB").save(saida, "JPEG", quality=85)
+    return saida.getvalue()
+
+
+def medir_deteccao(fotos):
+    inicio = time.perf_counter()
+    for dados in fotos:
+        detectar_regioes(preprocessar(dados)[0])
+    return len(fotos) / (time.perf_counter() - inicio)
+
+
+def medir_pipeline(fotos, placas):
+    inicio = time.perf_counter()
+    acertos = sum(reconhecer_imagem(dados)["placa"] == placa for dados, placa in zip(fotos, placas))
+    return len(fotos) / (time.perf_counter() - inicio), acertos
+
+
+def medir_pool(fotos, workers):
+    lotes = [fotos[i:i + TAMANHO_LOTE] for i in range(0, len(fotos), TAMANHO_LOTE)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Aquece os workers (import do módulo e do Tesseract) fora da medição
+        list(pool.map(reconhecer_lote, [fotos[:1]] * workers))
+        inicio = time.perf_counter()
+        list(pool.map(reconhecer_lote, lotes))
+        return len(fotos) / (time.perf_counter() - inicio)
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    random.seed(42)
+    placas = [placa_aleatoria() for _ in range(quantidade)]
+    fotos = [gerar_foto(placa) for placa in placas]
+    print(f"{quantidade} fotos sintéticas 1280x960, lote de {TAMANHO_LOTE}\n")
+
+    print(f"Pré-processamento + detecção: {medir_deteccao(fotos):.1f} quadros/s (1 núcleo)")
+    if not ocr_disponivel():
+        print("Tesseract não instalado (pytesseract + tesseract-ocr): pipeline completo não medido.")
+        return
+
+    fps, acertos = medir_pipeline(fotos, placas)
+    print(f"Pipeline completo: {fps:.1f} quadros/s (1 núcleo), acertos {acertos}/{quantidade}\n")
+    print(f"{'workers':>7} | {'quadros/s':>9} | {'por worker':>10}")
+    for workers in sorted({1, 2, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1}):
+        fps = medir_pool(fotos, workers)
+        print(f"{workers:>7} | {fps:>9.1f} | {fps / workers:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/bench_placas.py
+"""Normalização/validação de placas: módulo placas.py contra as funções antigas.
+
+Gera N placas no formato em que chegam dos formulários e importações
+(minúsculas, com hífen ou espaço, antigas, Mercosul e algumas inválidas) e
+mede, em ns por placa:
+
+- normalizar + validar uma a uma: antigo (re.match com o padrão em texto e
+  três str.replace) contra placas.normalizar_placa / placa_valida;
+- o mesmo em lote com placas.validar_placas;
+- conversão entre formatos (para_mercosul / para_antigo / chave_veiculo).
+
+Uso:
+    python benchmarks/bench_placas.py            # 200 mil placas
+    python benchmarks/bench_placas.py 1000000
+"""
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from placas import (chave_veiculo, normalizar_placa, para_antigo, para_mercosul,  # noqa: E402
+                    placa_valida, validar_placas)
+
+REPETICOES = 5
+
+
+def normalizar_antigo(placa):
+    """Versão anterior (controle_veiculos.py)."""
+    return placa.upper().replace("-", "").replace(" ", "")
+
+
+def placa_valida_antigo(placa):
+    """Versão anterior (controle_veiculos.py)."""
+    placa = normalizar_antigo(placa)
+    padrao_antigo = r'^[A-Z]{3}[0-9]{4}$'
+    padrao_mercosul = r'^[A-Z]{3}[0-9][A-Z][0-9]{2}$'
+    return (
+        re.match(padrao_antigo, placa) is not None or
+        re.match(padrao_mercosul, placa) is not None
+    )
+
+
+def gerar_placas(quantidade):
+    placas = []
+    for _ in range(quantidade):
+        letras = "".join(random.choices(string.ascii_uppercase, k=3))
+        quinto = random.choice(string.digits + "ABCDEFGHIJ")
+        placa = f"{letras}{random.randint(0, 9)}{quinto}{random.randint(0, 99):02d}"
+        sorteio = random.random()
+        if sorteio < 0.3:
+            placa = f"{placa[:3]}-{placa[3:]}"
+        elif sorteio < 0.4:
+            placa = f"{placa[:3]} {placa[3:]}"
+        elif sorteio < 0.45:
+            placa = placa[:6]  # inválida
+        if random.random() < 0.3:
+            placa = placa.lower()
+        placas.append(placa)
+    return placas
+
+
+def medir(nome, funcao, quantidade):
+    melhor = float("inf")
+    for _ in range(REPETICOES):
+        inicio = time.perf_counter()
+        funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    print(f"{nome:<44} | {melhor * 1e9 / quantidade:>8.0f} ns/placa")
+    return melhor
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    random.seed(42)
+    placas = gerar_placas(quantidade)
+    validas = [p for p in validar_placas(placas) if p]
+    print(f"{quantidade:,} placas ({len(validas):,} válidas), melhor de {REPETICOES}\n")
+
+    antigo = medir("antigo: normalizar + placa_valida (uma a uma)",
+                   lambda: [normalizar_antigo(p) if placa_valida_antigo(p) else None for p in placas], quantidade)
+    novo = medir("placas: normalizar + placa_valida (uma a uma)",
+                 lambda: [normalizar_placa(p) if placa_valida(p) else None for p in placas], quantidade)
+    lote = medir("placas: validar_placas (lote)", lambda: validar_placas(placas), quantidade)
+    print(f"\nGanho uma a uma: {antigo / novo:.1f}x | em lote: {antigo / lote:.1f}x\n")
+
+    assert validar_placas(placas) == [normalizar_antigo(p) if placa_valida_antigo(p) else None for p in placas]
+
+    medir("para_mercosul", lambda: [para_mercosul(p) for p in validas], len(validas))
+    medir("para_antigo", lambda: [para_antigo(p) for p in validas], len(validas))
+    medir("chave_veiculo", lambda: [chave_veiculo(p) for p in validas], len(validas))
+
+
+if __name__ == "__main__":
+    main()
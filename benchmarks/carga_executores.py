@@ -0,0 +1,124 @@
+# benchmarks/carga_executores.py
+"""Teste de carga: latência de /veiculos durante um backup e uma rajada de logins.
+
+Sobe o servidor (uvicorn) numa cópia temporária do projeto, mantém clientes
+consultando /veiculos sem parar e mede p50/p99 em três fases:
+  1. repouso
+  2. backup manual (/system/backup-now) rodando
+  3. rajada de logins simultâneos (bcrypt)
+Com o trabalho pesado nos executores, o p99 das fases 2 e 3 deve ficar
+próximo do repouso.
+
+Uso:
+    python benchmarks/carga_executores.py                 # 20 clientes, 100 logins
+    python benchmarks/carga_executores.py 50 300
+"""
+import asyncio
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DURACAO_FASE = 5  # segundos
+
+
+def preparar_copia():
+    pasta = tempfile.mkdtemp(prefix="carga_exec_")
+    for padrao in ("*.py", "*.html", "*.csv", "*.db"):
+        for arquivo in glob.glob(os.path.join(RAIZ, padrao)):
+            shutil.copy(arquivo, pasta)
+    if os.path.exists(os.path.join(RAIZ, "static")):
+        shutil.copytree(os.path.join(RAIZ, "static"), os.path.join(pasta, "static"))
+    return pasta
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def logar(base_url):
+    cliente = httpx.AsyncClient(base_url=base_url, timeout=60)
+    await cliente.post("/login", data={"username": "admin", "password": "admin"})
+    return cliente
+
+
+async def consultar_veiculos(cliente, parar, latencias):
+    while not parar.is_set():
+        t0 = time.perf_counter()
+        await cliente.get("/veiculos")
+        latencias.append((time.perf_counter() - t0) * 1000)
+
+
+async def fase(nome, clientes, carga=None):
+    parar = asyncio.Event()
+    latencias = []
+    tarefas = [asyncio.create_task(consultar_veiculos(c, parar, latencias)) for c in clientes]
+    inicio = time.perf_counter()
+    if carga is not None:
+        await carga
+    await asyncio.sleep(max(0, DURACAO_FASE - (time.perf_counter() - inicio)))
+    parar.set()
+    await asyncio.gather(*tarefas)
+    latencias.sort()
+    p50 = latencias[len(latencias) // 2]
+    p99 = latencias[max(0, int(len(latencias) * 0.99) - 1)]
+    print(f"{nome:<18} | {len(latencias):>8} | {p50:>8.1f} | {p99:>8.1f}")
+
+
+async def rajada_logins(base_url, quantidade):
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as cliente:
+        await asyncio.gather(*[
+            cliente.post("/login", data={"username": "admin", "password": "admin"})
+            for _ in range(quantidade)
+        ])
+
+
+async def main():
+    num_clientes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    num_logins = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    pasta = preparar_copia()
+    porta = porta_livre()
+    base_url = f"http://127.0.0.1:{porta}"
+    ambiente = dict(os.environ, DB_PATH=os.path.join(pasta, "estacionamento.db"))
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(porta), "--log-level", "error"],
+        cwd=pasta, env=ambiente)
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(base_url + "/favicon.ico", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        # Espera o backup do boot terminar para não contaminar o repouso
+        await asyncio.sleep(2)
+
+        clientes = [await logar(base_url) for _ in range(num_clientes)]
+        admin = clientes[0]
+        print(f"Servidor em {pasta} | {num_clientes} clientes consultando /veiculos")
+        print(f"{'fase':<18} | {'reqs':>8} | {'p50 ms':>8} | {'p99 ms':>8}")
+        await fase("repouso", clientes)
+        await fase("backup", clientes, admin.post("/system/backup-now"))
+        await fase(f"{num_logins} logins", clientes, rajada_logins(base_url, num_logins))
+
+        print("Executores:", (await admin.get("/dev/executor-stats")).json())
+        for c in clientes:
+            await c.aclose()
+    finally:
+        servidor.terminate()
+        servidor.wait()
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
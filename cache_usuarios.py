@@ -0,0 +1,120 @@
+# cache_usuarios.py
+"""Cache em memória (TTL + LRU) dos registros de usuários e empresas usados na autenticação.
+
+Toda rota protegida confere o usuário da sessão (ver autorizacao.py) e o
+login busca empresa + usuário: sem o cache, cada requisição iria ao banco
+só para autorizar. Os registros ficam aqui por TTL_S segundos, no máximo
+MAX_ITENS (os menos usados saem primeiro).
+
+services.py invalida o cache em toda escrita em usuarios (criar, atualizar,
+excluir, importar CSV, painel SQL). O TTL cobre o que o cache não vê (outro
+worker ou edição direta no banco).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from db import get_db_connection
+
+TTL_S = 60
+MAX_ITENS = 1024
+
+_COLUNAS_USUARIO = ("id", "username", "password_hash", "role", "empresa_id")
+_COLUNAS_EMPRESA = ("id", "nome_empresa", "cnpj")
+
+
+class CacheUsuarios:
+    def __init__(self, ttl=TTL_S, maximo=MAX_ITENS):
+        self.ttl = ttl
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()  # chave -> (expira_em, registro ou None)
+        self._stats = {"acertos": 0, "faltas": 0, "invalidacoes": 0}
+
+    def _ler(self, chave):
+        """(True, registro) se a chave está no cache e não expirou; (False, None) se não."""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] > time.monotonic():
+                self._itens.move_to_end(chave)
+                self._stats["acertos"] += 1
+                return True, item[1]
+            self._stats["faltas"] += 1
+            return False, None
+
+    def _guardar(self, chave, registro):
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + self.ttl, registro)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+
+    def usuario(self, username, empresa_id):
+        """Registro do usuário (dict) ou None. Inexistentes também ficam em cache até a invalidação."""
+        chave = ("usuario", username, empresa_id)
+        achou, registro = self._ler(chave)
+        if achou:
+            return registro
+        row = get_db_connection().execute(f"""
+            SELECT {", ".join(_COLUNAS_USUARIO)} FROM usuarios WHERE username = ? AND empresa_id = ?
+        """, (username, empresa_id)).fetchone()
+        registro = dict(zip(_COLUNAS_USUARIO, row)) if row else None
+        self._guardar(chave, registro)
+        return registro
+
+    def empresa(self, empresa_id=None, cnpj=None):
+        """Registro da empresa pelo id ou pelo CNPJ (dict) ou None."""
+        chave = ("empresa_id", empresa_id) if cnpj is None else ("empresa_cnpj", cnpj)
+        achou, registro = self._ler(chave)
+        if achou:
+            return registro
+        coluna, valor = ("id", empresa_id) if cnpj is None else ("cnpj", cnpj)
+        row = get_db_connection().execute(
+            f"SELECT {', '.join(_COLUNAS_EMPRESA)} FROM empresas WHERE {coluna} = ?", (valor,)).fetchone()
+        registro = dict(zip(_COLUNAS_EMPRESA, row)) if row else None
+        self._guardar(chave, registro)
+        return registro
+
+    def login(self, username, empresa_id=None, cnpj=None):
+        """(empresa, usuario) para o login, numa única consulta quando não estão em cache."""
+        chave_empresa = ("empresa_id", empresa_id) if cnpj is None else ("empresa_cnpj", cnpj)
+        achou_empresa, empresa = self._ler(chave_empresa)
+        if achou_empresa:
+            return empresa, (self.usuario(username, empresa["id"]) if empresa else None)
+
+        coluna, valor = ("e.id", empresa_id) if cnpj is None else ("e.cnpj", cnpj)
+        colunas = [f"e.{c}" for c in _COLUNAS_EMPRESA] + [f"u.{c}" for c in _COLUNAS_USUARIO]
+        row = get_db_connection().execute(f"""
+            SELECT {", ".join(colunas)} FROM empresas e
+            LEFT JOIN usuarios u ON u.empresa_id = e.id AND u.username = ?
+            WHERE {coluna} = ?
+        """, (username, valor)).fetchone()
+        if row is None:
+            self._guardar(chave_empresa, None)
+            return None, None
+        empresa = dict(zip(_COLUNAS_EMPRESA, row[:len(_COLUNAS_EMPRESA)]))
+        usuario = row[len(_COLUNAS_EMPRESA):]
+        usuario = dict(zip(_COLUNAS_USUARIO, usuario)) if usuario[0] is not None else None
+        self._guardar(("empresa_id", empresa["id"]), empresa)
+        self._guardar(("empresa_cnpj", empresa["cnpj"]), empresa)
+        self._guardar(("usuario", username, empresa["id"]), usuario)
+        return empresa, usuario
+
+    def invalidar_usuarios(self, empresa_id=None):
+        """Descarta os usuários da empresa (de todas, se None). Chamado após escritas em usuarios."""
+        with self._lock:
+            for chave in [c for c in self._itens if c[0] == "usuario" and empresa_id in (None, c[2])]:
+                del self._itens[chave]
+            self._stats["invalidacoes"] += 1
+
+    def invalidar(self):
+        with self._lock:
+            self._itens.clear()
+            self._stats["invalidacoes"] += 1
+
+    def estatisticas(self):
+        with self._lock:
+            return dict(self._stats, itens=len(self._itens))
+
+
+cache_usuarios = CacheUsuarios()
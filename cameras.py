@@ -0,0 +1,370 @@
+# cameras.py
+"""Ingestão automática de placas a partir de câmeras IP (RTSP) ou arquivos de vídeo.
+
+Cada câmera ativa (tabela cameras) roda num processo próprio:
+
+- uma thread lê o stream sem parar (grab, barato) e só decodifica o quadro
+  quando chega a hora da próxima amostra. O intervalo é curto enquanto há
+  movimento e longo com a cena parada;
+- os quadros amostrados passam por uma fila limitada. Num stream ao vivo,
+  se o OCR atrasar, o quadro mais antigo é descartado: o processo nunca fica
+  para trás do tempo real. Num arquivo de vídeo a leitura espera a fila
+  (nenhum quadro é perdido e o tempo é o do vídeo);
+- a thread principal compara cada quadro com o anterior (diferença em baixa
+  resolução) e só roda o OCR (ocr_placas.reconhecer_quadro) enquanto há
+  movimento recente;
+- a mesma placa lida de novo dentro de JANELA_DEDUP_S (carro parado na
+  frente da câmera) não gera outro evento.
+
+O servidor recebe as leituras por uma fila entre processos e registra
+entrada ou saída (conforme a direção da câmera) com registrar_entrada /
+registrar_saida. Um supervisor reinicia processos que caírem.
+
+Dependências opcionais: opencv-python-headless e as do OCR (ver ocr_placas.py).
+
+Teste com um arquivo de vídeo, só mostrando as leituras:
+    python cameras.py video.mp4
+"""
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+from ocr_placas import normalizar_cinza, ocr_disponivel, reconhecer_quadro
+from placas import chave_veiculo
+from services import listar_cameras, registrar_entrada, registrar_saida, registrar_log
+
+# Amostragem adaptativa: intervalo entre quadros decodificados (s)
+INTERVALO_MOVIMENTO_S = 0.2
+INTERVALO_REPOUSO_S = 1.0
+# Depois do último movimento, continua no intervalo curto (e rodando OCR) por este tempo
+ESPERA_REPOUSO_S = 2.0
+# Fração de pixels alterados (em 160x120) para considerar que houve movimento
+LIMIAR_MOVIMENTO = 0.01
+TAMANHO_FILA_QUADROS = 4
+CONFIANCA_MINIMA = float(os.getenv("CAMERAS_CONFIANCA_MINIMA", "0.7"))
+JANELA_DEDUP_S = float(os.getenv("CAMERAS_JANELA_DEDUP_S", "60"))
+INTERVALO_ESTATISTICAS_S = 5
+# Espera antes de reiniciar um processo que caiu (dobra a cada queda seguida, até o máximo)
+ESPERA_REINICIO_S, ESPERA_REINICIO_MAX_S = 2, 60
+
+
+def _eh_arquivo(url):
+    return "://" not in url
+
+
+# --- Processo de uma câmera ---
+
+class _Amostragem:
+    """Estado compartilhado entre a thread de leitura e a de análise dentro do processo."""
+
+    def __init__(self):
+        self.intervalo = INTERVALO_MOVIMENTO_S
+        self.lidos = 0
+        self.amostrados = 0
+        self.descartados = 0
+
+
+def _ler_stream(captura, quadros, amostragem, parar, arquivo):
+    """Thread de leitura: grab contínuo, retrieve só na hora da próxima amostra."""
+    ultima = float("-inf")
+    try:
+        while not parar.is_set():
+            if not captura.grab():
+                break
+            amostragem.lidos += 1
+            instante = captura.get(cv2.CAP_PROP_POS_MSEC) / 1000 if arquivo else time.monotonic()
+            if instante - ultima < amostragem.intervalo:
+                continue
+            ok, quadro = captura.retrieve()
+            if not ok:
+                continue
+            ultima = instante
+            amostragem.amostrados += 1
+            if arquivo:
+                quadros.put((instante, quadro))
+                continue
+            while True:
+                try:
+                    quadros.put_nowait((instante, quadro))
+                    break
+                except queue.Full:
+                    # Ao vivo: descarta o quadro mais antigo para não acumular atraso
+                    try:
+                        quadros.get_nowait()
+                        amostragem.descartados += 1
+                    except queue.Empty:
+                        pass
+    finally:
+        quadros.put(None)
+
+
+def executar_camera(camera, saida, parar, reconhecer=reconhecer_quadro):
+    """Alvo do processo de uma câmera; envia ("leitura" | "estatisticas" | "fim", camera_id, dados) por `saida`."""
+    camera_id = camera["id"]
+    arquivo = _eh_arquivo(camera["url"])
+    captura = cv2.VideoCapture(camera["url"])
+    if not captura.isOpened():
+        saida.put(("fim", camera_id, {"erro": "Não foi possível abrir o stream."}))
+        return
+
+    amostragem = _Amostragem()
+    quadros = queue.Queue(maxsize=TAMANHO_FILA_QUADROS)
+    parar_leitura = threading.Event()
+    leitor = threading.Thread(target=_ler_stream, args=(captura, quadros, amostragem, parar_leitura, arquivo),
+                              name=f"camera-{camera_id}", daemon=True)
+    leitor.start()
+
+    anterior = None
+    ultimo_movimento = float("-inf")
+    vistas = {}  # chave_veiculo(placa) -> instante da última leitura
+    contadores = {"com_movimento": 0, "ocr": 0, "leituras": 0, "repetidas": 0}
+    proximas_estatisticas = time.monotonic() + INTERVALO_ESTATISTICAS_S
+
+    def enviar_estatisticas():
+        saida.put(("estatisticas", camera_id, dict(
+            contadores, lidos=amostragem.lidos, amostrados=amostragem.amostrados,
+            descartados=amostragem.descartados, intervalo=amostragem.intervalo)))
+
+    try:
+        while not parar.is_set():
+            if time.monotonic() >= proximas_estatisticas:
+                enviar_estatisticas()
+                proximas_estatisticas = time.monotonic() + INTERVALO_ESTATISTICAS_S
+            try:
+                item = quadros.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            instante, quadro = item
+            cinza = cv2.cvtColor(quadro, cv2.COLOR_BGR2GRAY) if quadro.ndim == 3 else quadro
+
+            pequeno = cv2.GaussianBlur(cv2.resize(cinza, (160, 120), interpolation=cv2.INTER_AREA), (5, 5), 0)
+            if anterior is None or (cv2.absdiff(pequeno, anterior) > 25).mean() > LIMIAR_MOVIMENTO:
+                ultimo_movimento = instante
+                contadores["com_movimento"] += 1
+            anterior = pequeno
+            if instante - ultimo_movimento > ESPERA_REPOUSO_S:
+                amostragem.intervalo = INTERVALO_REPOUSO_S
+                continue
+            amostragem.intervalo = INTERVALO_MOVIMENTO_S
+
+            contadores["ocr"] += 1
+            leitura = reconhecer(*normalizar_cinza(cinza))
+            placa = leitura.get("placa")
+            if not placa or leitura["confianca"] < CONFIANCA_MINIMA:
+                continue
+            chave = chave_veiculo(placa)
+            ultima_vez = vistas.get(chave)
+            # Atualiza sempre: enquanto o carro continua à vista, a janela se estende
+            vistas[chave] = instante
+            if ultima_vez is not None and instante - ultima_vez < JANELA_DEDUP_S:
+                contadores["repetidas"] += 1
+                continue
+            vistas = {p: t for p, t in vistas.items() if instante - t < JANELA_DEDUP_S}
+            contadores["leituras"] += 1
+            saida.put(("leitura", camera_id, {"placa": placa, "confianca": leitura["confianca"],
+                                               "ts": time.time(), "instante_video": round(instante, 2)}))
+        saida.put(("fim", camera_id, {"erro": None if arquivo else "Stream encerrado."}))
+    finally:
+        parar_leitura.set()
+        # Libera a thread de leitura se ela estiver esperando espaço na fila
+        while leitor.is_alive():
+            try:
+                quadros.get_nowait()
+            except queue.Empty:
+                leitor.join(0.1)
+        enviar_estatisticas()
+        captura.release()
+
+
+# --- Serviço no servidor ---
+
+class ServicoCameras:
+    def __init__(self, reconhecer=reconhecer_quadro):
+        self.reconhecer = reconhecer
+        self._contexto = multiprocessing.get_context("spawn")
+        self._saida = None
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._threads = []
+        self._cameras = {}  # camera_id -> estado (config, processo, evento de parada, contadores)
+        self.motivo_indisponivel = None
+
+    def iniciar(self):
+        if cv2 is None:
+            self.motivo_indisponivel = "OpenCV não instalado (opencv-python-headless)."
+        elif self.reconhecer is reconhecer_quadro and not ocr_disponivel():
+            self.motivo_indisponivel = "OCR de placas indisponível (ver ocr_placas.py)."
+        if self.motivo_indisponivel:
+            print(f"Câmeras desativadas: {self.motivo_indisponivel}")
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._parar.clear()
+            self._saida = self._contexto.Queue()
+            self._threads = [
+                threading.Thread(target=self._consumir, name="cameras", daemon=True),
+                threading.Thread(target=self._supervisionar, name="cameras-supervisor", daemon=True),
+            ]
+            for thread in self._threads:
+                thread.start()
+        self.recarregar()
+
+    def recarregar(self):
+        """Sincroniza os processos com a tabela cameras (chamado após cadastrar/alterar/excluir)."""
+        if self._saida is None:
+            return
+        ativas = {c["id"]: c for c in listar_cameras(somente_ativas=True)}
+        with self._lock:
+            for camera_id in list(self._cameras):
+                if self._cameras[camera_id]["config"] != ativas.get(camera_id):
+                    self._parar_camera(self._cameras.pop(camera_id))
+            for camera_id, config in ativas.items():
+                if camera_id not in self._cameras:
+                    self._cameras[camera_id] = {
+                        "config": config, "processo": None, "parar": None, "reinicios": 0,
+                        "espera": ESPERA_REINICIO_S, "reiniciar_em": 0, "finalizada": False,
+                        "ultimo_erro": None, "ultima_leitura": None, "eventos": 0, "recusados": 0,
+                        "estatisticas": {},
+                    }
+                    self._iniciar_processo(self._cameras[camera_id])
+
+    def _iniciar_processo(self, estado):
+        estado["parar"] = self._contexto.Event()
+        estado["processo"] = self._contexto.Process(
+            target=executar_camera, args=(estado["config"], self._saida, estado["parar"], self.reconhecer),
+            name=f"camera-{estado['config']['id']}", daemon=True)
+        estado["processo"].start()
+        estado["iniciado_em"] = time.monotonic()
+
+    @staticmethod
+    def _parar_camera(estado, timeout=5):
+        processo = estado["processo"]
+        if processo is None:
+            return
+        estado["parar"].set()
+        processo.join(timeout)
+        if processo.is_alive():
+            processo.terminate()
+            processo.join(1)
+
+    def _supervisionar(self):
+        while not self._parar.wait(2):
+            agora = time.monotonic()
+            with self._lock:
+                for estado in self._cameras.values():
+                    processo = estado["processo"]
+                    if estado["finalizada"] or processo is None or processo.is_alive():
+                        continue
+                    if not estado["reiniciar_em"]:
+                        # Caiu: se rodou bem por um tempo, volta a esperar pouco antes de reiniciar
+                        if agora - estado["iniciado_em"] > ESPERA_REINICIO_MAX_S:
+                            estado["espera"] = ESPERA_REINICIO_S
+                        estado["reiniciar_em"] = agora + estado["espera"]
+                        estado["espera"] = min(estado["espera"] * 2, ESPERA_REINICIO_MAX_S)
+                    elif agora >= estado["reiniciar_em"]:
+                        estado["reiniciar_em"] = 0
+                        estado["reinicios"] += 1
+                        self._iniciar_processo(estado)
+
+    def _consumir(self):
+        while not self._parar.is_set():
+            try:
+                tipo, camera_id, dados = self._saida.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                estado = self._cameras.get(camera_id)
+            if estado is None:
+                continue
+            try:
+                if tipo == "leitura":
+                    self._registrar(estado, dados)
+                elif tipo == "estatisticas":
+                    estado["estatisticas"] = dados
+                elif tipo == "fim":
+                    estado["ultimo_erro"] = dados.get("erro")
+                    # Arquivo de vídeo que terminou não é reiniciado; stream que caiu é
+                    estado["finalizada"] = dados.get("erro") is None
+            except Exception as e:
+                print(f"Erro ao registrar leitura da câmera {camera_id}: {e}")
+
+    def _registrar(self, estado, leitura):
+        camera = estado["config"]
+        placa = leitura["placa"]
+        estado["ultima_leitura"] = leitura
+        if camera["direcao"] == "entrada":
+            res = registrar_entrada(placa, camera["tipo"], camera["empresa_id"])
+            acao, detalhes = "ENTRADA VEÍCULO", f"Placa: {placa} | Tipo: {camera['tipo']}"
+        else:
+            res = registrar_saida(placa, camera["empresa_id"])
+            # Placa como foi gravada na entrada (ver services.registrar_saida)
+            acao, detalhes = "SAÍDA VEÍCULO", f"Placa: {res.get('placa', placa)}"
+        if "status" not in res:
+            # Ex.: carro já no pátio (câmera de entrada) ou que não entrou (câmera de saída)
+            estado["recusados"] += 1
+            return
+        estado["eventos"] += 1
+        registrar_log(f"camera:{camera['nome']}", acao, camera["empresa_id"],
+                      f"{detalhes} (câmera, confiança {round(leitura['confianca'] * 100)}%)")
+
+    def estatisticas(self, empresa_id=None):
+        """Situação de cada câmera (da empresa, se informada)."""
+        with self._lock:
+            cameras = []
+            for estado in self._cameras.values():
+                config = estado["config"]
+                if empresa_id is not None and config["empresa_id"] != empresa_id:
+                    continue
+                processo = estado["processo"]
+                cameras.append({
+                    "id": config["id"], "nome": config["nome"], "direcao": config["direcao"],
+                    "rodando": bool(processo and processo.is_alive()), "finalizada": estado["finalizada"],
+                    "reinicios": estado["reinicios"], "ultimo_erro": estado["ultimo_erro"],
+                    "eventos": estado["eventos"], "recusados": estado["recusados"],
+                    "ultima_leitura": estado["ultima_leitura"], **estado["estatisticas"],
+                })
+        return {"disponivel": self.motivo_indisponivel is None, "motivo": self.motivo_indisponivel,
+                "cameras": cameras}
+
+    def encerrar(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+            cameras, self._cameras = list(self._cameras.values()), {}
+        self._parar.set()
+        for estado in cameras:
+            self._parar_camera(estado)
+        for thread in threads:
+            thread.join(5)
+
+
+servico_cameras = ServicoCameras()
+
+
+def _testar_arquivo(caminho):
+    """Roda o pipeline de uma câmera sobre um arquivo e mostra as leituras (nada é registrado)."""
+    saida = queue.Queue()
+    inicio = time.perf_counter()
+    executar_camera({"id": 0, "url": caminho}, saida, threading.Event())
+    while not saida.empty():
+        tipo, _, dados = saida.get()
+        print(tipo, dados)
+    print(f"Tempo total: {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Uso: python cameras.py <arquivo de vídeo ou URL rtsp://>")
+    _testar_arquivo(sys.argv[1])
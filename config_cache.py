@@ -0,0 +1,114 @@
+# config_cache.py
+"""Cache em memória da tabela configuracoes (CSS personalizado, config visual e versão do app).
+
+Esses valores são lidos a cada carregamento de página e quase nunca mudam.
+O cache guarda um snapshot imutável e só volta ao banco quando:
+
+- este processo grava uma configuração (invalidar() logo após o commit);
+- o contador em config_versao mudou. Triggers em configuracoes incrementam
+  o contador em qualquer escrita (inclusive pelo painel SQL), e cada worker
+  confere o contador no máximo a cada VERIFICAR_A_CADA_S segundos.
+
+Cada valor tem um ETag (hash do conteúdo) para as rotas responderem 304.
+"""
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+
+from db import get_db_connection
+
+VERIFICAR_A_CADA_S = 2.0
+
+VERSAO_APP_PADRAO = "1.0.0"
+CHANGELOG_PADRAO = "Versão inicial."
+
+
+def _etag(texto):
+    return '"' + hashlib.sha256(texto.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+@dataclass(frozen=True)
+class ConfigSistema:
+    versao: int
+    css: str = ""
+    visual: dict = field(default_factory=dict)
+    versao_app: str = VERSAO_APP_PADRAO
+    changelog: str = CHANGELOG_PADRAO
+    etag_css: str = ""
+    etag_visual: str = ""
+
+
+def _versao_banco(conn):
+    row = conn.execute("SELECT versao FROM config_versao WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def _carregar(conn):
+    versao = _versao_banco(conn)
+    valores = dict(conn.execute("""
+        SELECT chave, valor FROM configuracoes
+        WHERE chave IN ('custom_css', 'visual_config', 'app_version', 'app_changelog')
+    """).fetchall())
+    css = valores.get("custom_css") or ""
+    visual_texto = valores.get("visual_config")
+    try:
+        visual = json.loads(visual_texto) if visual_texto else {}
+    except ValueError:
+        visual = {}
+    return ConfigSistema(
+        versao=versao,
+        css=css,
+        visual=visual,
+        versao_app=valores.get("app_version") or VERSAO_APP_PADRAO,
+        changelog=valores.get("app_changelog") or CHANGELOG_PADRAO,
+        etag_css=_etag(css),
+        etag_visual=_etag(json.dumps(visual, sort_keys=True)),
+    )
+
+
+class CacheConfig:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._atual = None
+        self._verificado_em = 0.0
+        self._stats = {"leituras": 0, "recargas": 0, "verificacoes": 0}
+
+    def carregar(self):
+        """Lê tudo do banco (startup e após invalidação)."""
+        config = _carregar(get_db_connection())
+        with self._lock:
+            self._atual = config
+            self._verificado_em = time.monotonic()
+            self._stats["recargas"] += 1
+        return config
+
+    def invalidar(self):
+        with self._lock:
+            self._atual = None
+
+    def obter(self):
+        """Snapshot atual; confere o contador do banco no máximo a cada VERIFICAR_A_CADA_S."""
+        with self._lock:
+            atual = self._atual
+            self._stats["leituras"] += 1
+            precisa_verificar = atual is not None and time.monotonic() - self._verificado_em >= VERIFICAR_A_CADA_S
+            if precisa_verificar:
+                # Marca antes de consultar: as outras threads seguem com o snapshot atual
+                self._verificado_em = time.monotonic()
+                self._stats["verificacoes"] += 1
+        if atual is None:
+            return self.carregar()
+        if precisa_verificar and _versao_banco(get_db_connection()) != atual.versao:
+            return self.carregar()
+        return atual
+
+    def estatisticas(self):
+        with self._lock:
+            dados = dict(self._stats)
+            dados["versao"] = self._atual.versao if self._atual else None
+        return dados
+
+
+cache_config = CacheConfig()
@@ -1,23 +1,21 @@
-import sqlite3
 import re
 import csv
 import os
 from datetime import datetime
+# Mesmo pool (WAL + pragmas) usado pela API
+from db import get_db_connection
+from migrations import aplicar_migracoes, preencher_timestamps_legados
+from datas import agora_movimentacao, intervalo_do_dia, intervalo_do_mes
+from placas import normalizar_placa, placa_valida
 
-
-def get_db_connection():
-    """Cria e retorna uma nova conexão com o banco de dados."""
-    return sqlite3.connect("estacionamento.db", timeout=10)
+# O script de terminal grava sem empresa_id, ou seja, na empresa padrão (DEFAULT 1)
+EMPRESA_PADRAO = 1
 
 
 def setup_database():
-    """Garante que a tabela e as colunas necessárias existam para o script de terminal."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""CREATE TABLE IF NOT EXISTS movimentacoes ( id INTEGER PRIMARY KEY AUTOINCREMENT,
-                       placa TEXT NOT NULL, tipo TEXT NOT NULL, entrada TEXT NOT NULL, saida TEXT)""")
-        ensure_columns(cursor)
-        conn.commit()
+    """Garante que as tabelas, colunas e índices existam para o script de terminal."""
+    aplicar_migracoes()
+    preencher_timestamps_legados()
 
 
 def registrar_responsavel():
@@ -72,36 +70,6 @@ def registrar_cpf():
     print("CPF registrado com sucesso!")
 
 
-def ensure_columns(cursor):
-    # Garante que as colunas responsavel e cpf_responsavel existam
-    cursor.execute("PRAGMA table_info(movimentacoes)")
-    cols = [r[1] for r in cursor.fetchall()]
-    if 'responsavel' not in cols:
-        cursor.execute("ALTER TABLE movimentacoes ADD COLUMN responsavel TEXT")
-    if 'cpf_responsavel' not in cols:
-        cursor.execute(
-            "ALTER TABLE movimentacoes ADD COLUMN cpf_responsavel TEXT")
-
-# normalizacao da placa
-
-
-def normalizar_placa(placa):
-    return placa.upper().replace("-", "").replace(" ", "")
-
-# validacao da placa
-
-
-def placa_valida(placa):
-    placa = normalizar_placa(placa)
-
-    padrao_antigo = r'^[A-Z]{3}[0-9]{4}$'
-    padrao_mercosul = r'^[A-Z]{3}[0-9][A-Z][0-9]{2}$'
-
-    return (
-        re.match(padrao_antigo, placa) is not None or
-        re.match(padrao_mercosul, placa) is not None
-    )
-
 # registro de entrada
 
 
@@ -188,12 +156,12 @@ def registrar_entrada():
                 continue
             cpf_responsavel = cpf_digits
             break
-        entrada = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+        entrada, entrada_ts = agora_movimentacao()
 
         cursor.execute("""
-                       INSERT INTO movimentacoes (placa, tipo, entrada, responsavel, cpf_responsavel)
-                       VALUES (?, ?, ?, ?, ?)
-                       """, (placa, tipo, entrada, responsavel or None, cpf_responsavel or None))
+                       INSERT INTO movimentacoes (placa, tipo, entrada, entrada_ts, responsavel, cpf_responsavel)
+                       VALUES (?, ?, ?, ?, ?, ?)
+                       """, (placa, tipo, entrada, entrada_ts, responsavel or None, cpf_responsavel or None))
 
         conn.commit()
     print("Entrada do veículo registrada com sucesso!")
@@ -208,12 +176,12 @@ def registrar_saida():
         print("Placa Inválida!")
         return
 
-    saida = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    saida, saida_ts = agora_movimentacao()
 
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "UPDATE movimentacoes SET saida = ? WHERE placa = ? AND saida IS NULL", (saida, placa))
+            "UPDATE movimentacoes SET saida = ?, saida_ts = ? WHERE placa = ? AND saida IS NULL", (saida, saida_ts, placa))
 
         if cursor.rowcount == 0:
             print("Veiculo não encontrado ou já saiu.")
@@ -242,30 +210,35 @@ def listar_veiculos_dentro():
 # Criar relatorios
 
 
+def buscar_movimentacoes_periodo(inicio, fim):
+    """Movimentações com entrada no intervalo [inicio, fim) em epoch (idx_mov_entrada_ts)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT placa, tipo, entrada, saida, responsavel, cpf_responsavel
+            FROM movimentacoes
+            WHERE empresa_id = ? AND entrada_ts >= ? AND entrada_ts < ?
+            ORDER BY entrada_ts
+            """, (EMPRESA_PADRAO, inicio, fim))
+        return cursor.fetchall()
+
+
 def relatório(tipo):
     if tipo == "diario":
         filtro = datetime.now().strftime("%d-%m-%Y")
         titulo = f"RELATÓRIO DO DIA {filtro}"
-        like = f"{filtro}%"
+        inicio, fim = intervalo_do_dia()
 
     elif tipo == "mensal":
         filtro = datetime.now().strftime("%m-%Y")
-        titulo = f"%-{filtro}%"
-        like = f"{filtro}%"
+        titulo = f"RELATÓRIO DO MÊS {filtro}"
+        inicio, fim = intervalo_do_mes()
 
     else:
         print("Tipo de relatório inválido")
         return
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT placa, tipo, entrada, saida, responsavel, cpf_responsavel
-            FROM movimentacoes
-            WHERE entrada LIKE ?
-            """, (like,))
-
-        registros = cursor.fetchall()
+    registros = buscar_movimentacoes_periodo(inicio, fim)
 
     print(f"\n{titulo}")
 
@@ -287,12 +260,12 @@ def exportar_relatório(tipo):
     if tipo == "diario":
         filtro = datetime.now().strftime("%d-%m-%Y")
         nome_arquivo = f"relatorio_diario_{filtro}.csv"
-        like = f"{filtro}%"
+        inicio, fim = intervalo_do_dia()
 
     elif tipo == "mensal":
         filtro = datetime.now().strftime("%m-%Y")
         nome_arquivo = f"relatorio_mensal_{filtro}.csv"
-        like = f"%-{filtro}%"
+        inicio, fim = intervalo_do_mes()
 
     else:
         print("Tipo inválido")
@@ -300,15 +273,7 @@ def exportar_relatório(tipo):
 
     caminho = os.path.join(pasta_projeto, nome_arquivo)
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT placa, tipo, entrada, saida, responsavel, cpf_responsavel
-            FROM movimentacoes
-            WHERE entrada LIKE ?
-        """, (like,))
-
-        registros = cursor.fetchall()
+    registros = buscar_movimentacoes_periodo(inicio, fim)
 
     if not registros:
         print("Nenhum dado para exportar.")
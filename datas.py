@@ -0,0 +1,94 @@
+# datas.py
+"""Conversões de data/hora das movimentações.
+
+As colunas `entrada`/`saida` continuam guardando o texto de exibição
+("dd-mm-YYYY HH:MM:SS"), e `entrada_ts`/`saida_ts` guardam o mesmo instante
+em epoch (segundos, horário local do servidor) para filtros e ordenação.
+"""
+from datetime import datetime, timedelta
+
+import pytz
+
+FORMATO_MOVIMENTACAO = "%d-%m-%Y %H:%M:%S"
+
+# Fuso das datas exibidas no histórico de ações e no chat (montar o fuso do pytz é caro)
+FUSO_SP = pytz.timezone('America/Sao_Paulo')
+
+# Formatos encontrados em bancos antigos (gravados à mão ou por versões anteriores)
+_FORMATOS_LEGADOS = (
+    FORMATO_MOVIMENTACAO,
+    "%d-%m-%Y %H.%M.%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%d/%m/%Y %H:%M:%S",
+    "%d-%m-%Y %H:%M",
+    "%d/%m/%Y %H:%M",
+)
+
+
+def agora_movimentacao():
+    """Retorna (texto de exibição, epoch) do instante atual."""
+    agora = datetime.now().replace(microsecond=0)
+    return agora.strftime(FORMATO_MOVIMENTACAO), int(agora.timestamp())
+
+
+def movimentacao_de_epoch(ts):
+    """Retorna (texto de exibição, epoch) de um instante informado pelo cliente (ex.: leitura offline)."""
+    ts = int(ts)
+    return datetime.fromtimestamp(ts).strftime(FORMATO_MOVIMENTACAO), ts
+
+
+def texto_para_epoch(texto, fuso=None):
+    """Converte o texto de entrada/saida (qualquer formato legado) em epoch, ou None.
+
+    Sem `fuso` o texto é interpretado no horário local do servidor; com um
+    fuso do pytz (ex.: histórico de ações, gravado em America/Sao_Paulo), nele.
+    """
+    if not texto:
+        return None
+    texto = texto.strip()
+    for formato in _FORMATOS_LEGADOS:
+        try:
+            data = datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+        if fuso is not None:
+            data = fuso.localize(data)
+        return int(data.timestamp())
+    return None
+
+
+def intervalo_do_dia(dia=None):
+    """(início, fim) em epoch do dia informado (padrão: hoje), fim exclusivo."""
+    dia = dia or datetime.now()
+    inicio = datetime(dia.year, dia.month, dia.day)
+    return int(inicio.timestamp()), int((inicio + timedelta(days=1)).timestamp())
+
+
+def intervalo_do_mes(dia=None):
+    """(início, fim) em epoch do mês informado (padrão: mês atual), fim exclusivo."""
+    dia = dia or datetime.now()
+    inicio = datetime(dia.year, dia.month, 1)
+    if dia.month == 12:
+        fim = datetime(dia.year + 1, 1, 1)
+    else:
+        fim = datetime(dia.year, dia.month + 1, 1)
+    return int(inicio.timestamp()), int(fim.timestamp())
+
+
+def intervalo_de_datas(data_inicio=None, data_fim=None, fuso=None):
+    """Converte filtros "YYYY-MM-DD" (fim inclusivo) em (início, fim) epoch, fim exclusivo.
+
+    Um dos lados pode ser None (sem limite). Lança ValueError se a data for inválida.
+    """
+    def epoch(dia):
+        data = datetime.strptime(dia, "%Y-%m-%d")
+        if fuso is not None:
+            data = fuso.localize(data)
+        return int(data.timestamp())
+
+    inicio = epoch(data_inicio) if data_inicio else None
+    fim = None
+    if data_fim:
+        dia_seguinte = datetime.strptime(data_fim, "%Y-%m-%d") + timedelta(days=1)
+        fim = epoch(dia_seguinte.strftime("%Y-%m-%d"))
+    return inicio, fim
@@ -0,0 +1,165 @@
+# db.py
+"""Pool de conexões SQLite compartilhado por services.py e controle_veiculos.py.
+
+Cada thread de trabalho (threadpool do FastAPI/uvicorn) recebe UMA conexão,
+aberta e configurada uma única vez (WAL, pragmas e cache de statements) e
+reaproveitada em todas as consultas seguintes daquela thread.
+"""
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+DB_PATH = os.getenv("DB_PATH", "estacionamento.db")
+
+# Tamanho do cache de prepared statements por conexão (padrão do sqlite3 é 128)
+CACHED_STATEMENTS = 256
+# Quantas vezes repetir um comando que recebeu "database is locked/busy"
+MAX_BUSY_RETRIES = 5
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # leitores não bloqueiam escritores (polls de /veiculos)
+    "PRAGMA synchronous=NORMAL",    # seguro com WAL e bem mais rápido que FULL
+    "PRAGMA cache_size=-16000",     # ~16 MB de page cache por conexão
+    "PRAGMA mmap_size=134217728",   # 128 MB de leitura via mmap
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=10000",    # mesmo timeout=10 usado antes
+)
+
+_local = threading.local()
+_lock = threading.Lock()
+_conexoes = []
+# Incrementado por fechar_conexoes() para invalidar as conexões de todas as threads
+_geracao = 0
+_stats = {
+    "conexoes_abertas": 0,
+    "checkouts": 0,
+    "esperas": 0,
+    "retentativas_busy": 0,
+    "tempo_espera_ms": 0.0,
+}
+
+
+def _incrementar(chave, valor=1):
+    with _lock:
+        _stats[chave] += valor
+
+
+def _is_busy(erro):
+    msg = str(erro).lower()
+    return "locked" in msg or "busy" in msg
+
+
+class PooledCursor(sqlite3.Cursor):
+    """Cursor que repete o comando quando o banco está ocupado (SQLITE_BUSY)."""
+
+    def _com_retentativa(self, metodo, *args):
+        tentativa = 0
+        while True:
+            try:
+                return metodo(*args)
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or tentativa >= MAX_BUSY_RETRIES:
+                    raise
+                tentativa += 1
+                if tentativa == 1:
+                    _incrementar("esperas")
+                _incrementar("retentativas_busy")
+                espera = 0.05 * (2 ** (tentativa - 1))
+                time.sleep(espera)
+                _incrementar("tempo_espera_ms", espera * 1000)
+
+    def execute(self, sql, parameters=()):
+        return self._com_retentativa(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._com_retentativa(super().executemany, sql, seq_of_parameters)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Conexão cujos cursores (inclusive os de conn.execute) usam PooledCursor."""
+
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+
+class _SlotThread:
+    """Guarda a conexão da thread; quando a thread termina, o slot é coletado
+    e a conexão é fechada e devolvida (ver weakref.finalize em get_db_connection)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pid = os.getpid()
+        self.geracao = _geracao
+
+
+def _descartar_conexao(conn, pid):
+    with _lock:
+        if conn in _conexoes:
+            _conexoes.remove(conn)
+    if pid != os.getpid():
+        # Conexão herdada por fork: pertence ao processo pai, não mexer
+        return
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _abrir_conexao():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=10,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+        factory=PooledConnection,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _lock:
+        _conexoes.append(conn)
+        _stats["conexoes_abertas"] += 1
+    return conn
+
+
+def get_db_connection():
+    """Retorna a conexão da thread atual (criando-a no primeiro uso).
+
+    Pode ser usada com `with get_db_connection() as conn:` exatamente como
+    antes: o bloco faz commit/rollback, mas a conexão NÃO é fechada.
+    """
+    slot = getattr(_local, "slot", None)
+    # Após um fork (ProcessPool/multiprocessing) a conexão herdada não pode ser usada
+    if slot is None or slot.pid != os.getpid() or slot.geracao != _geracao:
+        slot = _SlotThread(_abrir_conexao())
+        weakref.finalize(slot, _descartar_conexao, slot.conn, slot.pid)
+        _local.slot = slot
+    conn = slot.conn
+    # Algumas funções trocam o row_factory; cada checkout começa com tuplas
+    conn.row_factory = None
+    _incrementar("checkouts")
+    return conn
+
+
+def estatisticas_pool():
+    """Contadores do pool para diagnosticar contenção no banco."""
+    with _lock:
+        dados = dict(_stats)
+        dados["conexoes_ativas"] = len(_conexoes)
+    dados["tempo_espera_ms"] = round(dados["tempo_espera_ms"], 1)
+    return dados
+
+
+def fechar_conexoes():
+    """Fecha todas as conexões do pool (usado no shutdown do servidor)."""
+    global _geracao
+    with _lock:
+        _geracao += 1
+        conexoes = list(_conexoes)
+        _conexoes.clear()
+    for conn in conexoes:
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,125 @@
+# eventos.py
+"""Barramento de eventos em memória para os canais de push (SSE).
+
+Cada tópico (ex.: "patio:1") guarda os últimos eventos num buffer circular
+com IDs crescentes, para que um cliente que reconectou possa continuar de
+onde parou (Last-Event-ID). As funções de services.py publicam de threads
+comuns; os endpoints async esperam com `aguardar`, sem polling.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+TAMANHO_BUFFER = 500
+
+
+class _Topico:
+    def __init__(self, tamanho_buffer):
+        self.eventos = deque(maxlen=tamanho_buffer)
+        # ID do evento mais novo que já saiu do buffer circular
+        self.ultimo_descartado = 0
+
+
+class BarramentoEventos:
+    def __init__(self, tamanho_buffer=TAMANHO_BUFFER):
+        self._tamanho_buffer = tamanho_buffer
+        self._lock = threading.Lock()
+        # IDs partem do relógio (ms) para continuarem crescendo após um restart
+        self._primeiro_id = int(time.time() * 1000)
+        self._ids = itertools.count(self._primeiro_id)
+        self._ultimo_id = self._primeiro_id - 1
+        self._buffers = {}
+        # tópico -> conjunto de (loop, asyncio.Event) esperando novidades
+        self._ouvintes = {}
+
+    def publicar(self, topico, tipo, dados):
+        """Publica um evento (pode ser chamado de qualquer thread). Retorna o ID."""
+        with self._lock:
+            evento_id = next(self._ids)
+            self._ultimo_id = evento_id
+            t = self._buffers.get(topico)
+            if t is None:
+                t = self._buffers[topico] = _Topico(self._tamanho_buffer)
+            if len(t.eventos) == t.eventos.maxlen:
+                t.ultimo_descartado = t.eventos[0][0]
+            t.eventos.append((evento_id, tipo, dados))
+            ouvintes = list(self._ouvintes.get(topico, ()))
+        for loop, sinal in ouvintes:
+            try:
+                loop.call_soon_threadsafe(sinal.set)
+            except RuntimeError:
+                # Loop já encerrado (cliente desconectou durante o shutdown)
+                pass
+        return evento_id
+
+    def ultimo_id(self):
+        with self._lock:
+            return self._ultimo_id
+
+    def eventos_desde(self, topico, ultimo_id):
+        """Eventos do tópico com ID > ultimo_id.
+
+        Retorna None quando o buffer já descartou eventos posteriores a
+        ultimo_id, ou quando o ID veio de antes de um restart do servidor (o
+        cliente precisa de um snapshot novo).
+        """
+        if ultimo_id < self._primeiro_id - 1:
+            return None
+        with self._lock:
+            t = self._buffers.get(topico)
+            if t is None:
+                return []
+            if t.ultimo_descartado > ultimo_id:
+                return None
+            return [e for e in t.eventos if e[0] > ultimo_id]
+
+    async def aguardar(self, topico, ultimo_id, timeout=15):
+        """Espera até haver eventos novos no tópico (ou timeout). Retorna a lista (ou None)."""
+        sinal = asyncio.Event()
+        ouvinte = (asyncio.get_running_loop(), sinal)
+        with self._lock:
+            self._ouvintes.setdefault(topico, set()).add(ouvinte)
+        try:
+            eventos = self.eventos_desde(topico, ultimo_id)
+            if eventos:
+                return eventos
+            try:
+                await asyncio.wait_for(sinal.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+            return self.eventos_desde(topico, ultimo_id)
+        finally:
+            with self._lock:
+                ouvintes = self._ouvintes.get(topico)
+                if ouvintes is not None:
+                    ouvintes.discard(ouvinte)
+                    if not ouvintes:
+                        del self._ouvintes[topico]
+
+    def total_ouvintes(self):
+        with self._lock:
+            return {topico: len(o) for topico, o in self._ouvintes.items()}
+
+
+barramento = BarramentoEventos()
+
+
+def formatar_sse(evento_id, tipo, dados):
+    """Serializa um evento no formato text/event-stream (sem linha id: se evento_id for None)."""
+    linha_id = f"id: {evento_id}\n" if evento_id is not None else ""
+    return f"{linha_id}event: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+def topico_patio(empresa_id):
+    return f"patio:{empresa_id}"
+
+
+def topico_chat(empresa_id):
+    return f"chat:{empresa_id}"
+
+
+# Todos os protocolos de todas as empresas (painel de suporte dev/admin, igual a list_protocols)
+TOPICO_CHAT_SUPORTE = "chat:suporte"
@@ -0,0 +1,186 @@
+# executores.py
+"""Executores para tirar trabalho bloqueante do event loop do uvicorn.
+
+- IO: pool de threads limitado (arquivos, psutil, chamadas de rede síncronas).
+- CPU: pool de processos para o que segura CPU por muito tempo (compactação
+  de backups), assim nem o GIL do processo do servidor é disputado.
+- OCR: pool de processos próprio para o reconhecimento de placas, para uma
+  rajada de fotos não atrasar logins e backups no pool de CPU.
+- Senhas: pool de processos próprio para o bcrypt do login (ver senhas.py). O
+  número de workers é o limite de verificações simultâneas: na troca de turno
+  os logins fazem fila ali sem tomar os núcleos do resto do servidor.
+- Jobs: pool de processos da fila de jobs em segundo plano (ver fila_jobs.py);
+  o número de workers é o limite de jobs rodando ao mesmo tempo.
+
+As rotas/tarefas async usam `await executar_io(...)` / `await executar_cpu(...)`
+/ `await executar_ocr(...)` / `await executar_senha(...)` / `await executar_job(...)`.
+Cada pool tem contadores de fila em `estatisticas_executores()`.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+MAX_THREADS_IO = int(os.getenv("MAX_THREADS_IO", "8"))
+MAX_PROCESSOS_CPU = int(os.getenv("MAX_PROCESSOS_CPU", str(min(4, os.cpu_count() or 1))))
+MAX_PROCESSOS_OCR = int(os.getenv("MAX_PROCESSOS_OCR", str(max(1, (os.cpu_count() or 1) // 2))))
+MAX_PROCESSOS_SENHA = int(os.getenv("MAX_PROCESSOS_SENHA", str(max(1, (os.cpu_count() or 1) // 2))))
+MAX_JOBS_SIMULTANEOS = int(os.getenv("MAX_JOBS_SIMULTANEOS", "2"))
+
+
+class _Metricas:
+    """Profundidade de fila e tempos de um pool (tarefas enviadas pelo servidor)."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self.pendentes = 0
+        self.pico_pendentes = 0
+        self.concluidas = 0
+        self.erros = 0
+        self.tempo_total_ms = 0.0
+        self.tempo_max_ms = 0.0
+
+    def entrou(self):
+        with self._lock:
+            self.pendentes += 1
+            self.pico_pendentes = max(self.pico_pendentes, self.pendentes)
+
+    def saiu(self, inicio, erro):
+        duracao = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self.pendentes -= 1
+            self.concluidas += 1
+            if erro:
+                self.erros += 1
+            self.tempo_total_ms += duracao
+            self.tempo_max_ms = max(self.tempo_max_ms, duracao)
+
+    def resumo(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pendentes": self.pendentes,
+                # Tarefas esperando um worker livre (o resto está executando)
+                "em_fila": max(0, self.pendentes - self.workers),
+                "pico_pendentes": self.pico_pendentes,
+                "concluidas": self.concluidas,
+                "erros": self.erros,
+                "tempo_medio_ms": round(self.tempo_total_ms / self.concluidas, 1) if self.concluidas else 0,
+                "tempo_max_ms": round(self.tempo_max_ms, 1),
+            }
+
+
+_lock = threading.Lock()
+_pool_io = None
+# nome -> ProcessPoolExecutor (criado no primeiro uso)
+_pools_processos = {}
+_workers_processos = {
+    "cpu": MAX_PROCESSOS_CPU,
+    "ocr": MAX_PROCESSOS_OCR,
+    "senha": MAX_PROCESSOS_SENHA,
+    "jobs": MAX_JOBS_SIMULTANEOS,
+}
+_metricas = {
+    "io": _Metricas(MAX_THREADS_IO),
+    "cpu": _Metricas(MAX_PROCESSOS_CPU),
+    "ocr": _Metricas(MAX_PROCESSOS_OCR),
+    "senha": _Metricas(MAX_PROCESSOS_SENHA),
+    "jobs": _Metricas(MAX_JOBS_SIMULTANEOS),
+}
+
+
+def _get_pool_io():
+    global _pool_io
+    with _lock:
+        if _pool_io is None:
+            _pool_io = ThreadPoolExecutor(max_workers=MAX_THREADS_IO, thread_name_prefix="io")
+        return _pool_io
+
+
+def _get_pool_processos(nome):
+    # Criado só no primeiro uso: os processos não sobem em scripts que não precisam deles
+    with _lock:
+        pool = _pools_processos.get(nome)
+        if pool is None:
+            # "spawn" (igual ao Windows): um fork herdaria travas internas do SQLite
+            # seguradas por outras threads do servidor e o worker ficaria preso
+            pool = ProcessPoolExecutor(max_workers=_workers_processos[nome],
+                                       mp_context=multiprocessing.get_context("spawn"))
+            _pools_processos[nome] = pool
+        return pool
+
+
+def _descartar_pool_processos(nome, pool):
+    with _lock:
+        if _pools_processos.get(nome) is pool:
+            del _pools_processos[nome]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _executar(nome, pool, func, args):
+    metricas = _metricas[nome]
+    metricas.entrou()
+    inicio = time.perf_counter()
+    erro = True
+    try:
+        resultado = await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+        erro = False
+        return resultado
+    finally:
+        metricas.saiu(inicio, erro)
+
+
+async def executar_io(func, *args):
+    """Roda func(*args) no pool de threads de IO sem bloquear o event loop."""
+    return await _executar("io", _get_pool_io(), func, args)
+
+
+async def _executar_em_processo(nome, func, args):
+    pool = _get_pool_processos(nome)
+    try:
+        return await _executar(nome, pool, func, args)
+    except BrokenProcessPool:
+        # Um worker morreu (ex.: falta de memória): recria o pool na próxima chamada
+        _descartar_pool_processos(nome, pool)
+        raise
+
+
+async def executar_cpu(func, *args):
+    """Roda func(*args) no pool de processos (func e args precisam ser picklable)."""
+    return await _executar_em_processo("cpu", func, args)
+
+
+async def executar_ocr(func, *args):
+    """Roda func(*args) no pool de processos do OCR de placas (ver ocr_placas.py)."""
+    return await _executar_em_processo("ocr", func, args)
+
+
+async def executar_senha(func, *args):
+    """Roda func(*args) no pool de processos das senhas (bcrypt do login, ver senhas.py)."""
+    return await _executar_em_processo("senha", func, args)
+
+
+async def executar_job(func, *args):
+    """Roda func(*args) no pool de processos da fila de jobs (ver fila_jobs.py)."""
+    return await _executar_em_processo("jobs", func, args)
+
+
+def estatisticas_executores():
+    """Contadores de fila dos pools de IO, CPU, OCR, senhas e jobs."""
+    return {nome: m.resumo() for nome, m in _metricas.items()}
+
+
+def encerrar_executores():
+    """Encerra os pools (usado no shutdown do servidor)."""
+    global _pool_io
+    with _lock:
+        pools = [p for p in [_pool_io, *_pools_processos.values()] if p is not None]
+        _pool_io = None
+        _pools_processos.clear()
+    for pool in pools:
+        # Espera só o que já está rodando, para os workers saírem limpos
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,161 @@
+# exportacao.py
+"""Exportação em streaming (CSV e XLSX) para respostas HTTP em partes.
+
+Os geradores recebem um iterável de linhas (ex.: services.iterar_historico)
+e devolvem blocos de bytes à medida que as linhas são lidas do banco: a
+memória fica constante e nenhum arquivo é gravado em disco.
+
+O XLSX é montado direto com zipfile (modo streaming, sem seek): o modo
+write-only do openpyxl grava a planilha num arquivo temporário e só produz
+o pacote no save(), o que impediria mandar os bytes ao cliente enquanto o
+banco ainda está sendo lido.
+"""
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+# Linhas escritas antes de entregar um bloco de bytes à resposta
+LINHAS_POR_BLOCO = 500
+# Limite de linhas de uma planilha do Excel (cabeçalho incluso)
+MAX_LINHAS_XLSX = 1_048_576
+# Limite de caracteres de uma célula do Excel
+MAX_CARACTERES_CELULA = 32_767
+
+TIPO_CSV = "text/csv; charset=utf-8"
+TIPO_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Caracteres de controle que não são válidos em XML 1.0
+_INVALIDOS_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+
+_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{nome}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+# Estilo 0 = normal, estilo 1 = negrito (cabeçalho)
+_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+
+class _Saida:
+    """Destino do zipfile: acumula os bytes escritos até o próximo bloco ser entregue."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def _celula(valor, estilo=0):
+    if valor is None:
+        return "<c/>"
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f"<c><v>{valor}</v></c>"
+    texto = _INVALIDOS_XML.sub("", str(valor))[:MAX_CARACTERES_CELULA]
+    atributo_estilo = f' s="{estilo}"' if estilo else ""
+    return f'<c t="inlineStr"{atributo_estilo}><is><t xml:space="preserve">{escape(texto)}</t></is></c>'
+
+
+def _linha_xml(numero, valores, estilo=0):
+    celulas = "".join(_celula(v, estilo) for v in valores)
+    return f'<row r="{numero}">{celulas}</row>'.encode("utf-8")
+
+
+def gerar_xlsx(cabecalho, linhas, nome_planilha="Planilha", larguras=None):
+    """Gera os bytes de um .xlsx com `cabecalho` e as `linhas`, em blocos.
+
+    Para no limite de linhas do Excel (MAX_LINHAS_XLSX); períodos maiores
+    devem ser exportados em CSV.
+    """
+    saida = _Saida()
+    with zipfile.ZipFile(saida, "w", compression=zipfile.ZIP_DEFLATED) as pacote:
+        pacote.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        pacote.writestr("_rels/.rels", _RELS)
+        pacote.writestr("xl/workbook.xml", _WORKBOOK.format(nome=escape(nome_planilha[:31], {'"': "&quot;"})))
+        pacote.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        pacote.writestr("xl/styles.xml", _STYLES)
+
+        # Sem force_zip64: a planilha para no limite de linhas do Excel, bem abaixo de 2 GiB,
+        # e o Excel recusa alguns pacotes zip64 gerados em streaming.
+        with pacote.open("xl/worksheets/sheet1.xml", "w") as planilha:
+            planilha.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                           b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">')
+            if larguras:
+                colunas = "".join(f'<col min="{i}" max="{i}" width="{w}" customWidth="1"/>'
+                                  for i, w in enumerate(larguras, start=1))
+                planilha.write(f"<cols>{colunas}</cols>".encode("utf-8"))
+            planilha.write(b"<sheetData>")
+            planilha.write(_linha_xml(1, cabecalho, estilo=1))
+            for numero, linha in enumerate(linhas, start=2):
+                if numero > MAX_LINHAS_XLSX:
+                    break
+                planilha.write(_linha_xml(numero, linha))
+                if numero % LINHAS_POR_BLOCO == 0:
+                    dados = saida.retirar()
+                    if dados:
+                        yield dados
+            planilha.write(b"</sheetData></worksheet>")
+    yield saida.retirar()
+
+
+def gerar_csv(cabecalho, linhas):
+    """Gera os bytes de um CSV (";", UTF-8 com BOM para o Excel abrir acentos), em blocos."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=";")
+    buffer.write("\ufeff")
+    escritor.writerow(cabecalho)
+    for numero, linha in enumerate(linhas, start=1):
+        escritor.writerow(linha)
+        if numero % LINHAS_POR_BLOCO == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def gerar_exportacao(formato, cabecalho, linhas, nome_planilha="Planilha", larguras=None):
+    """Escolhe o gerador pelo formato ("xlsx" ou "csv"); retorna (gerador, media_type)."""
+    if formato == "csv":
+        return gerar_csv(cabecalho, linhas), TIPO_CSV
+    if formato == "xlsx":
+        return gerar_xlsx(cabecalho, linhas, nome_planilha, larguras), TIPO_XLSX
+    raise ValueError(f"Formato de exportação inválido: {formato}")
@@ -0,0 +1,358 @@
+# fila_jobs.py
+"""Fila de jobs em segundo plano, guardada no SQLite (tabela jobs).
+
+Operações pesadas (backup, exportação do histórico, importação de usuários,
+relatório de evolução, git pull) não rodam mais dentro da requisição: a rota
+chama enfileirar() e devolve o id do job na hora. O DespachanteJobs (uma
+tarefa do event loop) pega os pendentes e roda cada um no pool de processos
+de jobs (executores.executar_job), no máximo MAX_JOBS_SIMULTANEOS por vez.
+Jobs "servidor" (a importação de usuários) são corrotinas no event loop: só
+orquestram, mandando a parte pesada para os pools de executores.py, e mexem
+no estado do servidor (o cache de usuários) sem precisar de outro processo.
+
+- Progresso e cancelamento: a função do job recebe um ContextoJob, que grava
+  o progresso na tabela e lê o pedido de cancelamento (cancelar = 1). Job
+  pendente é cancelado na hora; o que já está rodando para no próximo
+  job.verificar_cancelamento() (jobs que não chamam rodam até o fim).
+- Retentativas: job que falha volta para pendente com espera crescente
+  (ESPERA_RETENTATIVA_S, 2x, 4x...) até max_tentativas do tipo.
+- Arquivos de resultado: a função grava em uploads/ e devolve
+  {"arquivo_gerado": {"caminho_salvo", "nome_original", "tamanho", "tamanho_bytes",
+  "sha256"}} (o SHA-256 é o ETag do download); o arquivo entra
+  na tabela arquivos marcado com o job_id (fora da lista compartilhada) e é
+  baixado por /api/jobs/{id}/arquivo, com o mesmo papel exigido para ver o job.
+  Sai junto com o job em limpar_jobs_antigos().
+
+Como a fila está no banco, jobs pendentes sobrevivem a um reinício; os que
+estavam rodando quando o servidor caiu voltam para pendente na subida
+(contando a tentativa). Pressupõe um processo de servidor por banco, como o
+`uvicorn.run` de app.py.
+"""
+import asyncio
+import importlib
+import json
+import os
+import time
+
+from auditoria import fila_auditoria
+from db import get_db_connection
+from executores import MAX_JOBS_SIMULTANEOS, executar_io, executar_job
+from services import salvar_arquivo_db
+
+PASTA_UPLOADS = "uploads"
+ESPERA_RETENTATIVA_S = 30
+# Fallback para jobs agendados por retentativa (os novos acordam o despachante na hora)
+INTERVALO_VERIFICACAO_S = 5
+RETENCAO_JOBS_DIAS = 30
+# O worker relê o pedido de cancelamento no máximo a cada N segundos
+INTERVALO_CANCELAMENTO_S = 1.0
+
+# tipo -> (função "modulo.funcao", máximo de tentativas, onde roda). A função
+# recebe (job, **parametros) e devolve um dict. "processo": roda num processo do
+# pool de jobs, com ContextoJob (o dict volta por pickle). "servidor": corrotina
+# no event loop, com ContextoJobServidor.
+TIPOS_JOB = {
+    "backup": ("jobs_admin.job_backup", 3, "processo"),
+    "exportar_historico": ("jobs_admin.job_exportar_historico", 2, "processo"),
+    "importar_usuarios": ("importacao_usuarios.importar_usuarios", 2, "servidor"),
+    "relatorio_evolucao": ("jobs_admin.job_relatorio_evolucao", 2, "processo"),
+    "git_pull": ("jobs_admin.job_git_pull", 1, "processo"),
+}
+
+_COLUNAS_JOB = ("id", "tipo", "empresa_id", "usuario", "parametros", "status", "progresso", "mensagem",
+                "resultado", "arquivo_id", "tentativas", "max_tentativas", "cancelar", "disponivel_ts",
+                "criado_ts", "iniciado_ts", "concluido_ts")
+
+
+class JobCancelado(Exception):
+    pass
+
+
+class ContextoJob:
+    """Passado à função do job, no processo do worker."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._cancelado = False
+        self._ultima_verificacao = 0.0
+
+    def progresso(self, percentual, mensagem=None):
+        with get_db_connection() as conn:
+            conn.execute("UPDATE jobs SET progresso = ?, mensagem = COALESCE(?, mensagem) WHERE id = ?",
+                         (round(min(100.0, max(0.0, percentual)), 1), mensagem, self.job_id))
+
+    def cancelado(self):
+        agora = time.monotonic()
+        if not self._cancelado and agora - self._ultima_verificacao >= INTERVALO_CANCELAMENTO_S:
+            self._ultima_verificacao = agora
+            row = get_db_connection().execute("SELECT cancelar FROM jobs WHERE id = ?", (self.job_id,)).fetchone()
+            self._cancelado = bool(row and row[0])
+        return self._cancelado
+
+    def verificar_cancelamento(self):
+        if self.cancelado():
+            raise JobCancelado()
+
+
+class ContextoJobServidor:
+    """ContextoJob dos jobs "servidor": as mesmas operações, async (o banco é lido no pool de IO)."""
+
+    def __init__(self, job_id):
+        self._contexto = ContextoJob(job_id)
+
+    async def progresso(self, percentual, mensagem=None):
+        await executar_io(self._contexto.progresso, percentual, mensagem)
+
+    async def verificar_cancelamento(self):
+        if await executar_io(self._contexto.cancelado):
+            raise JobCancelado()
+
+
+def _funcao_do_tipo(tipo):
+    modulo, funcao = TIPOS_JOB[tipo][0].rsplit(".", 1)
+    return getattr(importlib.import_module(modulo), funcao)
+
+
+def _rodar_job(job_id, tipo, parametros):
+    """Ponto de entrada no worker: importa a função do tipo e a executa."""
+    return _funcao_do_tipo(tipo)(ContextoJob(job_id), **parametros)
+
+
+def _job_para_dict(row):
+    job = dict(zip(_COLUNAS_JOB, row))
+    job["parametros"] = json.loads(job["parametros"] or "{}")
+    job["resultado"] = json.loads(job["resultado"]) if job["resultado"] else None
+    job["cancelar"] = bool(job["cancelar"])
+    return job
+
+
+def _inserir_job(tipo, empresa_id, usuario, parametros):
+    agora = int(time.time())
+    with get_db_connection() as conn:
+        cursor = conn.execute("""
+            INSERT INTO jobs (tipo, empresa_id, usuario, parametros, max_tentativas, disponivel_ts, criado_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (tipo, empresa_id, usuario, json.dumps(parametros), TIPOS_JOB[tipo][1], agora, agora))
+        return cursor.lastrowid
+
+
+def obter_job(job_id, empresa_id):
+    row = get_db_connection().execute(f"""
+        SELECT {", ".join(_COLUNAS_JOB)} FROM jobs WHERE id = ? AND empresa_id = ?
+    """, (job_id, empresa_id)).fetchone()
+    return _job_para_dict(row) if row else None
+
+
+def listar_jobs(empresa_id, tipos, limite=50):
+    """Últimos jobs da empresa, só dos `tipos` informados (os que o papel do usuário vê)."""
+    if not tipos:
+        return []
+    rows = get_db_connection().execute(f"""
+        SELECT {", ".join(_COLUNAS_JOB)} FROM jobs
+        WHERE empresa_id = ? AND tipo IN ({",".join("?" * len(tipos))}) ORDER BY id DESC LIMIT ?
+    """, [empresa_id, *tipos, limite]).fetchall()
+    return [_job_para_dict(row) for row in rows]
+
+
+def job_em_andamento(tipo, empresa_id):
+    """Job do tipo pendente/executando na empresa (para não enfileirar duas vezes), ou None."""
+    row = get_db_connection().execute("""
+        SELECT id FROM jobs WHERE tipo = ? AND empresa_id = ? AND status IN ('pendente', 'executando')
+        ORDER BY id LIMIT 1
+    """, (tipo, empresa_id)).fetchone()
+    return obter_job(row[0], empresa_id) if row else None
+
+
+def cancelar_job(job_id, empresa_id):
+    with get_db_connection() as conn:
+        cursor = conn.execute("""
+            UPDATE jobs SET status = 'cancelado', cancelar = 1, concluido_ts = ?, mensagem = 'Cancelado.'
+            WHERE id = ? AND empresa_id = ? AND status = 'pendente'
+        """, (int(time.time()), job_id, empresa_id))
+        if cursor.rowcount:
+            return {"status": "Job cancelado."}
+        cursor = conn.execute("""
+            UPDATE jobs SET cancelar = 1 WHERE id = ? AND empresa_id = ? AND status = 'executando'
+        """, (job_id, empresa_id))
+        if cursor.rowcount:
+            return {"status": "Cancelamento solicitado; o job para no próximo ponto de verificação."}
+    if obter_job(job_id, empresa_id):
+        return {"erro": "O job já terminou."}
+    return {"erro": "Job não encontrado."}
+
+
+def limpar_jobs_antigos(dias=RETENCAO_JOBS_DIAS):
+    """Apaga os jobs terminados há mais de `dias` dias, com os arquivos que geraram."""
+    limite = int(time.time()) - dias * 86400
+    with get_db_connection() as conn:
+        arquivos = conn.execute("""
+            SELECT a.id, a.caminho_salvo FROM arquivos a JOIN jobs j ON j.id = a.job_id
+            WHERE j.status IN ('concluido', 'erro', 'cancelado') AND j.concluido_ts < ?
+        """, (limite,)).fetchall()
+        conn.executemany("DELETE FROM arquivos WHERE id = ?", [(arquivo_id,) for arquivo_id, _ in arquivos])
+        cursor = conn.execute("""
+            DELETE FROM jobs WHERE status IN ('concluido', 'erro', 'cancelado') AND concluido_ts < ?
+        """, (limite,))
+    for _, caminho_salvo in arquivos:
+        try:
+            os.remove(os.path.join(PASTA_UPLOADS, caminho_salvo))
+        except FileNotFoundError:
+            pass
+    return cursor.rowcount
+
+
+def _reativar_interrompidos():
+    """Jobs que estavam rodando quando o servidor parou voltam para a fila (ou falham, sem tentativas)."""
+    agora = int(time.time())
+    with get_db_connection() as conn:
+        conn.execute("""
+            UPDATE jobs SET status = 'erro', concluido_ts = ?, mensagem = 'Interrompido (servidor reiniciado).'
+            WHERE status = 'executando' AND tentativas >= max_tentativas
+        """, (agora,))
+        conn.execute("""
+            UPDATE jobs SET status = 'pendente', disponivel_ts = ?, mensagem = 'Reiniciado após queda do servidor.'
+            WHERE status = 'executando'
+        """, (agora,))
+
+
+def _reservar_proximo():
+    """Marca o próximo pendente como executando e o devolve (None se não há)."""
+    agora = int(time.time())
+    with get_db_connection() as conn:
+        while True:
+            row = conn.execute("""
+                SELECT id FROM jobs WHERE status = 'pendente' AND disponivel_ts <= ?
+                ORDER BY disponivel_ts, id LIMIT 1
+            """, (agora,)).fetchone()
+            if not row:
+                return None
+            # Só um despachante consegue trocar pendente -> executando
+            cursor = conn.execute("""
+                UPDATE jobs SET status = 'executando', tentativas = tentativas + 1, iniciado_ts = ?, progresso = 0
+                WHERE id = ? AND status = 'pendente'
+            """, (agora, row[0]))
+            if cursor.rowcount:
+                job = conn.execute(f"SELECT {', '.join(_COLUNAS_JOB)} FROM jobs WHERE id = ?", (row[0],)).fetchone()
+                return _job_para_dict(job)
+
+
+def _concluir(job, resultado):
+    arquivo_id = None
+    arquivo = (resultado or {}).pop("arquivo_gerado", None)
+    if arquivo:
+        arquivo_id = salvar_arquivo_db(arquivo["nome_original"], arquivo["caminho_salvo"], arquivo["tamanho"],
+                                       job["usuario"], job["empresa_id"], arquivo.get("tamanho_bytes"),
+                                       arquivo.get("sha256"), job_id=job["id"])["id"]
+    with get_db_connection() as conn:
+        conn.execute("""
+            UPDATE jobs SET status = 'concluido', progresso = 100, resultado = ?, arquivo_id = ?,
+                            mensagem = ?, concluido_ts = ?
+            WHERE id = ?
+        """, (json.dumps(resultado, default=str), arquivo_id, (resultado or {}).get("status"),
+              int(time.time()), job["id"]))
+
+
+def _finalizar(job, status, mensagem):
+    with get_db_connection() as conn:
+        conn.execute("UPDATE jobs SET status = ?, mensagem = ?, concluido_ts = ? WHERE id = ?",
+                     (status, mensagem, int(time.time()), job["id"]))
+
+
+def _reagendar(job, mensagem):
+    espera = ESPERA_RETENTATIVA_S * 2 ** (job["tentativas"] - 1)
+    with get_db_connection() as conn:
+        conn.execute("UPDATE jobs SET status = 'pendente', mensagem = ?, disponivel_ts = ? WHERE id = ?",
+                     (f"{mensagem} Nova tentativa em {espera}s.", int(time.time()) + espera, job["id"]))
+
+
+class DespachanteJobs:
+    def __init__(self, simultaneos=MAX_JOBS_SIMULTANEOS):
+        self.simultaneos = simultaneos
+        self._loop = None
+        self._acordar = None
+        self._tarefa = None
+        self._rodando = set()
+
+    def iniciar(self):
+        """Chamado no startup do servidor (dentro do event loop)."""
+        _reativar_interrompidos()
+        limpar_jobs_antigos()
+        self._loop = asyncio.get_running_loop()
+        self._acordar = asyncio.Event()
+        self._tarefa = self._loop.create_task(self._despachar())
+
+    def acordar(self):
+        """Avisa que há job novo. Pode ser chamado de qualquer thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._acordar.set)
+
+    def enfileirar(self, tipo, empresa_id, usuario, /, **parametros):
+        """Grava o job como pendente e devolve o registro (com o id). Os parâmetros
+        (JSON) vão para a função do tipo; podem repetir empresa_id/usuario."""
+        if tipo not in TIPOS_JOB:
+            raise ValueError(f"Tipo de job desconhecido: {tipo}")
+        job_id = _inserir_job(tipo, empresa_id, usuario, parametros)
+        self.acordar()
+        return obter_job(job_id, empresa_id)
+
+    async def _despachar(self):
+        while True:
+            try:
+                job = None
+                # Limpa antes de procurar: um enfileirar() durante a consulta não se perde
+                self._acordar.clear()
+                if len(self._rodando) < self.simultaneos:
+                    job = await executar_io(_reservar_proximo)
+                if job:
+                    tarefa = asyncio.create_task(self._executar(job))
+                    self._rodando.add(tarefa)
+                    tarefa.add_done_callback(self._fim_tarefa)
+                    continue
+                try:
+                    await asyncio.wait_for(self._acordar.wait(), INTERVALO_VERIFICACAO_S)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERRO NO DESPACHANTE DE JOBS: {e}")
+                await asyncio.sleep(INTERVALO_VERIFICACAO_S)
+
+    def _fim_tarefa(self, tarefa):
+        self._rodando.discard(tarefa)
+        # Vaga livre: procura o próximo pendente
+        if self._acordar is not None:
+            self._acordar.set()
+
+    async def _executar(self, job):
+        try:
+            # O worker lê o banco: o que a rota registrou no histórico precisa estar gravado
+            await executar_io(fila_auditoria.descarregar)
+            if TIPOS_JOB[job["tipo"]][2] == "servidor":
+                resultado = await _funcao_do_tipo(job["tipo"])(ContextoJobServidor(job["id"]), **job["parametros"])
+            else:
+                resultado = await executar_job(_rodar_job, job["id"], job["tipo"], job["parametros"])
+            await executar_io(_concluir, job, resultado)
+        except JobCancelado:
+            await executar_io(_finalizar, job, "cancelado", "Cancelado.")
+        except Exception as e:
+            mensagem = f"Tentativa {job['tentativas']} falhou: {e}"
+            print(f"Job {job['id']} ({job['tipo']}): {mensagem}")
+            if job["tentativas"] < job["max_tentativas"]:
+                await executar_io(_reagendar, job, mensagem)
+            else:
+                await executar_io(_finalizar, job, "erro", str(e) or type(e).__name__)
+
+    async def encerrar(self):
+        """Shutdown: os jobs interrompidos voltam para a fila na próxima subida.
+
+        Espera as tarefas terminarem de cancelar, para nenhuma tocar no banco
+        depois que as conexões forem fechadas.
+        """
+        tarefas = [t for t in [self._tarefa, *self._rodando] if t is not None]
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+
+
+fila_jobs = DespachanteJobs()
@@ -0,0 +1,184 @@
+# importacao_usuarios.py
+"""Importação de usuários do usuarios_backup.csv, por lotes (job "importar_usuarios", ver fila_jobs.py).
+
+Antes a rota lia o CSV inteiro dentro da requisição, com um SELECT + UPDATE/
+INSERT e um bcrypt síncrono por linha, e gravava todo mundo na empresa padrão.
+Agora a rota enfileira um job e importar_usuarios() roda no event loop do
+servidor (jobs "servidor" da fila), só orquestrando:
+
+1. o CSV é lido em streaming, LINHAS_POR_LOTE linhas por vez (pool de IO);
+2. linhas repetidas do mesmo login são juntadas (o CSV é um log: CRIADO e
+   depois ATUALIZADO) e os logins do lote são conferidos numa consulta só;
+3. as senhas novas são hasheadas em paralelo no pool de senhas
+   (executores.executar_senha), em tarefas pequenas e com no máximo
+   MAX_PROCESSOS_SENHA delas na fila por vez: um login que chega no meio da
+   importação espera uma tarefa, não o lote inteiro;
+4. o lote é gravado com executemany numa transação e os usuários da empresa
+   saem do cache de autenticação (cache_usuarios.py).
+
+Tudo fica na empresa de quem importou: login existente em outra empresa não
+é alterado (vai para a lista de erros). O progresso é a fração do arquivo já
+lida; o cancelamento é conferido entre os lotes.
+"""
+import asyncio
+import csv
+import os
+
+from cache_usuarios import cache_usuarios
+from db import get_db_connection
+from executores import MAX_PROCESSOS_SENHA, executar_io, executar_senha
+from senhas import get_hash_senhas
+from services import get_backup_file_path
+
+LINHAS_POR_LOTE = 500
+SENHAS_POR_TAREFA = 20
+# Erros de linha devolvidos no resultado (o resto só entra na contagem)
+MAX_ERROS_LISTADOS = 50
+
+SENHA_MANTIDA = "MANTIDA"
+
+
+class _LeitorCSV:
+    """Lê o CSV em lotes, contando os bytes lidos para o progresso."""
+
+    def __init__(self, arquivo):
+        self.total_bytes = os.path.getsize(arquivo)
+        self.bytes_lidos = 0
+        self._arquivo = open(arquivo, mode='rb')
+        self._linhas = csv.DictReader(self._decodificar(), delimiter=';')
+
+    def _decodificar(self):
+        for linha in self._arquivo:
+            self.bytes_lidos += len(linha)
+            yield linha.decode('utf-8-sig')
+
+    def proximo_lote(self):
+        lote = []
+        for row in self._linhas:
+            lote.append((self._linhas.line_num, row))
+            if len(lote) >= LINHAS_POR_LOTE:
+                break
+        return lote
+
+    def fechar(self):
+        self._arquivo.close()
+
+
+def _juntar_repetidos(lote):
+    """login -> (linha, senha ou None, cargo), com o cargo da última linha do login
+    e a última senha informada (MANTIDA/vazia não apaga uma senha anterior)."""
+    usuarios = {}
+    for numero, row in lote:
+        login = (row.get("Login") or "").strip()
+        if not login:
+            continue
+        senha = row.get("Senha") or None
+        if senha == SENHA_MANTIDA:
+            senha = None
+        cargo = (row.get("Cargo") or "").strip() or "operador"
+        anterior = usuarios.get(login)
+        if anterior and senha is None:
+            senha = anterior[1]
+        usuarios[login] = (numero, senha, cargo)
+    return usuarios
+
+
+def _empresas_dos_logins(logins):
+    """login -> empresa_id dos logins que já existem (o username é único no banco)."""
+    marcadores = ", ".join("?" * len(logins))
+    with get_db_connection() as conn:
+        return dict(conn.execute(
+            f"SELECT username, empresa_id FROM usuarios WHERE username IN ({marcadores})", logins).fetchall())
+
+
+def _gravar_lote(empresa_id, atualizar, inserir):
+    """Uma transação por lote. Devolve quantos novos foram inseridos (um login criado
+    por outra requisição entre a consulta e a gravação é ignorado)."""
+    with get_db_connection() as conn:
+        conn.executemany("""
+            UPDATE usuarios SET password_hash = COALESCE(?, password_hash), role = ?
+            WHERE username = ? AND empresa_id = ?
+        """, [(senha_hash, cargo, login, empresa_id) for login, senha_hash, cargo in atualizar])
+        cursor = conn.executemany("""
+            INSERT INTO usuarios (username, password_hash, role, empresa_id) VALUES (?, ?, ?, ?)
+            ON CONFLICT(username) DO NOTHING
+        """, [(login, senha_hash, cargo, empresa_id) for login, senha_hash, cargo in inserir])
+        return max(cursor.rowcount, 0)
+
+
+async def _hashear(senhas, custo):
+    """Hashes das senhas no pool de senhas, SENHAS_POR_TAREFA por tarefa."""
+    vagas = asyncio.Semaphore(MAX_PROCESSOS_SENHA)
+
+    async def parte(inicio):
+        async with vagas:
+            return await executar_senha(get_hash_senhas, senhas[inicio:inicio + SENHAS_POR_TAREFA], custo)
+
+    partes = await asyncio.gather(*(parte(i) for i in range(0, len(senhas), SENHAS_POR_TAREFA)))
+    return [senha_hash for hashes in partes for senha_hash in hashes]
+
+
+def _erro(resultado, numero, login, mensagem):
+    resultado["erros"] += 1
+    if len(resultado["detalhes_erros"]) < MAX_ERROS_LISTADOS:
+        resultado["detalhes_erros"].append({"linha": numero, "login": login, "erro": mensagem})
+
+
+async def _processar_lote(resultado, empresa_id, lote, custo):
+    usuarios = _juntar_repetidos(lote)
+    if not usuarios:
+        return
+    existentes = await executar_io(_empresas_dos_logins, list(usuarios))
+
+    atualizar, inserir = [], []
+    for login, (numero, senha, cargo) in usuarios.items():
+        dona = existentes.get(login)
+        if dona is None and senha is None:
+            _erro(resultado, numero, login, "Usuário novo sem senha.")
+        elif dona is not None and dona != empresa_id:
+            _erro(resultado, numero, login, "Login já usado por outra empresa.")
+        else:
+            (inserir if dona is None else atualizar).append((login, senha, cargo))
+
+    # Só as senhas informadas são hasheadas; MANTIDA continua None (mantém o hash atual)
+    com_senha = [item for item in atualizar + inserir if item[1] is not None]
+    hashes = iter(await _hashear([senha for _, senha, _ in com_senha], custo))
+    hash_por_login = {login: next(hashes) for login, _, _ in com_senha}
+    atualizar = [(login, hash_por_login.get(login), cargo) for login, _, cargo in atualizar]
+    inserir = [(login, hash_por_login[login], cargo) for login, _, cargo in inserir]
+
+    inseridos = await executar_io(_gravar_lote, empresa_id, atualizar, inserir)
+    cache_usuarios.invalidar_usuarios(empresa_id)
+    resultado["atualizados"] += len(atualizar)
+    resultado["criados"] += inseridos
+    if inseridos < len(inserir):
+        _erro(resultado, None, None, f"{len(inserir) - inseridos} login(s) criado(s) por outra operação "
+                                     "durante a importação; não foram alterados.")
+
+
+async def importar_usuarios(job, empresa_id, custo):
+    """Importa o CSV na empresa e devolve os contadores. `job` é o contexto do job
+    (fila_jobs.ContextoJobServidor); `custo` é o do bcrypt (senhas.custo_atual)."""
+    arquivo = get_backup_file_path()
+    if not os.path.exists(arquivo):
+        raise FileNotFoundError("Arquivo usuarios_backup.csv não encontrado.")
+
+    leitor = await executar_io(_LeitorCSV, arquivo)
+    resultado = {"linhas_processadas": 0, "criados": 0, "atualizados": 0, "erros": 0, "detalhes_erros": []}
+    try:
+        while True:
+            await job.verificar_cancelamento()
+            lote = await executar_io(leitor.proximo_lote)
+            if not lote:
+                break
+            await _processar_lote(resultado, empresa_id, lote, custo)
+            resultado["linhas_processadas"] += len(lote)
+            await job.progresso(100 * leitor.bytes_lidos / (leitor.total_bytes or 1),
+                                f"{resultado['linhas_processadas']} linhas processadas")
+    finally:
+        leitor.fechar()
+
+    resultado["status"] = (f"Sincronização concluída! {resultado['criados']} criados, "
+                           f"{resultado['atualizados']} atualizados, {resultado['erros']} com erro.")
+    return resultado
+
@@ -0,0 +1,149 @@
+# jobs_admin.py
+"""Funções dos jobs administrativos (rodam num processo do pool de jobs, ver fila_jobs.py).
+
+Cada função recebe o ContextoJob e os parâmetros gravados no enfileiramento
+e devolve um dict. Arquivos gerados vão para uploads/ e são devolvidos em
+"arquivo_gerado" (com tamanho e SHA-256, calculados aqui no worker) para a
+fila registrá-los na tabela arquivos.
+"""
+import hashlib
+import os
+import subprocess
+import uuid
+
+from exportacao import gerar_exportacao
+from services import contar_historico, criar_backup_sistema, formatar_tamanho, iterar_historico
+
+PASTA_UPLOADS = "uploads"
+_BLOCO_LEITURA = 1024 * 1024
+TIMEOUT_GIT_S = 120
+# Linhas exportadas entre duas atualizações do progresso/cancelamento
+LINHAS_POR_PROGRESSO = 5000
+
+
+def _arquivo_resultado(caminho_salvo, nome_original, sha256=None):
+    """O "arquivo_gerado" do resultado. O SHA-256 vira o ETag do download; é
+    calculado aqui (relendo o arquivo) quando o job não o trouxe pronto."""
+    caminho = os.path.join(PASTA_UPLOADS, caminho_salvo)
+    if sha256 is None:
+        hash_arquivo = hashlib.sha256()
+        with open(caminho, "rb") as f:
+            for bloco in iter(lambda: f.read(_BLOCO_LEITURA), b""):
+                hash_arquivo.update(bloco)
+        sha256 = hash_arquivo.hexdigest()
+    tamanho = os.path.getsize(caminho)
+    return {"caminho_salvo": caminho_salvo, "nome_original": nome_original, "tamanho": formatar_tamanho(tamanho),
+            "tamanho_bytes": tamanho, "sha256": sha256}
+
+
+def job_backup(job):
+    resultado = criar_backup_sistema()
+    if "erro" in resultado:
+        # Exceção: a fila tenta de novo
+        raise RuntimeError(resultado["erro"])
+    return resultado
+
+
+def job_exportar_historico(job, empresa_id, nome_base, formato, usuario=None, acao=None,
+                           data_inicio=None, data_fim=None):
+    # Contagem com os mesmos filtros (e índices) da leitura: dá o percentual
+    total = contar_historico(empresa_id, usuario, acao, data_inicio, data_fim)
+
+    def linhas_com_progresso():
+        for numero, linha in enumerate(iterar_historico(empresa_id, usuario, acao, data_inicio, data_fim), 1):
+            if numero % LINHAS_POR_PROGRESSO == 0:
+                job.verificar_cancelamento()
+                job.progresso(100 * numero / max(total, numero), f"{numero} de {total} linhas exportadas")
+            yield linha
+
+    gerador, _ = gerar_exportacao(formato, ["Data/Hora", "Usuário", "Ação", "Detalhes"],
+                                  linhas_com_progresso(), "Histórico", [20, 20, 22, 80])
+    caminho_salvo = f"{uuid.uuid4()}.{formato}"
+    caminho = os.path.join(PASTA_UPLOADS, caminho_salvo)
+    sha256 = hashlib.sha256()
+    try:
+        with open(caminho, "wb") as f:
+            for bloco in gerador:
+                sha256.update(bloco)
+                f.write(bloco)
+    except BaseException:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        raise
+    return {"status": "Exportação concluída.",
+            "arquivo_gerado": _arquivo_resultado(caminho_salvo, f"{nome_base}.{formato}", sha256.hexdigest())}
+
+
+def job_relatorio_evolucao(job):
+    """Gera o Excel com as atualizações do sistema."""
+    import pandas as pd
+
+    # Dados do Realizado
+    dados_realizado = [
+        {"Recurso": "Monitoramento de Servidor", "Detalhes": "Painel com CPU, RAM, Disco, Ping (Local/Railway) e Gráficos Históricos.", "Status": "Concluído"},
+        {"Recurso": "Interface Responsiva Inteligente", "Detalhes": "Ajuste automático de escala: 'Zoom Out' (Placa de Vídeo) no PC e Normal no Mobile.", "Status": "Concluído"},
+        {"Recurso": "Indicadores de Rede Avançados", "Detalhes": "Detecção automática de WiFi vs Cabo e velocímetro no Navbar.", "Status": "Concluído"},
+        {"Recurso": "Sistema de Chat/Suporte", "Detalhes": "Chat interno com geração de protocolos, status (aberto/fechado) e avaliação.", "Status": "Concluído"},
+        {"Recurso": "Leitura de Placa (OCR)", "Detalhes": "Integração com câmera e Tesseract.js para leitura automática de placas.", "Status": "Concluído"},
+        {"Recurso": "Gestão de Arquivos (Nuvem)", "Detalhes": "Upload e download de arquivos internos no servidor.", "Status": "Concluído"},
+        {"Recurso": "Controle de Acesso (Roles)", "Detalhes": "Níveis hierárquicos: Admin, Gerente, Operador, Vigilante, Dev.", "Status": "Concluído"},
+        {"Recurso": "Editor Visual (No-Code)", "Detalhes": "Ferramenta para alterar textos e cores clicando com botão direito (Modo Dev).", "Status": "Concluído"},
+        {"Recurso": "Monitoramento 24/7", "Detalhes": "Tarefa de fundo para manter histórico de performance mesmo sem acesso ao site.", "Status": "Concluído"},
+        {"Recurso": "Painel SQL", "Detalhes": "Ferramenta para execução de queries e correção de banco direto pelo navegador.", "Status": "Concluído"},
+        {"Recurso": "Copyright Dinâmico", "Detalhes": "Ano e versão atualizados automaticamente no rodapé de todas as telas.", "Status": "Concluído"},
+        {"Recurso": "Widgets de Utilidade", "Detalhes": "Previsão do tempo e Calendário integrados ao topo do sistema.", "Status": "Concluído"},
+        {"Recurso": "Scanner Mobile (Vigilante)", "Detalhes": "Interface simplificada e leve focada apenas na leitura de placas.", "Status": "Concluído"},
+        {"Recurso": "Integração Câmeras IP (RTSP)", "Detalhes": "Leitura automática de placas das câmeras cadastradas, com registro de entrada/saída.", "Status": "Concluído"},
+        {"Recurso": "Fila de Jobs em Segundo Plano", "Detalhes": "Backups, exportações, importações e atualizações rodam fora da requisição, com progresso e cancelamento.", "Status": "Concluído"},
+    ]
+
+    # Dados do Futuro
+    dados_futuro = [
+        {"Recurso": "Módulo Financeiro", "Detalhes": "Cálculo de valor por tempo de estadia, gestão de mensalistas e integração Pix.", "Prioridade": "Alta"},
+        {"Recurso": "App Mobile Nativo", "Detalhes": "Aplicativo .apk/.ipa instalado no celular com notificações push reais.", "Prioridade": "Média"},
+        {"Recurso": "Controle de Hardware (IoT)", "Detalhes": "Abrir cancelas e portões automaticamente via Arduino/ESP32 ao reconhecer placa.", "Prioridade": "Média"},
+        {"Recurso": "Reconhecimento Facial", "Detalhes": "Identificar motoristas e funcionários pela câmera na entrada.", "Prioridade": "Baixa"},
+        {"Recurso": "Dashboard BI Avançado", "Detalhes": "Gráficos de fluxo de veículos, horários de pico e previsão de faturamento.", "Prioridade": "Baixa"},
+        {"Recurso": "Backup em Nuvem Externa", "Detalhes": "Salvar banco de dados no Google Drive/AWS S3 automaticamente para segurança total.", "Prioridade": "Baixa"},
+    ]
+
+    df_realizado = pd.DataFrame(dados_realizado)
+    df_futuro = pd.DataFrame(dados_futuro)
+
+    caminho_salvo = f"{uuid.uuid4()}.xlsx"
+
+    # Salvar o Excel
+    with pd.ExcelWriter(os.path.join(PASTA_UPLOADS, caminho_salvo), engine='openpyxl') as writer:
+        df_realizado.to_excel(writer, sheet_name='Realizado', index=False)
+        df_futuro.to_excel(writer, sheet_name='Futuro (Roadmap)', index=False)
+
+        # Ajuste visual das colunas
+        for sheet in writer.sheets.values():
+            sheet.column_dimensions['A'].width = 35
+            sheet.column_dimensions['B'].width = 70
+            sheet.column_dimensions['C'].width = 15
+
+    return {"status": "Relatório gerado.",
+            "arquivo_gerado": _arquivo_resultado(caminho_salvo, "Relatorio_Evolucao_Sistema.xlsx")}
+
+
+def _git(*args):
+    return subprocess.check_output(["git", *args], stderr=subprocess.STDOUT, timeout=TIMEOUT_GIT_S).decode('utf-8')
+
+
+def job_git_pull(job):
+    """Executa um reset forçado para atualizar o código com a versão do GitHub."""
+    # 1. Busca as últimas informações do repositório remoto.
+    _git("fetch")
+    job.progresso(50, "Repositório remoto consultado.")
+
+    # 2. Tenta fazer o reset para o branch 'main'; se falhar, 'master' como alternativa.
+    try:
+        return {"status": "Sistema atualizado com sucesso!", "log": _git("reset", "--hard", "origin/main")}
+    except subprocess.CalledProcessError:
+        try:
+            return {"status": "Sistema atualizado com sucesso (usando branch 'master')!",
+                    "log": _git("reset", "--hard", "origin/master")}
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError("Falha ao atualizar. Não foi possível encontrar 'origin/main' ou 'origin/master'. "
+                               f"Detalhes: {e.output.decode('utf-8')}") from None
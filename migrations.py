@@ -0,0 +1,732 @@
+# migrations.py
+"""Migrações versionadas do banco (tabela schema_version).
+
+Cada migração é uma tupla (versao, descricao, funcao(cursor)) e roda uma única
+vez por banco. As primeiras versões são idempotentes para que bancos antigos
+(criados antes deste controle) possam ser migrados sem erro.
+
+Uso no terminal:
+    python migrations.py          # aplica pendentes e confere os planos de consulta
+"""
+import re
+from datetime import datetime
+from db import get_db_connection
+from datas import texto_para_epoch, FUSO_SP
+from series_performance import COLUNAS_AGREGADOS, HORA, DIA, deslocamento_local
+
+
+def _colunas(cursor, tabela):
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    return [r[1] for r in cursor.fetchall()]
+
+
+def _adicionar_coluna(cursor, tabela, coluna, definicao):
+    """ALTER TABLE ADD COLUMN apenas se a coluna ainda não existir."""
+    if coluna not in _colunas(cursor, tabela):
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+        return True
+    return False
+
+
+# --- Migrações ---
+
+def _m001_tabelas_base(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS empresas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome_empresa TEXT NOT NULL,
+            cnpj TEXT UNIQUE NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT DEFAULT 'operador',
+            empresa_id INTEGER NOT NULL,
+            FOREIGN KEY (empresa_id) REFERENCES empresas (id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS movimentacoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            placa TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            entrada TEXT NOT NULL,
+            saida TEXT,
+            responsavel TEXT,
+            cpf_responsavel TEXT,
+            empresa_id INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cadastros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT,
+            data_nascimento TEXT,
+            telefone TEXT,
+            cep TEXT,
+            endereco TEXT,
+            numero TEXT,
+            cargo TEXT,
+            email TEXT,
+            cpf TEXT,
+            empresa TEXT,
+            placa TEXT,
+            tipo_veiculo TEXT,
+            empresa_id INTEGER NOT NULL
+        )
+    """)
+    # Tabela de configurações (para o layout dinâmico)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS configuracoes (
+            chave TEXT PRIMARY KEY,
+            valor TEXT
+        )
+    """)
+    # --- CHAT TABLES ---
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_protocolos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_cliente TEXT NOT NULL,
+            assunto TEXT,
+            data_inicio TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'aberto', -- aberto, fechado
+            empresa_id INTEGER NOT NULL
+        )
+    """)
+    # Tabela chat_mensagens antiga (sem protocolo_id) é incompatível: recriar
+    cols_chat = _colunas(cursor, "chat_mensagens")
+    if 'usuario' in cols_chat and 'protocolo_id' not in cols_chat:
+        cursor.execute("DROP TABLE chat_mensagens")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_mensagens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            protocolo_id INTEGER NOT NULL,
+            usuario TEXT NOT NULL,
+            texto TEXT NOT NULL,
+            data_hora TEXT NOT NULL,
+            empresa_id INTEGER NOT NULL,
+            FOREIGN KEY (protocolo_id) REFERENCES chat_protocolos (id)
+        )
+    """)
+    # --- ARQUIVOS / NUVEM ---
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS arquivos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome_original TEXT,
+            caminho_salvo TEXT,
+            tamanho TEXT,
+            data_upload TEXT,
+            uploader TEXT,
+            empresa_id INTEGER NOT NULL
+        )
+    """)
+    # --- HISTÓRICO / LOGS ---
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS historico_acoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario TEXT,
+            acao TEXT,
+            detalhes TEXT,
+            data_hora TEXT,
+            empresa_id INTEGER NOT NULL
+        )
+    """)
+    # --- MONITORAMENTO / PERFORMANCE ---
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS historico_performance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            data_hora TEXT,
+            cpu_usage REAL,
+            ram_usage REAL,
+            disk_usage REAL,
+            ping_local INTEGER,
+            ping_railway INTEGER
+        )
+    """)
+
+
+def _m002_colunas_legadas(cursor):
+    """Colunas que bancos antigos podem não ter (antes ficava em setup_usuarios)."""
+    if _adicionar_coluna(cursor, "usuarios", "role", "TEXT DEFAULT 'operador'"):
+        # Atualiza o admin para ter permissão total
+        cursor.execute("UPDATE usuarios SET role = 'admin' WHERE username = 'admin'")
+    _adicionar_coluna(cursor, "movimentacoes", "responsavel", "TEXT")
+    _adicionar_coluna(cursor, "movimentacoes", "cpf_responsavel", "TEXT")
+    _adicionar_coluna(cursor, "cadastros", "numero", "TEXT")
+    _adicionar_coluna(cursor, "cadastros", "tipo_veiculo", "TEXT")
+    # Dados existentes passam a pertencer à empresa padrão (ID 1)
+    for tabela in ['usuarios', 'movimentacoes', 'cadastros', 'chat_protocolos',
+                   'chat_mensagens', 'arquivos', 'historico_acoes']:
+        _adicionar_coluna(cursor, tabela, "empresa_id", "INTEGER NOT NULL DEFAULT 1")
+
+
+def _m003_indices(cursor):
+    """Índices compostos para as consultas quentes por empresa (tenant)."""
+    # registrar_entrada (já está no pátio?), registrar_saida e listar_veiculos
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mov_patio
+        ON movimentacoes (empresa_id, placa) WHERE saida IS NULL
+    """)
+    # listar_saidas (ORDER BY id DESC por empresa, só quem já saiu)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mov_saidas
+        ON movimentacoes (empresa_id, id DESC) WHERE saida IS NOT NULL
+    """)
+    # listar_historico / exportação (com e sem filtro de usuário)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hist_empresa_id ON historico_acoes (empresa_id, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hist_empresa_usuario ON historico_acoes (empresa_id, usuario, id DESC)")
+    # Chat
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_msg_protocolo ON chat_mensagens (protocolo_id, empresa_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_proto_usuario ON chat_protocolos (empresa_id, usuario_cliente, id DESC)")
+    # Cadastros e arquivos
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cadastros_empresa_nome ON cadastros (empresa_id, nome)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_arquivos_empresa_id ON arquivos (empresa_id, id DESC)")
+    cursor.execute("ANALYZE")
+
+
+def _m004_timestamps_movimentacoes(cursor):
+    """Colunas epoch de entrada/saída (preenchidas por preencher_timestamps_legados)."""
+    _adicionar_coluna(cursor, "movimentacoes", "entrada_ts", "INTEGER")
+    _adicionar_coluna(cursor, "movimentacoes", "saida_ts", "INTEGER")
+    # Relatórios diário/mensal e exportações por período
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mov_entrada_ts ON movimentacoes (empresa_id, entrada_ts)")
+    # "Saíram hoje"
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mov_saida_ts ON movimentacoes (empresa_id, saida_ts)")
+    # "Pendentes" (no pátio há mais de 24h). Também cobre listar_veiculos (só as
+    # linhas no pátio da empresa), que o planejador passa a fazer por ele
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mov_patio_entrada
+        ON movimentacoes (empresa_id, entrada_ts) WHERE saida IS NULL
+    """)
+
+
+def _m005_estatisticas_incrementais(cursor):
+    """Contadores por empresa mantidos por triggers a cada entrada/saída.
+
+    Os triggers cobrem qualquer escritor (API, script de terminal, /dev/sql,
+    resetar_banco), então obter_estatisticas só lê uma linha por empresa.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS estatisticas_patio (
+            empresa_id INTEGER PRIMARY KEY,
+            no_patio INTEGER NOT NULL DEFAULT 0,
+            visitantes INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS estatisticas_saidas_dia (
+            empresa_id INTEGER NOT NULL,
+            dia TEXT NOT NULL,  -- YYYY-MM-DD (horário local)
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (empresa_id, dia)
+        )
+    """)
+
+    # Soma (+1) ou subtrai (-1) a contribuição de uma linha de movimentacoes
+    def corpo(ref, sinal):
+        return f"""
+            INSERT INTO estatisticas_patio (empresa_id, no_patio, visitantes)
+            SELECT {ref}.empresa_id, {sinal}, {sinal} * (LOWER(TRIM({ref}.tipo)) = 'visitante')
+            WHERE {ref}.saida IS NULL
+            ON CONFLICT (empresa_id) DO UPDATE SET
+                no_patio = no_patio + excluded.no_patio,
+                visitantes = visitantes + excluded.visitantes;
+            INSERT INTO estatisticas_saidas_dia (empresa_id, dia, total)
+            SELECT {ref}.empresa_id, DATE({ref}.saida_ts, 'unixepoch', 'localtime'), {sinal}
+            WHERE {ref}.saida_ts IS NOT NULL
+            ON CONFLICT (empresa_id, dia) DO UPDATE SET total = total + excluded.total;
+        """
+
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_mov_estat_insert AFTER INSERT ON movimentacoes
+        BEGIN {corpo("NEW", 1)} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_mov_estat_update
+        AFTER UPDATE OF saida, saida_ts, tipo, empresa_id ON movimentacoes
+        BEGIN {corpo("OLD", -1)} {corpo("NEW", 1)} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_mov_estat_delete AFTER DELETE ON movimentacoes
+        BEGIN {corpo("OLD", -1)} END
+    """)
+    recalcular_estatisticas(cursor)
+
+
+def recalcular_estatisticas(cursor, empresa_id=None):
+    """Recalcula os contadores a partir de agregações indexadas de movimentacoes."""
+    filtro, params = ("WHERE empresa_id = ?", (empresa_id,)) if empresa_id is not None else ("", ())
+    cursor.execute(f"DELETE FROM estatisticas_patio {filtro}", params)
+    cursor.execute(f"DELETE FROM estatisticas_saidas_dia {filtro}", params)
+    filtro_and = "AND empresa_id = ?" if empresa_id is not None else ""
+    cursor.execute(f"""
+        INSERT INTO estatisticas_patio (empresa_id, no_patio, visitantes)
+        SELECT empresa_id, COUNT(*), SUM(LOWER(TRIM(tipo)) = 'visitante')
+        FROM movimentacoes WHERE saida IS NULL {filtro_and}
+        GROUP BY empresa_id
+    """, params)
+    cursor.execute(f"""
+        INSERT INTO estatisticas_saidas_dia (empresa_id, dia, total)
+        SELECT empresa_id, DATE(saida_ts, 'unixepoch', 'localtime') AS dia, COUNT(*)
+        FROM movimentacoes WHERE saida_ts IS NOT NULL {filtro_and}
+        GROUP BY empresa_id, dia
+    """, params)
+
+
+def _m006_paginacao(cursor):
+    """Filtros das listagens paginadas (/saidas e /api/historico).
+
+    O histórico ganha data_ts (epoch) para filtrar por período; data_hora
+    continua sendo o texto exibido. A paginação em si usa os índices por
+    (empresa_id, id DESC) que já existem.
+    """
+    _adicionar_coluna(cursor, "historico_acoes", "data_ts", "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hist_empresa_ts ON historico_acoes (empresa_id, data_ts)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hist_empresa_acao ON historico_acoes (empresa_id, acao, id DESC)")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mov_saidas_placa
+        ON movimentacoes (empresa_id, placa, id DESC) WHERE saida IS NOT NULL
+    """)
+
+
+def _m007_busca_cadastros(cursor):
+    """Índice FTS5 da busca de cadastros (nome, placa, cpf, email, empresa).
+
+    A tabela cadastros_fts usa rowid = cadastros.id e é mantida por triggers,
+    então registrar/atualizar/excluir_cadastro (e qualquer outro escritor)
+    ficam sincronizados. Placa e CPF entram sem pontuação para que "123456"
+    encontre "123.456.789-00" e "ABC1D" encontre "ABC-1D23"; remove_diacritics
+    faz "joao" encontrar "João".
+    """
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS cadastros_fts USING fts5(
+            nome, placa, cpf, email, empresa,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    valores = """
+        {ref}.id, {ref}.nome,
+        UPPER(REPLACE(REPLACE(REPLACE({ref}.placa, '-', ''), ' ', ''), '.', '')),
+        REPLACE(REPLACE(REPLACE({ref}.cpf, '.', ''), '-', ''), ' ', ''),
+        {ref}.email, {ref}.empresa
+    """
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_cadastros_fts_insert AFTER INSERT ON cadastros BEGIN
+            INSERT INTO cadastros_fts (rowid, nome, placa, cpf, email, empresa)
+            VALUES ({valores.format(ref="NEW")});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_cadastros_fts_update
+        AFTER UPDATE OF nome, placa, cpf, email, empresa ON cadastros BEGIN
+            DELETE FROM cadastros_fts WHERE rowid = OLD.id;
+            INSERT INTO cadastros_fts (rowid, nome, placa, cpf, email, empresa)
+            VALUES ({valores.format(ref="NEW")});
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_cadastros_fts_delete AFTER DELETE ON cadastros BEGIN
+            DELETE FROM cadastros_fts WHERE rowid = OLD.id;
+        END
+    """)
+    cursor.execute("DELETE FROM cadastros_fts")
+    cursor.execute(f"""
+        INSERT INTO cadastros_fts (rowid, nome, placa, cpf, email, empresa)
+        SELECT {valores.format(ref="cadastros")} FROM cadastros
+    """)
+
+
+def _iso_para_epoch(texto):
+    """data_hora de historico_performance: ISO com fuso (atual) ou texto local (antigo)."""
+    try:
+        return int(datetime.fromisoformat(texto.strip()).timestamp())
+    except (ValueError, AttributeError):
+        return texto_para_epoch(texto)
+
+
+def _m008_series_performance(cursor):
+    """Séries temporais de performance (ver series_performance.py).
+
+    historico_performance ganha ts (epoch indexado) no lugar do filtro por
+    LIKE em data_hora, e performance_series guarda os agregados min/avg/max
+    por resolução. As horas e dias já existentes são agregados a partir das
+    amostras brutas, para os gráficos longos não começarem vazios.
+    """
+    _adicionar_coluna(cursor, "historico_performance", "ts", "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_perf_ts ON historico_performance (ts)")
+    cursor.execute("SELECT id, data_hora FROM historico_performance WHERE ts IS NULL")
+    updates = [(_iso_para_epoch(data_hora), id_) for id_, data_hora in cursor.fetchall()]
+    cursor.executemany("UPDATE historico_performance SET ts = ? WHERE id = ?",
+                       [u for u in updates if u[0] is not None])
+
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS performance_series (
+            resolucao INTEGER NOT NULL,
+            inicio_ts INTEGER NOT NULL,
+            amostras INTEGER NOT NULL,
+            {", ".join(f"{c} REAL" for c in COLUNAS_AGREGADOS.split(", "))},
+            PRIMARY KEY (resolucao, inicio_ts)
+        ) WITHOUT ROWID
+    """)
+    for resolucao, deslocamento in ((HORA, 0), (DIA, deslocamento_local())):
+        balde = f"(ts + ({deslocamento})) / {resolucao} * {resolucao} - ({deslocamento})"
+        agregados = ", ".join(f"MIN({c}), AVG({c}), MAX({c})"
+                              for c in ("cpu_usage", "ram_usage", "disk_usage", "ping_railway"))
+        cursor.execute(f"""
+            INSERT OR REPLACE INTO performance_series (resolucao, inicio_ts, amostras, {COLUNAS_AGREGADOS})
+            SELECT {resolucao}, {balde} AS balde, COUNT(*), {agregados}
+            FROM historico_performance WHERE ts IS NOT NULL
+            GROUP BY balde
+        """)
+
+
+def _m009_versao_config(cursor):
+    """Contador de versão das configurações (invalidação do cache entre workers, ver config_cache.py).
+
+    Os triggers incrementam o contador em qualquer escrita em configuracoes,
+    então até alterações feitas pelo painel SQL invalidam o cache.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS config_versao (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            versao INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO config_versao (id, versao) VALUES (1, 1)")
+    for evento in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_config_versao_{evento.lower()}
+            AFTER {evento} ON configuracoes
+            BEGIN
+                UPDATE config_versao SET versao = versao + 1 WHERE id = 1;
+            END
+        """)
+
+
+def _m010_eventos_processados(cursor):
+    """Chaves de idempotência das entradas/saídas enviadas pelos aparelhos (scanner offline).
+
+    O aparelho gera um id_evento por leitura e reenvia até receber resposta;
+    o resultado da primeira vez fica guardado e é devolvido nas repetições.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS eventos_processados (
+            empresa_id INTEGER NOT NULL,
+            id_evento TEXT NOT NULL,
+            resultado TEXT,
+            criado_ts INTEGER NOT NULL,
+            PRIMARY KEY (empresa_id, id_evento)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_eventos_processados_ts ON eventos_processados (criado_ts)")
+
+
+def _m011_cameras(cursor):
+    """Câmeras IP (RTSP) ou arquivos de vídeo lidos pelo serviço de ingestão (cameras.py)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cameras (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            empresa_id INTEGER NOT NULL DEFAULT 1,
+            nome TEXT NOT NULL,
+            url TEXT NOT NULL,
+            direcao TEXT NOT NULL CHECK (direcao IN ('entrada', 'saida')),
+            tipo TEXT NOT NULL DEFAULT 'Carro',
+            ativa INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cameras_empresa ON cameras (empresa_id)")
+
+
+
+def _m012_jobs(cursor):
+    """Fila de jobs em segundo plano (backups, exportações, importações; ver fila_jobs.py)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            empresa_id INTEGER NOT NULL,
+            usuario TEXT,
+            parametros TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'pendente'
+                CHECK (status IN ('pendente', 'executando', 'concluido', 'erro', 'cancelado')),
+            progresso REAL NOT NULL DEFAULT 0,
+            mensagem TEXT,
+            resultado TEXT,
+            arquivo_id INTEGER,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            max_tentativas INTEGER NOT NULL DEFAULT 1,
+            cancelar INTEGER NOT NULL DEFAULT 0,
+            disponivel_ts INTEGER NOT NULL,
+            criado_ts INTEGER NOT NULL,
+            iniciado_ts INTEGER,
+            concluido_ts INTEGER
+        )
+    """)
+    # Próximo job pendente (parcial: só as linhas pendentes ficam no índice)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_pendentes ON jobs (disponivel_ts, id)
+        WHERE status = 'pendente'
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_empresa ON jobs (empresa_id, id DESC)")
+
+
+def _m013_uploads_retomaveis(cursor):
+    """Upload em blocos com retomada e ETag pelo conteúdo no download (ver transferencias.py)."""
+    _adicionar_coluna(cursor, "arquivos", "tamanho_bytes", "INTEGER")
+    _adicionar_coluna(cursor, "arquivos", "sha256", "TEXT")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS uploads_sessoes (
+            id TEXT PRIMARY KEY,
+            empresa_id INTEGER NOT NULL,
+            usuario TEXT NOT NULL,
+            nome_original TEXT NOT NULL,
+            tamanho_total INTEGER NOT NULL,
+            recebidos INTEGER NOT NULL DEFAULT 0,
+            criado_ts INTEGER NOT NULL,
+            atualizado_ts INTEGER NOT NULL
+        )
+    """)
+
+
+def _m014_arquivos_de_jobs(cursor):
+    """Arquivos gerados por jobs saem da lista compartilhada (baixados por /api/jobs/{id}/arquivo)."""
+    _adicionar_coluna(cursor, "arquivos", "job_id", "INTEGER")
+    # Os gerados antes desta versão
+    cursor.execute("""
+        UPDATE arquivos SET job_id = (SELECT j.id FROM jobs j WHERE j.arquivo_id = arquivos.id)
+        WHERE id IN (SELECT arquivo_id FROM jobs WHERE arquivo_id IS NOT NULL)
+    """)
+
+
+MIGRACOES = [
+    (1, "Tabelas base", _m001_tabelas_base),
+    (2, "Colunas legadas e empresa_id", _m002_colunas_legadas),
+    (3, "Índices das consultas quentes", _m003_indices),
+    (4, "Timestamps epoch em movimentacoes", _m004_timestamps_movimentacoes),
+    (5, "Estatísticas incrementais do pátio", _m005_estatisticas_incrementais),
+    (6, "Paginação por cursor e filtros de saídas/histórico", _m006_paginacao),
+    (7, "Busca full-text de cadastros (FTS5)", _m007_busca_cadastros),
+    (8, "Séries temporais de performance", _m008_series_performance),
+    (9, "Contador de versão das configurações", _m009_versao_config),
+    (10, "Idempotência de entradas/saídas", _m010_eventos_processados),
+    (11, "Câmeras de ingestão automática", _m011_cameras),
+    (12, "Fila de jobs em segundo plano", _m012_jobs),
+    (13, "Upload de arquivos em blocos com retomada", _m013_uploads_retomaveis),
+    (14, "Arquivos de jobs fora da lista compartilhada", _m014_arquivos_de_jobs),
+]
+
+
+def versao_atual(conn=None):
+    conn = conn or get_db_connection()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            versao INTEGER PRIMARY KEY,
+            descricao TEXT,
+            aplicada_em TEXT
+        )
+    """)
+    row = conn.execute("SELECT MAX(versao) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def aplicar_migracoes(conn=None):
+    """Aplica as migrações pendentes numa única transação e retorna as versões aplicadas.
+
+    Usa BEGIN IMMEDIATE para que vários workers subindo ao mesmo tempo não
+    rodem a mesma migração duas vezes.
+    """
+    conn = conn or get_db_connection()
+    if versao_atual(conn) >= MIGRACOES[-1][0]:
+        return []
+
+    aplicadas = []
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        # Relê dentro do lock: outro worker pode ter migrado enquanto esperávamos
+        cursor.execute("SELECT versao FROM schema_version")
+        ja_aplicadas = {r[0] for r in cursor.fetchall()}
+        for versao, descricao, funcao in MIGRACOES:
+            if versao in ja_aplicadas:
+                continue
+            funcao(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (?, ?, ?)",
+                (versao, descricao, datetime.now().isoformat(timespec="seconds")))
+            aplicadas.append(versao)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return aplicadas
+
+
+def preencher_timestamps_legados(tamanho_lote=1000, conn=None):
+    """Converte entrada/saida em texto para entrada_ts/saida_ts (e data_hora do
+    histórico para data_ts), em lotes.
+
+    Cada lote é uma transação curta, então o servidor continua atendendo
+    entradas e saídas enquanto o backfill roda. Linhas com texto que não
+    pode ser interpretado ficam com NULL (e não são revisitadas). Retorna o
+    total de linhas atualizadas.
+    """
+    conn = conn or get_db_connection()
+    ultimo_id = 0
+    total = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, entrada, saida, entrada_ts, saida_ts FROM movimentacoes
+            WHERE id > ? AND (entrada_ts IS NULL OR (saida IS NOT NULL AND saida_ts IS NULL))
+            ORDER BY id LIMIT ?
+        """, (ultimo_id, tamanho_lote)).fetchall()
+        if not rows:
+            break
+        ultimo_id = rows[-1][0]
+        updates = []
+        for id_, entrada, saida, entrada_ts, saida_ts in rows:
+            novo_entrada = entrada_ts if entrada_ts is not None else texto_para_epoch(entrada)
+            novo_saida = saida_ts if saida_ts is not None else texto_para_epoch(saida)
+            if (novo_entrada, novo_saida) != (entrada_ts, saida_ts):
+                updates.append((novo_entrada, novo_saida, id_))
+        if updates:
+            with conn:
+                conn.executemany(
+                    "UPDATE movimentacoes SET entrada_ts = ?, saida_ts = ? WHERE id = ?", updates)
+            total += len(updates)
+
+    # Histórico de ações: data_hora foi gravada no fuso de São Paulo
+    ultimo_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, data_hora FROM historico_acoes
+            WHERE id > ? AND data_ts IS NULL
+            ORDER BY id LIMIT ?
+        """, (ultimo_id, tamanho_lote)).fetchall()
+        if not rows:
+            break
+        ultimo_id = rows[-1][0]
+        updates = [(texto_para_epoch(data_hora, FUSO_SP), id_) for id_, data_hora in rows]
+        updates = [u for u in updates if u[0] is not None]
+        if updates:
+            with conn:
+                conn.executemany("UPDATE historico_acoes SET data_ts = ? WHERE id = ?", updates)
+            total += len(updates)
+    return total
+
+
+# --- Conferência dos planos de consulta ---
+
+# nome -> (sql, parâmetros de exemplo, índice que o plano deve usar)
+CONSULTAS_QUENTES = {
+    "registrar_entrada (já no pátio)": (
+        "SELECT 1 FROM movimentacoes WHERE placa = ? AND saida IS NULL AND empresa_id = ?",
+        ("ABC1234", 1), "idx_mov_patio"),
+    "registrar_saida": (
+        "UPDATE movimentacoes SET saida = ? WHERE placa = ? AND saida IS NULL AND empresa_id = ?",
+        ("01-01-2026 00:00:00", "ABC1234", 1), "idx_mov_patio"),
+    "entradas/saídas em lote (no pátio)": (
+        "SELECT placa, id, entrada_ts FROM movimentacoes WHERE empresa_id = ? AND saida IS NULL AND placa IN (?, ?, ?)",
+        (1, "ABC1234", "DEF5678", "GHI9012"), "idx_mov_patio"),
+    "listar_veiculos": (
+        "SELECT placa, tipo, entrada, responsavel, cpf_responsavel FROM movimentacoes WHERE saida IS NULL AND empresa_id = ?",
+        (1,), "idx_mov_patio_entrada"),
+    "listar_saidas (página)": (
+        "SELECT placa, tipo, entrada, saida, id FROM movimentacoes WHERE saida IS NOT NULL AND empresa_id = ? AND id < ? ORDER BY id DESC LIMIT 51",
+        (1, 1000), "idx_mov_saidas"),
+    "listar_saidas (placa)": (
+        "SELECT placa, id FROM movimentacoes WHERE saida IS NOT NULL AND empresa_id = ? AND placa >= ? AND placa < ? ORDER BY id DESC LIMIT 51",
+        (1, "ABC", "ABC\uffff"), "idx_mov_saidas_placa"),
+    "listar_saidas (período)": (
+        "SELECT placa, id FROM movimentacoes WHERE saida IS NOT NULL AND empresa_id = ? AND saida_ts >= ? AND saida_ts < ? ORDER BY +id DESC LIMIT 51",
+        (1, 0, 86400), "idx_mov_saida_ts"),
+    "obter_estatisticas (pendentes)": (
+        "SELECT COUNT(*) FROM movimentacoes WHERE saida IS NULL AND empresa_id = ? AND entrada_ts < ?",
+        (1, 0), "idx_mov_patio_entrada"),
+    "obter_estatisticas (saíram hoje)": (
+        "SELECT COUNT(*) FROM movimentacoes WHERE empresa_id = ? AND saida_ts >= ? AND saida_ts < ?",
+        (1, 0, 86400), "idx_mov_saida_ts"),
+    "relatório por período": (
+        "SELECT placa FROM movimentacoes WHERE empresa_id = ? AND entrada_ts >= ? AND entrada_ts < ? ORDER BY entrada_ts",
+        (1, 0, 86400), "idx_mov_entrada_ts"),
+    "exportação de movimentações (lote)": (
+        "SELECT placa, entrada_ts, id FROM movimentacoes WHERE empresa_id = ? AND (entrada_ts, id) > (?, ?) AND entrada_ts < ? ORDER BY entrada_ts, id LIMIT 1000",
+        (1, 0, 0, 86400), "idx_mov_entrada_ts"),
+    "listar_historico": (
+        "SELECT * FROM historico_acoes WHERE empresa_id = ? AND id >= ? AND +data_ts >= ? ORDER BY id DESC LIMIT 51",
+        (1, 0, 0), "idx_hist_empresa_id"),
+    "listar_historico (usuário)": (
+        "SELECT * FROM historico_acoes WHERE empresa_id = ? AND usuario = ? AND id < ? ORDER BY id DESC LIMIT 51",
+        (1, "admin", 1000), "idx_hist_empresa_usuario"),
+    "listar_historico (ação)": (
+        "SELECT * FROM historico_acoes WHERE empresa_id = ? AND acao = ? AND id < ? ORDER BY id DESC LIMIT 51",
+        (1, "LOGIN", 1000), "idx_hist_empresa_acao"),
+    "listar_historico (início do período)": (
+        "SELECT id FROM historico_acoes WHERE empresa_id = ? AND data_ts >= ? ORDER BY data_ts, id LIMIT 1",
+        (1, 0), "idx_hist_empresa_ts"),
+    "get_messages_by_protocol": (
+        "SELECT * FROM chat_mensagens WHERE protocolo_id = ? AND empresa_id = ? ORDER BY id ASC",
+        (1, 1), "idx_chat_msg_protocolo"),
+    "get_open_protocol_for_user": (
+        "SELECT * FROM chat_protocolos WHERE usuario_cliente = ? AND empresa_id = ? AND status IN ('aberto', 'avaliando') ORDER BY id DESC LIMIT 1",
+        ("admin", 1), "idx_chat_proto_usuario"),
+    "listar_cadastros": (
+        "SELECT id, nome FROM cadastros WHERE empresa_id = ? ORDER BY nome",
+        (1,), "idx_cadastros_empresa_nome"),
+    "obter_historico_performance": (
+        "SELECT data_hora, cpu_usage FROM historico_performance WHERE ts >= ? AND ts < ? ORDER BY ts",
+        (0, 86400), "idx_perf_ts"),
+    "consultar_serie": (
+        "SELECT inicio_ts, cpu_avg FROM performance_series WHERE resolucao = ? AND inicio_ts >= ? AND inicio_ts < ? ORDER BY inicio_ts",
+        (3600, 0, 86400), "PRIMARY KEY"),
+    "listar_arquivos_db": (
+        "SELECT * FROM arquivos WHERE empresa_id = ? AND job_id IS NULL ORDER BY id DESC",
+        (1,), "idx_arquivos_empresa_id"),
+    "fila_jobs (próximo pendente)": (
+        "SELECT id FROM jobs WHERE status = 'pendente' AND disponivel_ts <= ? ORDER BY disponivel_ts, id LIMIT 1",
+        (0,), "idx_jobs_pendentes"),
+    "listar_jobs": (
+        "SELECT * FROM jobs WHERE empresa_id = ? AND tipo IN (?, ?) ORDER BY id DESC LIMIT 50",
+        (1, "backup", "relatorio_evolucao"), "idx_jobs_empresa"),
+}
+
+
+def _usa_indice(linha, indice):
+    """A linha do plano usa exatamente esse índice (idx_mov_patio não casa com
+    idx_mov_patio_entrada); "PRIMARY KEY" casa com a chave primária da tabela."""
+    if indice == "PRIMARY KEY":
+        return re.search(r"\bUSING (?:INTEGER )?PRIMARY KEY\b", linha) is not None
+    return re.search(rf"\bUSING (?:COVERING )?INDEX {re.escape(indice)}\b", linha) is not None
+
+
+def verificar_planos(conn=None):
+    """Roda EXPLAIN QUERY PLAN em cada consulta quente.
+
+    Retorna {nome: {"ok": bool, "indice": esperado, "plano": [...]}}; "ok" é
+    False quando o plano não usa o índice esperado (ex.: SCAN na tabela).
+    """
+    conn = conn or get_db_connection()
+    resultado = {}
+    for nome, (sql, params, indice) in CONSULTAS_QUENTES.items():
+        plano = [r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        resultado[nome] = {
+            "ok": any(_usa_indice(linha, indice) for linha in plano),
+            "indice": indice,
+            "plano": plano,
+        }
+    return resultado
+
+
+if __name__ == "__main__":
+    novas = aplicar_migracoes()
+    print(f"Versão do schema: {versao_atual()} (aplicadas agora: {novas or 'nenhuma'})")
+    print(f"Timestamps preenchidos: {preencher_timestamps_legados()}")
+    falhas = 0
+    for nome, info in verificar_planos().items():
+        marca = "OK " if info["ok"] else "FALHA"
+        print(f"[{marca}] {nome}: {' | '.join(info['plano'])}")
+        falhas += 0 if info["ok"] else 1
+    raise SystemExit(1 if falhas else 0)
@@ -0,0 +1,193 @@
+# monitoramento.py
+"""Coletor de status do servidor em segundo plano.
+
+Uma única thread amostra CPU, RAM, disco, velocidade de rede, tamanho do
+banco e os processos que mais usam memória a cada INTERVALO_S segundos e
+guarda as amostras num buffer circular em memória. Outra thread mede o ping
+externo (que pode demorar até o timeout) sem atrasar as amostras.
+
+/api/server-status só lê a última amostra: o custo não depende de quantos
+monitores estão abertos, e a velocidade de rede é calculada sempre entre
+duas amostras do coletor (não entre requisições de clientes diferentes).
+"""
+import os
+import threading
+import time
+import urllib.request
+from collections import deque
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from db import DB_PATH
+
+INTERVALO_S = float(os.getenv("MONITOR_INTERVALO_S", "2"))
+# A lista de processos é mais cara (percorre todos): atualizada com menos frequência
+INTERVALO_PROCESSOS_S = 10
+INTERVALO_PING_S = 10
+TIMEOUT_PING_S = 2
+# 10 minutos de amostras com o intervalo padrão
+TAMANHO_BUFFER = 300
+TOP_PROCESSOS = 5
+
+URL_PING = "https://projeto-sistema-de-veiculos-production.up.railway.app/app-version"
+
+
+class ColetorStatus:
+    def __init__(self, intervalo=INTERVALO_S, tamanho=TAMANHO_BUFFER):
+        self.intervalo = intervalo
+        self._amostras = deque(maxlen=tamanho)
+        self._parar = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._lock_coleta = threading.Lock()
+        self._ultimo_net = None
+        self._processos = []
+        self._processos_ts = 0
+        self.ping_railway = 0
+
+    # --- Coleta ---
+
+    def _rede(self, agora):
+        """Velocidade de upload/download (bytes/s) desde a amostra anterior."""
+        net = psutil.net_io_counters()
+        upload = download = 0
+        if self._ultimo_net is not None:
+            anterior, instante = self._ultimo_net
+            delta = agora - instante
+            if delta > 0:
+                upload = (net.bytes_sent - anterior.bytes_sent) / delta
+                download = (net.bytes_recv - anterior.bytes_recv) / delta
+        self._ultimo_net = (net, agora)
+        return upload, download
+
+    def _top_processos(self, agora):
+        if agora - self._processos_ts >= INTERVALO_PROCESSOS_S:
+            processos = []
+            for proc in psutil.process_iter(['pid', 'name', 'memory_percent']):
+                info = proc.info
+                if info.get('memory_percent') is not None:
+                    processos.append(info)
+            processos.sort(key=lambda p: p['memory_percent'], reverse=True)
+            self._processos = processos[:TOP_PROCESSOS]
+            self._processos_ts = agora
+        return self._processos
+
+    def coletar(self, referencia=False):
+        """Tira uma amostra e a coloca no buffer (chamado pela thread do coletor).
+
+        referencia=True é a primeira amostra: CPU e rede são medidos entre duas
+        leituras, então ela só marca o ponto de partida e informa 0 para eles.
+        """
+        with self._lock_coleta:
+            return self._coletar(referencia)
+
+    def _coletar(self, referencia):
+        agora = time.time()
+        amostra = {
+            "ts": agora,
+            "db_size_mb": round(os.path.getsize(DB_PATH) / (1024 * 1024), 2) if os.path.exists(DB_PATH) else 0,
+            "db_status": "Conectado" if os.path.exists(DB_PATH) else "Erro",
+            "cpu_usage": 0,
+            "ram_usage": 0,
+            "disk_usage": 0,
+            "net_upload_kb": 0,
+            "net_download_kb": 0,
+            "top_processes": [],
+            "railway_ping_backend": self.ping_railway,
+        }
+        if psutil:
+            try:
+                # interval=None: uso desde a chamada anterior, sem dormir
+                cpu = psutil.cpu_percent(interval=None)
+                amostra["cpu_usage"] = 0 if referencia else cpu
+                amostra["ram_usage"] = psutil.virtual_memory().percent
+                amostra["disk_usage"] = psutil.disk_usage('/').percent
+                upload, download = self._rede(agora)
+                amostra["net_upload_kb"] = round(upload / 1024, 1)
+                amostra["net_download_kb"] = round(download / 1024, 1)
+                amostra["top_processes"] = self._top_processos(agora)
+            except Exception as e:
+                print(f"Erro ao coletar status do servidor: {e}")
+        self._amostras.append(amostra)
+        return amostra
+
+    def medir_ping(self):
+        try:
+            inicio = time.time()
+            urllib.request.urlopen(URL_PING, timeout=TIMEOUT_PING_S)
+            self.ping_railway = int((time.time() - inicio) * 1000)
+        except Exception:
+            self.ping_railway = 0  # Offline ou timeout
+        return self.ping_railway
+
+    # --- Threads ---
+
+    def _loop(self, funcao, intervalo, imediato):
+        proxima = time.monotonic()
+        if not imediato:
+            proxima += intervalo
+            self._parar.wait(intervalo)
+        while not self._parar.is_set():
+            try:
+                funcao()
+            except Exception as e:
+                print(f"Erro no coletor de status: {e}")
+            # Cadência fixa: desconta o tempo gasto na coleta
+            proxima += intervalo
+            espera = proxima - time.monotonic()
+            if espera < 0:
+                proxima = time.monotonic()
+                espera = 0
+            self._parar.wait(espera)
+
+    def iniciar(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._parar.clear()
+            self.coletar(referencia=True)
+            self._threads = [
+                threading.Thread(target=self._loop, args=(self.coletar, self.intervalo, False),
+                                 name="monitor", daemon=True),
+                threading.Thread(target=self._loop, args=(self.medir_ping, INTERVALO_PING_S, True),
+                                 name="monitor-ping", daemon=True),
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def encerrar(self, timeout=5):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._parar.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    # --- Leitura ---
+
+    def ultima_amostra(self):
+        """Última amostra (None se o coletor ainda não rodou)."""
+        try:
+            return self._amostras[-1]
+        except IndexError:
+            return None
+
+    def amostras(self, segundos=None):
+        """Amostras do buffer (as dos últimos `segundos`, se informado), da mais antiga à mais nova."""
+        amostras = list(self._amostras)
+        if segundos is not None:
+            limite = time.time() - segundos
+            amostras = [a for a in amostras if a["ts"] >= limite]
+        return amostras
+
+    def media(self, segundos, campos=("cpu_usage", "ram_usage", "disk_usage")):
+        """Média de cada campo nas amostras dos últimos `segundos` (vazio se não houver amostras)."""
+        amostras = self.amostras(segundos)
+        if not amostras:
+            return {}
+        return {campo: round(sum(a[campo] for a in amostras) / len(amostras), 1) for campo in campos}
+
+
+coletor_status = ColetorStatus()
@@ -0,0 +1,309 @@
+# ocr_placas.py
+"""Reconhecimento de placas no servidor (alternativa ao Tesseract.js do scanner).
+
+Pipeline de cada foto, executado nos processos do pool de OCR (executores.py):
+
+1. Pré-processamento: decodifica, corrige a rotação do EXIF, converte para
+   cinza, reduz para LARGURA_MAX e estica o contraste.
+2. Detecção da placa: os caracteres formam uma faixa horizontal com muitas
+   bordas verticais. A densidade dessas bordas é somada em janelas (imagem
+   integral) e as faixas mais densas com proporção de placa viram candidatas.
+3. Reconhecimento: cada candidata é binarizada (Otsu) e lida pelo Tesseract
+   em modo de linha única, só com letras e dígitos.
+4. Restrição ao formato: o texto lido é encaixado nos padrões de placa_valida
+   (antigo ABC1234 e Mercosul ABC1D23), trocando confusões comuns do OCR
+   (0/O, 1/I, 8/B...) conforme a posição pede letra ou dígito. Cada troca
+   reduz a confiança.
+
+FilaOCR junta as requisições que chegam ao mesmo tempo em lotes: um lote por
+tarefa no pool custa uma ida e volta entre processos em vez de uma por foto,
+e sob carga as fotos esperam na fila em vez de disputar os workers.
+
+Dependências opcionais: Pillow, numpy, pytesseract e o binário tesseract-ocr
+do sistema. Sem elas, ocr_disponivel() é False e a rota responde 503 (o
+scanner volta ao OCR no navegador).
+"""
+import asyncio
+import functools
+import io
+import os
+import shutil
+import time
+
+try:
+    import numpy as np
+    from PIL import Image, ImageOps
+except ImportError:
+    np = Image = ImageOps = None
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+from placas import formato_placa, normalizar_placa, placa_valida
+from executores import MAX_PROCESSOS_OCR, executar_ocr
+
+LARGURA_MAX = 1024
+MAX_BYTES_IMAGEM = 8 * 1024 * 1024
+MAX_REGIOES = 4
+# Proporção largura/altura aceita para uma placa (400x130 mm, com folga para perspectiva)
+PROPORCAO_MIN, PROPORCAO_MAX = 1.8, 7.0
+ALTURA_OCR = 64
+TIMEOUT_TESSERACT_S = 5
+CONFIG_TESSERACT = "--psm 7 --oem 1 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+# Cada caractere trocado para caber no padrão multiplica a confiança por este fator
+PENALIDADE_CORRECAO = 0.8
+
+# Lotes: espera até JANELA_LOTE_S por mais fotos, no máximo TAMANHO_LOTE por tarefa
+JANELA_LOTE_S = float(os.getenv("OCR_JANELA_LOTE_MS", "15")) / 1000
+TAMANHO_LOTE = int(os.getenv("OCR_TAMANHO_LOTE", "8"))
+MAX_FILA = int(os.getenv("OCR_MAX_FILA", "64"))
+
+# Posições de uma placa: L = letra, D = dígito, X = qualquer (dígito no antigo, letra no Mercosul)
+_POSICOES = "LLLDXDD"
+_PARA_LETRA = {"0": "O", "1": "I", "2": "Z", "4": "A", "5": "S", "6": "G", "7": "T", "8": "B"}
+_PARA_DIGITO = {"O": "0", "Q": "0", "D": "0", "U": "0", "I": "1", "L": "1", "J": "1", "Z": "2",
+                "A": "4", "S": "5", "G": "6", "T": "7", "B": "8"}
+
+
+class FilaCheia(Exception):
+    """Mais fotos esperando do que MAX_FILA: a rota responde 503 em vez de acumular."""
+
+
+@functools.lru_cache(maxsize=None)
+def ocr_disponivel():
+    return None not in (np, Image, pytesseract) and shutil.which("tesseract") is not None
+
+
+# --- Pipeline (roda nos workers) ---
+
+def preprocessar(dados):
+    """bytes da foto -> (matriz uint8 em cinza, escala aplicada)."""
+    imagem = Image.open(io.BytesIO(dados))
+    return normalizar_cinza(ImageOps.exif_transpose(imagem).convert("L"))
+
+
+def normalizar_cinza(imagem):
+    """Imagem (PIL ou matriz) em cinza -> (matriz uint8 reduzida para LARGURA_MAX e com contraste esticado, escala)."""
+    if not isinstance(imagem, Image.Image):
+        imagem = Image.fromarray(imagem)
+    escala = min(1.0, LARGURA_MAX / max(imagem.size))
+    if escala < 1.0:
+        imagem = imagem.resize((round(imagem.width * escala), round(imagem.height * escala)),
+                               Image.BILINEAR)
+    imagem = ImageOps.autocontrast(imagem, cutoff=1)
+    return np.asarray(imagem), escala
+
+
+def _soma_janelas(matriz, altura, largura):
+    """Soma de cada janela altura x largura (ancorada no canto superior esquerdo), via imagem integral."""
+    integral = np.zeros((matriz.shape[0] + 1, matriz.shape[1] + 1), dtype=np.int64)
+    integral[1:, 1:] = matriz.cumsum(0).cumsum(1)
+    return (integral[altura:, largura:] - integral[:-altura, largura:]
+            - integral[altura:, :-largura] + integral[:-altura, :-largura])
+
+
+def _suavizar(perfil, tamanho):
+    return np.convolve(perfil, np.ones(tamanho) / tamanho, "same")
+
+
+def _expandir(perfil, centro, limiar):
+    """Maior intervalo [inicio, fim) em torno de centro com perfil >= limiar."""
+    inicio = fim = centro
+    while inicio > 0 and perfil[inicio - 1] >= limiar:
+        inicio -= 1
+    while fim < len(perfil) and perfil[fim] >= limiar:
+        fim += 1
+    return inicio, max(fim, centro + 1)
+
+
+def detectar_regioes(cinza, maximo=MAX_REGIOES):
+    """Caixas (x0, y0, x1, y1, pontuação) das faixas com cara de placa, da mais provável à menos."""
+    altura, largura = cinza.shape
+    gradiente = np.abs(np.diff(cinza.astype(np.int16), axis=1))
+    bordas = (gradiente > max(40, np.percentile(gradiente, 90))).astype(np.int32)
+    janela_a, janela_l = max(4, altura // 24), max(8, largura // 10)
+    if bordas.shape[0] <= janela_a or bordas.shape[1] <= janela_l:
+        return []
+    densidade = _soma_janelas(bordas, janela_a, janela_l).astype(np.float64) / (janela_a * janela_l)
+    pico_global = densidade.max()
+    regioes = []
+    for _ in range(maximo * 3):
+        if len(regioes) == maximo:
+            break
+        y, x = np.unravel_index(np.argmax(densidade), densidade.shape)
+        pico = densidade[y, x]
+        if pico <= 0 or pico < 0.35 * pico_global:
+            break
+        # Faixa de linhas com bordas dentro das colunas da janela, depois as colunas dentro da faixa
+        linhas = _suavizar(bordas[:, x:x + janela_l].mean(axis=1), max(3, janela_a // 2))
+        y0, y1 = _expandir(linhas, y + janela_a // 2, 0.2 * linhas[y:y + janela_a].mean())
+        colunas = _suavizar(bordas[y0:y1].mean(axis=0), max(3, largura // 40))
+        x0, x1 = _expandir(colunas, x + janela_l // 2, 0.25 * colunas[x:x + janela_l].mean())
+        # Não escolhe de novo nada que se sobreponha a esta caixa
+        densidade[max(0, y0 - janela_a):y1, max(0, x0 - janela_l):x1] = 0
+        proporcao = (x1 - x0) / max(1, y1 - y0)
+        if PROPORCAO_MIN <= proporcao <= PROPORCAO_MAX and y1 - y0 >= 8:
+            folga_y, folga_x = (y1 - y0) // 6, (y1 - y0) // 3
+            regioes.append((max(0, x0 - folga_x), max(0, y0 - folga_y),
+                            min(largura, x1 + folga_x), min(altura, y1 + folga_y), round(float(pico / pico_global), 2)))
+    return regioes
+
+
+def _otsu(cinza):
+    histograma = np.bincount(cinza.ravel(), minlength=256).astype(np.float64)
+    total = histograma.sum()
+    acumulado = histograma.cumsum()
+    media_acumulada = (histograma * np.arange(256)).cumsum()
+    fundo = acumulado / total
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entre_classes = (media_acumulada[-1] * fundo - media_acumulada) ** 2 / (fundo * (1 - fundo))
+    return int(np.nanargmax(entre_classes))
+
+
+def _ler_texto(recorte):
+    """Binariza (texto escuro sobre fundo claro) e lê uma linha com o Tesseract: (texto, confiança 0-1)."""
+    imagem = Image.fromarray(recorte)
+    imagem = imagem.resize((max(1, round(imagem.width * ALTURA_OCR / imagem.height)), ALTURA_OCR),
+                           Image.BICUBIC)
+    matriz = np.asarray(imagem)
+    binaria = np.where(matriz > _otsu(matriz), 255, 0).astype(np.uint8)
+    if binaria.mean() < 128:
+        binaria = 255 - binaria
+    imagem = ImageOps.expand(Image.fromarray(binaria), border=10, fill=255)
+    dados = pytesseract.image_to_data(imagem, config=CONFIG_TESSERACT, timeout=TIMEOUT_TESSERACT_S,
+                                      output_type=pytesseract.Output.DICT)
+    palavras = [(t, float(c)) for t, c in zip(dados["text"], dados["conf"]) if t.strip() and float(c) >= 0]
+    if not palavras:
+        return "", 0.0
+    return "".join(t for t, _ in palavras), sum(c for _, c in palavras) / len(palavras) / 100
+
+
+def encaixar_placa(texto):
+    """Melhor placa válida contida no texto lido: (placa, correções) ou (None, None)."""
+    texto = "".join(c for c in normalizar_placa(texto) if c.isalnum())
+    melhor = (None, None)
+    for inicio in range(len(texto) - len(_POSICOES) + 1):
+        candidata, correcoes = [], 0
+        for caractere, posicao in zip(texto[inicio:inicio + len(_POSICOES)], _POSICOES):
+            if posicao == "L" and caractere.isdigit():
+                caractere, correcoes = _PARA_LETRA.get(caractere), correcoes + 1
+            elif posicao == "D" and caractere.isalpha():
+                caractere, correcoes = _PARA_DIGITO.get(caractere), correcoes + 1
+            if caractere is None:
+                break
+            candidata.append(caractere)
+        else:
+            placa = "".join(candidata)
+            if placa_valida(placa) and (melhor[1] is None or correcoes < melhor[1]):
+                melhor = (placa, correcoes)
+    return melhor
+
+
+def reconhecer_imagem(dados):
+    """Uma foto -> {"placa", "confianca", "formato", "regiao", "tempo_ms"} (placa None se não achou)."""
+    inicio = time.perf_counter()
+    resultado = reconhecer_quadro(*preprocessar(dados))
+    resultado["tempo_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    return resultado
+
+
+def reconhecer_quadro(cinza, escala=1.0):
+    """Etapas 2 a 4 sobre uma matriz já normalizada (ver normalizar_cinza); regiao volta na escala original."""
+    melhor = {"placa": None, "confianca": 0.0, "formato": None, "regiao": None}
+    for x0, y0, x1, y1, pontuacao in detectar_regioes(cinza):
+        recorte = cinza[y0:y1, x0:x1]
+        # Mercosul: a faixa azul "BRASIL" no topo atrapalha a leitura em linha única
+        for tentativa in (recorte, recorte[recorte.shape[0] * 3 // 10:]):
+            texto, confianca = _ler_texto(tentativa)
+            placa, correcoes = encaixar_placa(texto)
+            if placa is None:
+                continue
+            confianca = round(confianca * PENALIDADE_CORRECAO ** correcoes, 2)
+            if confianca > melhor["confianca"]:
+                melhor = {
+                    "placa": placa,
+                    "confianca": confianca,
+                    "formato": formato_placa(placa),
+                    "regiao": [round(v / escala) for v in (x0, y0, x1, y1)],
+                }
+            break
+        if melhor["confianca"] >= 0.9:
+            break
+    return melhor
+
+
+def reconhecer_lote(imagens):
+    """Tarefa enviada ao pool: uma resposta por foto, na mesma ordem (erros não derrubam o lote)."""
+    resultados = []
+    for dados in imagens:
+        try:
+            resultados.append(reconhecer_imagem(dados))
+        except Exception as e:
+            print(f"Erro no OCR de placa: {e}")
+            resultados.append({"placa": None, "confianca": 0.0, "erro": "Não foi possível ler a imagem."})
+    return resultados
+
+
+# --- Fila de lotes (roda no event loop do servidor) ---
+
+class FilaOCR:
+    def __init__(self, janela=JANELA_LOTE_S, tamanho=TAMANHO_LOTE, em_paralelo=MAX_PROCESSOS_OCR,
+                 max_fila=MAX_FILA):
+        self.janela = janela
+        self.tamanho = tamanho
+        self.em_paralelo = em_paralelo
+        self.max_fila = max_fila
+        self._pendentes = []
+        self._vagas = None
+        self._despachante = None
+        self._tarefas = set()
+
+    async def reconhecer(self, dados):
+        """Enfileira uma foto e espera o resultado do lote em que ela entrar."""
+        if len(self._pendentes) >= self.max_fila:
+            raise FilaCheia()
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendentes.append((dados, futuro))
+        if self._despachante is None:
+            self._despachante = asyncio.create_task(self._despachar())
+        return await futuro
+
+    async def _despachar(self):
+        if self._vagas is None:
+            self._vagas = asyncio.Semaphore(self.em_paralelo)
+        try:
+            while self._pendentes:
+                # Um lote por worker livre; enquanto todos trabalham, as fotos acumulam num lote maior
+                await self._vagas.acquire()
+                if len(self._pendentes) < self.tamanho:
+                    await asyncio.sleep(self.janela)
+                lote, self._pendentes = self._pendentes[:self.tamanho], self._pendentes[self.tamanho:]
+                tarefa = asyncio.create_task(self._executar(lote))
+                self._tarefas.add(tarefa)
+                tarefa.add_done_callback(self._tarefas.discard)
+        finally:
+            self._despachante = None
+
+    async def _executar(self, lote):
+        try:
+            # Requisições canceladas (cliente desconectou) não vão para o worker
+            lote = [(dados, futuro) for dados, futuro in lote if not futuro.done()]
+            if not lote:
+                return
+            try:
+                resultados = await executar_ocr(reconhecer_lote, [dados for dados, _ in lote])
+            except Exception as e:
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                return
+            for (_, futuro), resultado in zip(lote, resultados):
+                if not futuro.done():
+                    futuro.set_result(resultado)
+        finally:
+            self._vagas.release()
+
+
+fila_ocr = FilaOCR()
@@ -0,0 +1,96 @@
+# placas.py
+"""Normalização, validação e conversão de placas (padrão antigo ABC1234 e Mercosul ABC1D23).
+
+Os padrões são compilados uma vez (antes cada chamada passava o padrão em
+texto para re.match, duas vezes). A limpeza continua com str.replace: para
+textos de 7-8 caracteres, str.translate com tabela de remoção mediu ~5x mais
+lento (ver benchmarks/bench_placas.py). As funções de lote
+(normalizar_placas / validar_placas) processam listas inteiras com map sobre
+métodos em C, sem chamadas de função Python por placa, para importações de
+CSV e sincronização de portões.
+
+Conversão entre formatos: na Mercosul o 5º caractere (dígito 0-9 no padrão
+antigo) virou letra A-J. ABC1234 e ABC1C34 são o mesmo veículo; chave_veiculo
+dá uma forma única para comparar placas nos dois formatos.
+"""
+import re
+from itertools import repeat
+
+_PADRAO_ANTIGO = re.compile(r"[A-Z]{3}[0-9]{4}")
+_PADRAO_MERCOSUL = re.compile(r"[A-Z]{3}[0-9][A-Z][0-9]{2}")
+_PADRAO_PLACA = re.compile(r"[A-Z]{3}[0-9][A-Z0-9][0-9]{2}")
+
+# 5º caractere: dígito do padrão antigo <-> letra da Mercosul
+_DIGITO_PARA_LETRA = dict(zip("0123456789", "ABCDEFGHIJ"))
+_LETRA_PARA_DIGITO = {letra: digito for digito, letra in _DIGITO_PARA_LETRA.items()}
+
+
+def normalizar_placa(placa):
+    """Maiúsculas, sem hífen e sem espaços ("abc-1234" -> "ABC1234")."""
+    return placa.upper().replace("-", "").replace(" ", "")
+
+
+def placa_valida(placa):
+    return _PADRAO_PLACA.fullmatch(normalizar_placa(placa)) is not None
+
+
+def formato_placa(placa):
+    """"antigo", "mercosul" ou None (placa já normalizada)."""
+    if _PADRAO_ANTIGO.fullmatch(placa):
+        return "antigo"
+    if _PADRAO_MERCOSUL.fullmatch(placa):
+        return "mercosul"
+    return None
+
+
+def para_mercosul(placa):
+    """Placa válida (normalizada) no formato Mercosul; as Mercosul voltam iguais."""
+    quinto = placa[4]
+    return placa[:4] + _DIGITO_PARA_LETRA.get(quinto, quinto) + placa[5:]
+
+
+def para_antigo(placa):
+    """Placa válida (normalizada) no padrão antigo; None para Mercosul emitidas já no novo
+    formato (5ª letra depois de J, sem placa antiga correspondente)."""
+    quinto = placa[4]
+    if quinto.isdigit():
+        return placa
+    digito = _LETRA_PARA_DIGITO.get(quinto)
+    return placa[:4] + digito + placa[5:] if digito else None
+
+
+def chave_veiculo(placa):
+    """Forma única do veículo nos dois formatos (a Mercosul, que sempre existe)."""
+    return para_mercosul(placa)
+
+
+def variantes_placa(placa):
+    """Formas em que o mesmo veículo pode estar gravado: como informada, normalizada,
+    no outro formato e com hífen (registros antigos, ex.: "ABC-1234")."""
+    normalizada = normalizar_placa(placa)
+    if not _PADRAO_PLACA.fullmatch(normalizada):
+        return [placa]
+    outra = para_antigo(normalizada) if normalizada[4].isalpha() else para_mercosul(normalizada)
+    formas = [placa, normalizada]
+    for forma in (normalizada, outra):
+        if forma:
+            formas += [forma, f"{forma[:3]}-{forma[3:]}"]
+    return list(dict.fromkeys(formas))
+
+
+# --- Lote ---
+
+def _normalizar_lote(placas):
+    """Iterador de placas normalizadas (mesmo resultado de normalizar_placa)."""
+    maiusculas = map(str.upper, placas)
+    sem_hifen = map(str.replace, maiusculas, repeat("-"), repeat(""))
+    return map(str.replace, sem_hifen, repeat(" "), repeat(""))
+
+
+def normalizar_placas(placas):
+    return list(_normalizar_lote(placas))
+
+
+def validar_placas(placas):
+    """Para cada placa, a forma normalizada se for válida ou None."""
+    return [m and m.string for m in map(_PADRAO_PLACA.fullmatch, _normalizar_lote(placas))]
@@ -0,0 +1,136 @@
+# senhas.py
+"""Hash e verificação de senhas (bcrypt) com custo calibrado para o servidor.
+
+O custo do bcrypt dobra o tempo a cada +1. Com o custo fixo do gensalt()
+(12), cada login segurava um núcleo por ~250 ms, e na troca de turno dezenas
+de vigilantes logam ao mesmo tempo. Agora:
+
+- calibrar_custo() mede o bcrypt nesta máquina e escolhe o maior custo cuja
+  verificação fica dentro de TEMPO_ALVO_MS (entre CUSTO_MIN e CUSTO_MAX). A
+  medição roda só na primeira subida (ou quando o admin pede, em
+  /dev/senhas/recalibrar) e o resultado fica gravado em configuracoes
+  (senha_custo): o ruído entre uma medição e outra não muda o custo a cada
+  reinício. SENHA_CUSTO no ambiente fixa o custo e pula a medição (útil com
+  vários servidores, para todos gravarem o mesmo custo);
+- verificar_e_atualizar() confere a senha e, se o hash gravado tem custo
+  menor que o atual, devolve um hash novo no custo atual: o login regrava o
+  hash sem o usuário perceber. Hash com custo maior fica como está (uma
+  calibração mais baixa nunca enfraquece os hashes já gravados);
+- as verificações rodam no pool de processos próprio de senhas
+  (executores.executar_senha), limitado a MAX_PROCESSOS_SENHA workers, para uma
+  rajada de logins não ocupar todos os núcleos.
+
+Ver benchmarks/bench_login.py.
+"""
+import os
+import time
+
+import bcrypt
+
+from db import get_db_connection
+
+CUSTO_MIN = 10
+CUSTO_MAX = 14
+CUSTO_PADRAO = 12  # o do bcrypt.gensalt(), usado até a calibração
+TEMPO_ALVO_MS = float(os.getenv("SENHA_TEMPO_ALVO_MS", "100"))
+
+# Custo baixo o bastante para medir rápido e alto o bastante para o tempo ser
+# dominado pelo bcrypt (e não pela chamada)
+_CUSTO_MEDICAO = 8
+_AMOSTRAS_MEDICAO = 5
+
+# Chave em configuracoes com o custo calibrado
+CHAVE_CUSTO = "senha_custo"
+
+_custo_atual = int(os.getenv("SENHA_CUSTO", str(CUSTO_PADRAO)))
+
+
+def _bytes(valor):
+    # O bcrypt exige bytes
+    return valor.encode('utf-8') if isinstance(valor, str) else valor
+
+
+def custo_do_hash(senha_hash):
+    """Custo gravado no hash ("$2b$12$..." -> 12); None se não for um hash bcrypt."""
+    try:
+        return int(_bytes(senha_hash).split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def calibrar_custo(tempo_alvo_ms=TEMPO_ALVO_MS):
+    """Maior custo cuja verificação leva até tempo_alvo_ms nesta máquina (limitado a CUSTO_MIN..CUSTO_MAX)."""
+    salt = bcrypt.gensalt(_CUSTO_MEDICAO)
+    tempos = []
+    for _ in range(_AMOSTRAS_MEDICAO):
+        inicio = time.perf_counter()
+        bcrypt.hashpw(b"calibracao", salt)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    # Mediana: um pico de carga na subida não derruba o custo
+    base_ms = sorted(tempos)[len(tempos) // 2]
+    custo = CUSTO_MIN
+    while custo < CUSTO_MAX and base_ms * 2 ** (custo + 1 - _CUSTO_MEDICAO) <= tempo_alvo_ms:
+        custo += 1
+    return custo
+
+
+def definir_custo(custo):
+    global _custo_atual
+    _custo_atual = max(CUSTO_MIN, min(CUSTO_MAX, int(custo)))
+
+
+def _custo_gravado():
+    row = get_db_connection().execute("SELECT valor FROM configuracoes WHERE chave = ?", (CHAVE_CUSTO,)).fetchone()
+    try:
+        return int(row[0]) if row else None
+    except ValueError:
+        return None
+
+
+def calibrar(recalibrar=False):
+    """Define o custo atual, na ordem: SENHA_CUSTO do ambiente, o custo gravado em
+    configuracoes ou uma medição nova, que fica gravada. Chamado na subida do
+    servidor (depois das migrações); recalibrar=True ignora o custo gravado."""
+    if os.getenv("SENHA_CUSTO"):
+        definir_custo(os.getenv("SENHA_CUSTO"))
+        return _custo_atual
+    custo = None if recalibrar else _custo_gravado()
+    if custo is not None:
+        definir_custo(custo)
+        return _custo_atual
+    definir_custo(calibrar_custo())
+    with get_db_connection() as conn:
+        conn.execute("INSERT OR REPLACE INTO configuracoes (chave, valor) VALUES (?, ?)",
+                     (CHAVE_CUSTO, str(_custo_atual)))
+    return _custo_atual
+
+
+def custo_atual():
+    return _custo_atual
+
+
+def get_hash_senha(senha, custo=None):
+    return bcrypt.hashpw(_bytes(senha), bcrypt.gensalt(custo or _custo_atual)).decode('utf-8')
+
+
+def get_hash_senhas(senhas, custo):
+    """Hashes de uma lista de senhas (uma tarefa do pool por lote, ver importacao_usuarios.py)."""
+    return [get_hash_senha(senha, custo) for senha in senhas]
+
+
+def verificar_senha(senha_plana, senha_hash):
+    return bcrypt.checkpw(_bytes(senha_plana), _bytes(senha_hash))
+
+
+def verificar_e_atualizar(senha_plana, senha_hash, custo):
+    """(senha confere, hash novo ou None). O hash novo (no `custo` informado) só
+    vem quando a senha confere e o hash gravado tem custo menor.
+
+    Roda no pool de senhas, que não enxerga o custo calibrado no processo do
+    servidor: por isso o custo vem como argumento.
+    """
+    if not verificar_senha(senha_plana, senha_hash):
+        return False, None
+    if (custo_do_hash(senha_hash) or 0) >= custo:
+        return True, None
+    return True, get_hash_senha(senha_plana, custo)
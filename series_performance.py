@@ -0,0 +1,179 @@
+# series_performance.py
+"""Séries temporais de performance do servidor (CPU, RAM, disco e ping).
+
+- historico_performance: amostra bruta a cada 5 minutos (ts em epoch, indexado).
+- performance_series: agregados min/avg/max por resolução (1 minuto, 1 hora,
+  1 dia), chave (resolucao, inicio_ts).
+
+Os agregados de 1 minuto vêm das amostras do coletor de status
+(monitoramento.py); os de 1 hora e 1 dia são recalculados a partir da
+resolução anterior para os períodos recentes. Cada resolução tem sua
+retenção, e consultar_serie escolhe a resolução pelo tamanho da janela.
+"""
+import time
+from datetime import datetime
+
+from datas import FUSO_SP
+from db import get_db_connection
+
+MINUTO = 60
+HORA = 3600
+DIA = 86400
+
+# resolução (s) -> por quanto tempo os pontos são mantidos (s)
+RETENCAO = {
+    MINUTO: 2 * DIA,
+    HORA: 90 * DIA,
+    DIA: 5 * 365 * DIA,
+}
+RETENCAO_BRUTO = 30 * DIA
+MAX_PONTOS = 500
+
+METRICAS = ("cpu", "ram", "disk", "ping")
+# metrica -> campo da amostra do coletor
+_CAMPOS_AMOSTRA = {
+    "cpu": "cpu_usage",
+    "ram": "ram_usage",
+    "disk": "disk_usage",
+    "ping": "railway_ping_backend",
+}
+
+COLUNAS_AGREGADOS = ", ".join(f"{m}_min, {m}_avg, {m}_max" for m in METRICAS)
+
+
+def deslocamento_local():
+    """Deslocamento de São Paulo em relação ao UTC (s), para os dias começarem à meia-noite local."""
+    return int(datetime.now(FUSO_SP).utcoffset().total_seconds())
+
+
+def inicio_do_periodo(ts, resolucao):
+    """Início do balde de `resolucao` que contém ts (dias alinhados ao horário de São Paulo)."""
+    deslocamento = deslocamento_local() if resolucao == DIA else 0
+    return (int(ts) + deslocamento) // resolucao * resolucao - deslocamento
+
+
+# Último minuto já agregado (cada minuto é gravado uma vez, logo depois de fechar)
+_ultimo_minuto = 0
+
+
+def registrar_amostras(amostras, agora=None):
+    """Grava os agregados de 1 minuto dos minutos fechados desde a última chamada.
+
+    As amostras vêm do buffer do coletor (10 minutos), que se sobrepõe entre
+    chamadas; só entram minutos ainda não gravados, enquanto todas as suas
+    amostras ainda estão no buffer.
+    """
+    global _ultimo_minuto
+    agora = agora or time.time()
+    minutos = {}
+    for amostra in amostras:
+        inicio = inicio_do_periodo(amostra["ts"], MINUTO)
+        if _ultimo_minuto < inicio and inicio + MINUTO <= agora:
+            minutos.setdefault(inicio, []).append(amostra)
+
+    linhas = []
+    for inicio, grupo in sorted(minutos.items()):
+        valores = [inicio, len(grupo)]
+        for metrica in METRICAS:
+            serie = [a[_CAMPOS_AMOSTRA[metrica]] for a in grupo]
+            valores += [min(serie), sum(serie) / len(serie), max(serie)]
+        linhas.append(valores)
+    if not linhas:
+        return 0
+
+    with get_db_connection() as conn:
+        conn.executemany(f"""
+            INSERT OR REPLACE INTO performance_series (resolucao, inicio_ts, amostras, {COLUNAS_AGREGADOS})
+            VALUES ({MINUTO}, ?, ?, {", ".join("?" * 3 * len(METRICAS))})
+        """, linhas)
+    _ultimo_minuto = linhas[-1][0]
+    return len(linhas)
+
+
+def _sql_consolidar(origem, destino, deslocamento):
+    """INSERT ... SELECT que agrega a resolução `origem` em baldes de `destino`."""
+    agregados = ", ".join(
+        f"MIN({m}_min), SUM({m}_avg * amostras) / SUM(amostras), MAX({m}_max)" for m in METRICAS)
+    balde = f"(inicio_ts + ({deslocamento})) / {destino} * {destino} - ({deslocamento})"
+    return f"""
+        INSERT OR REPLACE INTO performance_series (resolucao, inicio_ts, amostras, {COLUNAS_AGREGADOS})
+        SELECT {destino}, {balde} AS balde, SUM(amostras), {agregados}
+        FROM performance_series
+        WHERE resolucao = {origem} AND inicio_ts >= ?
+        GROUP BY balde
+    """
+
+
+def consolidar(agora=None, conn=None):
+    """Recalcula as horas e dias recentes a partir da resolução imediatamente menor.
+
+    Só a hora/dia atual e o anterior são refeitos (os mais antigos já estão
+    fechados e a resolução de origem pode até ter expirado).
+    """
+    agora = agora or time.time()
+    conn = conn or get_db_connection()
+    deslocamento = deslocamento_local()
+    with conn:
+        conn.execute(_sql_consolidar(MINUTO, HORA, 0),
+                     (inicio_do_periodo(agora, HORA) - HORA,))
+        conn.execute(_sql_consolidar(HORA, DIA, deslocamento),
+                     (inicio_do_periodo(agora, DIA) - DIA,))
+
+
+def aplicar_retencao(agora=None, conn=None):
+    """Apaga os pontos mais antigos que a retenção de cada resolução (e as amostras brutas)."""
+    agora = agora or time.time()
+    conn = conn or get_db_connection()
+    apagados = 0
+    with conn:
+        for resolucao, retencao in RETENCAO.items():
+            apagados += conn.execute(
+                "DELETE FROM performance_series WHERE resolucao = ? AND inicio_ts < ?",
+                (resolucao, agora - retencao)).rowcount
+        apagados += conn.execute(
+            "DELETE FROM historico_performance WHERE ts < ?", (agora - RETENCAO_BRUTO,)).rowcount
+    return apagados
+
+
+def atualizar_series(amostras):
+    """Ciclo da tarefa de fundo: agregados de 1 minuto, consolidação e retenção."""
+    agora = time.time()
+    registrar_amostras(amostras, agora)
+    consolidar(agora)
+    aplicar_retencao(agora)
+
+
+def escolher_resolucao(inicio, fim, max_pontos=MAX_PONTOS, agora=None):
+    """Menor resolução que ainda tem dados desde `inicio` e cabe em `max_pontos` pontos."""
+    agora = agora or time.time()
+    for resolucao in sorted(RETENCAO):
+        if inicio >= agora - RETENCAO[resolucao] and (fim - inicio) / resolucao <= max_pontos:
+            return resolucao
+    return max(RETENCAO)
+
+
+def consultar_serie(inicio, fim, max_pontos=MAX_PONTOS, resolucao=None):
+    """Pontos entre inicio e fim (epoch), na resolução escolhida pela janela.
+
+    Retorna {"resolucao": segundos, "pontos": [{"ts", "amostras", "cpu_min", "cpu_avg", ...}]}.
+    """
+    if fim <= inicio:
+        raise ValueError("O fim do período deve ser depois do início.")
+    if resolucao is None:
+        resolucao = escolher_resolucao(inicio, fim, max_pontos)
+    elif resolucao not in RETENCAO:
+        raise ValueError(f"Resolução inválida: {resolucao}")
+    conn = get_db_connection()
+    cursor = conn.execute(f"""
+        SELECT inicio_ts, amostras, {COLUNAS_AGREGADOS} FROM performance_series
+        WHERE resolucao = ? AND inicio_ts >= ? AND inicio_ts < ?
+        ORDER BY inicio_ts
+    """, (resolucao, inicio_do_periodo(inicio, resolucao), fim))
+    colunas = ["ts"] + [d[0] for d in cursor.description[1:]]
+    pontos = []
+    for row in cursor.fetchall():
+        ponto = dict(zip(colunas, row))
+        for chave in colunas[2:]:
+            ponto[chave] = round(ponto[chave], 1) if ponto[chave] is not None else None
+        pontos.append(ponto)
+    return {"resolucao": resolucao, "pontos": pontos}
@@ -1,72 +1,306 @@
 # services.py
 import csv
 import os
+import re
 import sqlite3
+import time
 from datetime import datetime
-import zipfile
 from typing import Optional
-import bcrypt
 import json
-import pytz
 try:
     import psutil
 except ImportError:
     psutil = None
+from db import get_db_connection, estatisticas_pool, DB_PATH
+from migrations import aplicar_migracoes, recalcular_estatisticas
+from datas import agora_movimentacao, movimentacao_de_epoch, intervalo_do_dia, intervalo_de_datas, FUSO_SP
+from eventos import barramento, topico_patio, topico_chat, TOPICO_CHAT_SUPORTE
+from backup import criar_snapshot, aplicar_retencao
+from auditoria import fila_auditoria
+from config_cache import cache_config
+from cache_usuarios import cache_usuarios
+from senhas import get_hash_senha
+from placas import normalizar_placa, placa_valida, validar_placas, variantes_placa, chave_veiculo
+
+# Máximo de resultados da busca de cadastros
+LIMITE_BUSCA_CADASTROS = 50
+
+# Paginação por cursor (id) de /saidas e /api/historico
+LIMITE_PAGINA = 50
+MAX_LIMITE_PAGINA = 200
+
+# Linhas lidas por consulta nas exportações em streaming
+LOTE_EXPORTACAO = 1000
+
+# Entradas/saídas em lote (portão ou scanner sincronizando leituras offline)
+MAX_EVENTOS_LOTE = 500
+# Horário informado pelo cliente: aceita leituras de até 7 dias atrás e um
+# pequeno adiantamento do relógio do aparelho (além disso vale o horário do servidor)
+MAX_ATRASO_EVENTO_S = 7 * 86400
+MAX_ADIANTAMENTO_EVENTO_S = 300
+# Por quanto tempo um id_evento já processado é lembrado (maior que MAX_ATRASO_EVENTO_S)
+RETENCAO_EVENTOS_DIAS = 30
+MAX_TAMANHO_ID_EVENTO = 64
+
+def _reservar_evento(cursor, empresa_id, id_evento):
+    """Reserva a chave de idempotência; se já foi processada, retorna o resultado gravado.
+
+    O INSERT é o primeiro comando da transação: ele já pega a trava de escrita,
+    então duas repetições simultâneas do mesmo evento são serializadas.
+    """
+    cursor.execute("""
+        INSERT OR IGNORE INTO eventos_processados (empresa_id, id_evento, criado_ts)
+        VALUES (?, ?, ?)
+    """, (empresa_id, id_evento, int(time.time())))
+    if cursor.rowcount:
+        return None
+    cursor.execute("SELECT resultado FROM eventos_processados WHERE empresa_id = ? AND id_evento = ?",
+                   (empresa_id, id_evento))
+    row = cursor.fetchone()
+    return dict(json.loads(row[0]) if row and row[0] else {}, duplicado=True)
+
 
-def get_db_connection():
-    return sqlite3.connect("estacionamento.db", timeout=10, check_same_thread=False)
+def _concluir_evento(cursor, empresa_id, id_evento, resultado):
+    cursor.execute("UPDATE eventos_processados SET resultado = ? WHERE empresa_id = ? AND id_evento = ?",
+                   (json.dumps(resultado), empresa_id, id_evento))
 
 
-def registrar_entrada(placa, tipo, empresa_id, responsavel=None, cpf_responsavel=None):
-    entrada = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+def registrar_entrada(placa, tipo, empresa_id, responsavel=None, cpf_responsavel=None, id_evento=None):
+    """Registra a entrada; com id_evento, repetições devolvem o primeiro resultado (duplicado=True)."""
+    entrada, entrada_ts = agora_movimentacao()
 
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
+        if id_evento:
+            anterior = _reservar_evento(cursor, empresa_id, id_evento)
+            if anterior is not None:
+                return anterior
+        # O mesmo veículo pode estar no pátio no outro formato (ABC1234 / ABC1C34)
+        variantes = variantes_placa(placa)
+        cursor.execute(f"""
             SELECT 1 FROM movimentacoes 
-            WHERE placa = ? AND saida IS NULL AND empresa_id = ?
-        """, (placa, empresa_id))
+            WHERE placa IN ({",".join("?" * len(variantes))}) AND saida IS NULL AND empresa_id = ?
+        """, variantes + [empresa_id])
         if cursor.fetchone():
-            return {"erro": "Veículo já está no estacionamento"}
-
-        # garantir colunas (em caso de uso direto do services)
-        try:
-            cursor.execute("PRAGMA table_info(movimentacoes)")
-            cols = [r[1] for r in cursor.fetchall()]
-            if 'responsavel' in cols and 'cpf_responsavel' in cols:
-                cursor.execute("""
-                    INSERT INTO movimentacoes (placa, tipo, entrada, responsavel, cpf_responsavel, empresa_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (placa, tipo, entrada, responsavel, cpf_responsavel, empresa_id))
-            else:
-                cursor.execute("""
-                    INSERT INTO movimentacoes (placa, tipo, entrada, empresa_id)
-                    VALUES (?, ?, ?, ?)
-                """, (placa, tipo, entrada, empresa_id))
-        except Exception:
+            resultado = {"erro": "Veículo já está no estacionamento"}
+        else:
+            # As colunas responsavel/cpf_responsavel/entrada_ts são garantidas pelas migrações
             cursor.execute("""
-                INSERT INTO movimentacoes (placa, tipo, entrada, empresa_id)
-                VALUES (?, ?, ?, ?)
-            """, (placa, tipo, entrada, empresa_id))
+                INSERT INTO movimentacoes (placa, tipo, entrada, entrada_ts, responsavel, cpf_responsavel, empresa_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (placa, tipo, entrada, entrada_ts, responsavel, cpf_responsavel, empresa_id))
+            resultado = {"status": "entrada registrada", "placa": placa}
+        if id_evento:
+            _concluir_evento(cursor, empresa_id, id_evento, resultado)
 
-    return {"status": "entrada registrada", "placa": placa}
+    if "status" in resultado:
+        notificar_patio(empresa_id, "entrada", {
+            "placa": placa, "tipo": tipo, "entrada": entrada, "responsavel": responsavel})
+    return resultado
 
 
-def registrar_saida(placa, empresa_id):
-    saida = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+def registrar_saida(placa, empresa_id, id_evento=None):
+    """Registra a saída; com id_evento, repetições devolvem o primeiro resultado (duplicado=True)."""
+    saida, saida_ts = agora_movimentacao()
 
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
+        if id_evento:
+            anterior = _reservar_evento(cursor, empresa_id, id_evento)
+            if anterior is not None:
+                return anterior
+        variantes = variantes_placa(placa)
+        # RETURNING: a placa como está gravada (pode estar no outro formato), que é a
+        # que o feed ao vivo e o histórico precisam para achar a linha do pátio
+        gravadas = cursor.execute(f"""
             UPDATE movimentacoes
-            SET saida = ?
-            WHERE placa = ? AND saida IS NULL AND empresa_id = ?
-        """, (saida, placa, empresa_id))
+            SET saida = ?, saida_ts = ?
+            WHERE placa IN ({",".join("?" * len(variantes))}) AND saida IS NULL AND empresa_id = ?
+            RETURNING placa
+        """, [saida, saida_ts] + variantes + [empresa_id]).fetchall()
+
+        if not gravadas:
+            resultado = {"erro": "Veículo não encontrado"}
+        else:
+            resultado = {"status": "saida registrada", "placa": gravadas[0][0]}
+        if id_evento:
+            _concluir_evento(cursor, empresa_id, id_evento, resultado)
+
+    if "status" in resultado:
+        notificar_patio(empresa_id, "saida", {"placa": resultado["placa"], "saida": saida})
+    return resultado
+
+
+def _horario_evento(capturado_em, agora_ts):
+    """(texto, epoch) do evento: horário do cliente se plausível, senão o do servidor."""
+    if capturado_em is None:
+        return agora_movimentacao()
+    if capturado_em < agora_ts - MAX_ATRASO_EVENTO_S:
+        raise ValueError("Leitura antiga demais para ser registrada")
+    return movimentacao_de_epoch(min(capturado_em, agora_ts + MAX_ADIANTAMENTO_EVENTO_S))
 
-        if cursor.rowcount == 0:
-            return {"erro": "Veículo não encontrado"}
 
-    return {"status": "saida registrada", "placa": placa}
+def _chave_patio(placa):
+    """Chave para casar a mesma placa gravada em formatos diferentes (ver placas.chave_veiculo)."""
+    normalizada = normalizar_placa(placa)
+    return chave_veiculo(normalizada) if placa_valida(normalizada) else placa
+
+
+def _placas_no_patio(cursor, empresa_id, placas):
+    """{chave: (id, entrada_ts, placa gravada)} das placas do lote que estão no pátio (uma busca em idx_mov_patio).
+
+    A chave é _chave_patio(placa), igual para ABC1234, ABC-1234 e ABC1C34.
+    """
+    variantes = list({v for placa in placas for v in variantes_placa(placa)})
+    if not variantes:
+        return {}
+    cursor.execute(f"""
+        SELECT placa, id, entrada_ts FROM movimentacoes
+        WHERE empresa_id = ? AND saida IS NULL AND placa IN ({",".join("?" * len(variantes))})
+    """, [empresa_id] + variantes)
+    return {_chave_patio(placa): (id_, entrada_ts, placa) for placa, id_, entrada_ts in cursor.fetchall()}
+
+
+def _processar_lote(eventos, empresa_id, aplicar):
+    """Esqueleto comum de registrar_entradas_lote / registrar_saidas_lote.
+
+    Numa única transação: reserva os id_evento (repetições devolvem o resultado
+    gravado), percorre os eventos novos em ordem de captura chamando
+    aplicar(cursor, pendentes) -> {indice: resultado} e grava os resultados
+    das chaves reservadas. Retorna um resultado por evento, na ordem recebida.
+    """
+    agora_ts = agora_movimentacao()[1]
+    resultados = [None] * len(eventos)
+    reservados = {}  # id_evento -> índice do evento que o processa
+    repetidos = {}   # índice -> índice do evento com o mesmo id_evento neste lote
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        pendentes = []
+        for i, evento in enumerate(eventos):
+            id_evento = evento.get("id_evento")
+            if id_evento:
+                if id_evento in reservados:
+                    repetidos[i] = reservados[id_evento]
+                    continue
+                anterior = _reservar_evento(cursor, empresa_id, id_evento)
+                if anterior is not None:
+                    resultados[i] = {"placa": evento["placa"], **anterior, "indice": i}
+                    continue
+                reservados[id_evento] = i
+            pendentes.append(i)
+
+        validos = []
+        for i in sorted(pendentes, key=lambda i: eventos[i].get("capturado_em") or agora_ts):
+            try:
+                validos.append((i, _horario_evento(eventos[i].get("capturado_em"), agora_ts)))
+            except ValueError as e:
+                resultados[i] = {"erro": str(e)}
+        resultados_aplicados = aplicar(cursor, validos)
+        for i, resultado in resultados_aplicados.items():
+            resultados[i] = resultado
+
+        for id_evento, i in reservados.items():
+            _concluir_evento(cursor, empresa_id, id_evento, resultados[i])
+        for i in pendentes:
+            # A placa gravada (quando o aplicar a devolve) prevalece sobre a digitada
+            resultados[i] = {"placa": eventos[i]["placa"], **resultados[i], "indice": i}
+
+    for i, origem in repetidos.items():
+        resultados[i] = dict(resultados[origem], indice=i, duplicado=True)
+    return resultados
+
+
+def registrar_entradas_lote(eventos, empresa_id):
+    """Registra várias entradas numa única transação, na ordem do horário de captura.
+
+    eventos: dicts com placa, tipo e opcionais capturado_em (epoch do cliente),
+    id_evento (chave de idempotência), responsavel e cpf_responsavel.
+    Retorna um resultado por evento, na ordem recebida:
+    {"indice", "placa", "status"} ou {"indice", "placa", "erro"}, com
+    duplicado=True quando o id_evento já tinha sido processado. Nos registrados
+    "placa" é a gravada no banco; nos erros, a enviada.
+    """
+    inseridos = []
+
+    def aplicar(cursor, validos):
+        resultados = {}
+        placas = validar_placas([eventos[i]["placa"] for i, _ in validos])
+        no_patio = set(_placas_no_patio(cursor, empresa_id, [p for p in placas if p]))
+        linhas = []
+        for (i, (entrada, entrada_ts)), placa in zip(validos, placas):
+            evento = eventos[i]
+            if placa is None:
+                resultados[i] = {"erro": "Placa inválida"}
+                continue
+            chave = chave_veiculo(placa)
+            if chave in no_patio:
+                resultados[i] = {"erro": "Veículo já está no estacionamento"}
+                continue
+            no_patio.add(chave)
+            linhas.append((placa, evento["tipo"], entrada, entrada_ts, evento.get("responsavel"),
+                           evento.get("cpf_responsavel"), empresa_id))
+            resultados[i] = {"status": "entrada registrada", "placa": placa}
+            inseridos.append({"placa": placa, "tipo": evento["tipo"], "entrada": entrada,
+                              "responsavel": evento.get("responsavel")})
+        cursor.executemany("""
+            INSERT INTO movimentacoes (placa, tipo, entrada, entrada_ts, responsavel, cpf_responsavel, empresa_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, linhas)
+        return resultados
+
+    resultados = _processar_lote(eventos, empresa_id, aplicar)
+    notificar_patio_lote(empresa_id, [("entrada", dados) for dados in inseridos])
+    return resultados
+
+
+def registrar_saidas_lote(eventos, empresa_id):
+    """Registra várias saídas numa única transação (eventos: placa e opcionais capturado_em, id_evento).
+
+    Retorna um resultado por evento, na ordem recebida (ver registrar_entradas_lote).
+    """
+    registradas = []
+
+    def aplicar(cursor, validos):
+        resultados = {}
+        abertas = _placas_no_patio(cursor, empresa_id, [eventos[i]["placa"] for i, _ in validos])
+        updates = []
+        for i, (saida, saida_ts) in validos:
+            placa = eventos[i]["placa"]
+            movimentacao = abertas.pop(_chave_patio(placa), None)
+            if movimentacao is None:
+                resultados[i] = {"erro": "Veículo não encontrado"}
+                continue
+            id_, entrada_ts, placa_gravada = movimentacao
+            if entrada_ts is not None and saida_ts < entrada_ts:
+                # Leitura offline mais antiga que a entrada registrada por outro aparelho
+                saida, saida_ts = movimentacao_de_epoch(entrada_ts)
+            updates.append((saida, saida_ts, id_))
+            resultados[i] = {"status": "saida registrada", "placa": placa_gravada}
+            registradas.append({"placa": placa_gravada, "saida": saida})
+        cursor.executemany("UPDATE movimentacoes SET saida = ?, saida_ts = ? WHERE id = ?", updates)
+        return resultados
+
+    resultados = _processar_lote(eventos, empresa_id, aplicar)
+    notificar_patio_lote(empresa_id, [("saida", dados) for dados in registradas])
+    return resultados
+
+
+def notificar_patio_lote(empresa_id, eventos):
+    """Publica os eventos de um lote e uma única atualização dos contadores."""
+    if not eventos:
+        return
+    topico = topico_patio(empresa_id)
+    for tipo, dados in eventos:
+        barramento.publicar(topico, tipo, dados)
+    barramento.publicar(topico, "estatisticas", obter_estatisticas(empresa_id))
+
+
+def notificar_patio(empresa_id, tipo, dados):
+    """Publica a mudança no pátio (já commitada) e os contadores atualizados para o feed ao vivo."""
+    topico = topico_patio(empresa_id)
+    barramento.publicar(topico, tipo, dados)
+    barramento.publicar(topico, "estatisticas", obter_estatisticas(empresa_id))
 
 
 def listar_veiculos(empresa_id):
@@ -80,57 +314,79 @@ def listar_veiculos(empresa_id):
         return cursor.fetchall()
 
 
-def listar_saidas(empresa_id):
+def _pagina(rows, limite, id_da_linha=lambda row: row[-1]):
+    """Corta a página (buscada com limite + 1) e devolve (linhas, next_cursor)."""
+    if len(rows) > limite:
+        rows = rows[:limite]
+        return rows, id_da_linha(rows[-1])
+    return rows, None
+
+
+def _limite_pagina(limite):
+    return max(1, min(int(limite or LIMITE_PAGINA), MAX_LIMITE_PAGINA))
+
+
+def listar_saidas(empresa_id, cursor_id=None, limite=LIMITE_PAGINA, placa=None, tipo=None,
+                  data_inicio=None, data_fim=None):
+    """Página de veículos que já saíram (mais recentes primeiro), paginada por id.
+
+    Retorna (linhas, next_cursor); next_cursor é o id a passar como cursor_id
+    para a página seguinte (None na última). Datas em "YYYY-MM-DD" filtram a
+    hora de saída (data_fim inclusiva).
+    """
+    limite = _limite_pagina(limite)
+    where = ["saida IS NOT NULL", "empresa_id = ?"]
+    params = [empresa_id]
+    if cursor_id:
+        where.append("id < ?")
+        params.append(cursor_id)
+    if placa:
+        # Prefixo da placa (usa idx_mov_saidas_placa)
+        placa = placa.strip().upper()
+        where.append("placa >= ? AND placa < ?")
+        params += [placa, placa + "\uffff"]
+    if tipo:
+        where.append("LOWER(tipo) LIKE ?")
+        params.append(f"%{tipo.strip().lower()}%")
+    ordem = "id DESC"
+    if data_inicio or data_fim:
+        inicio, fim = intervalo_de_datas(data_inicio, data_fim)
+        if inicio is not None:
+            where.append("saida_ts >= ?")
+            params.append(inicio)
+        if fim is not None:
+            where.append("saida_ts < ?")
+            params.append(fim)
+        # Com período, o custo deve depender do tamanho do período e não da
+        # profundidade do histórico: "+id" impede o plano de varrer
+        # idx_mov_saidas desde o início só para evitar a ordenação
+        ordem = "+id DESC"
+    params.append(limite + 1)
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT placa, tipo, entrada, saida, responsavel, cpf_responsavel
+        cursor.execute(f"""
+            SELECT placa, tipo, entrada, saida, responsavel, cpf_responsavel, id
             FROM movimentacoes
-            WHERE saida IS NOT NULL AND empresa_id = ?
-            ORDER BY id DESC
-        """, (empresa_id,))
-        return cursor.fetchall()
+            WHERE {" AND ".join(where)}
+            ORDER BY {ordem} LIMIT ?
+        """, params)
+        return _pagina(cursor.fetchall(), limite)
 
 
 def resetar_banco(empresa_id):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM movimentacoes WHERE empresa_id = ?", (empresa_id,))
+    # Clientes do feed ao vivo recebem um pátio vazio
+    notificar_patio(empresa_id, "reset", {})
     return {"status": "Veículos da sua empresa foram resetados com sucesso"}
 
 
 def registrar_cadastro(dados, empresa_id):
-    # Garantir que a tabela existe
+    # Tabela/colunas garantidas pelas migrações; o índice de busca (cadastros_fts)
+    # é atualizado pelos triggers
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS cadastros (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT,
-                data_nascimento TEXT,
-                telefone TEXT,
-                cep TEXT,
-                endereco TEXT,
-                numero TEXT,
-                cargo TEXT,
-                email TEXT,
-                cpf TEXT,
-                empresa TEXT,
-                placa TEXT,
-                tipo_veiculo TEXT,
-                empresa_id INTEGER NOT NULL
-            )
-        """)
-
-        # Correção: Verificar se a coluna 'numero' existe e adicionar se faltar (Migração Automática)
-        cursor.execute("PRAGMA table_info(cadastros)")
-        colunas_existentes = [col[1] for col in cursor.fetchall()]
-        if 'numero' not in colunas_existentes:
-            cursor.execute("ALTER TABLE cadastros ADD COLUMN numero TEXT")
-        if 'tipo_veiculo' not in colunas_existentes:
-            cursor.execute(
-                "ALTER TABLE cadastros ADD COLUMN tipo_veiculo TEXT")
-
         cursor.execute("""
             INSERT INTO cadastros (nome, data_nascimento, telefone, cep, endereco, numero, cargo, email, cpf, empresa, placa, tipo_veiculo, empresa_id)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -149,27 +405,42 @@ def registrar_cadastro(dados, empresa_id):
     return {"status": "Cadastro realizado com sucesso!"}
 
 
-def listar_cadastros(empresa_id, busca: Optional[str] = None):
+def consulta_fts_cadastros(busca):
+    """Transforma o texto digitado numa consulta FTS5 de prefixos (ou None se vazio).
+
+    Em termos com dígitos (CPF/placa) a pontuação é removida, como no índice
+    ("123.456" -> 123456*, "abc-1d" -> abc1d*); cada termo vira um prefixo e
+    todos precisam casar (AND).
+    """
+    termos = []
+    for termo in busca.split():
+        if re.fullmatch(r"[\w.\-/]+", termo) and re.search(r"\d", termo):
+            termo = re.sub(r"[.\-/]", "", termo)
+        termos += re.findall(r"\w+", termo)
+    if not termos:
+        return None
+    return " ".join(f'"{t}"*' for t in termos)
+
+
+def listar_cadastros(empresa_id, busca: Optional[str] = None, limite: int = LIMITE_BUSCA_CADASTROS):
+    """Lista os cadastros da empresa; com `busca`, usa o índice FTS5 (ranqueado, até `limite`)."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        # Garante que a tabela exista antes de consultar
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS cadastros (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT, data_nascimento TEXT, telefone TEXT, cep TEXT,
-                endereco TEXT, numero TEXT, cargo TEXT, email TEXT, cpf TEXT,
-                empresa TEXT, placa TEXT, tipo_veiculo TEXT, empresa_id INTEGER
-            )
-        """)
 
         if busca:
-            query = """
-                SELECT id, nome, cpf, telefone, email, cargo, empresa, placa
-                FROM cadastros
-                WHERE empresa_id = ? AND (nome LIKE ? OR placa LIKE ?)
-                ORDER BY nome
-            """
-            params = (empresa_id, f"%{busca}%", f"%{busca}%")
-            cursor.execute(query, params)
+            consulta = consulta_fts_cadastros(busca)
+            if consulta is None:
+                return []
+            # Pesos do bm25 na ordem das colunas: placa/CPF pesam mais que nome,
+            # que pesa mais que email/empresa
+            cursor.execute("""
+                SELECT c.id, c.nome, c.cpf, c.telefone, c.email, c.cargo, c.empresa, c.placa
+                FROM cadastros_fts
+                JOIN cadastros c ON c.id = cadastros_fts.rowid
+                WHERE cadastros_fts MATCH ? AND c.empresa_id = ?
+                ORDER BY bm25(cadastros_fts, 5.0, 10.0, 10.0, 2.0, 1.0)
+                LIMIT ?
+            """, (consulta, empresa_id, limite))
         else:
             query = """
                 SELECT id, nome, cpf, telefone, email, cargo, empresa, placa
@@ -223,125 +494,17 @@ def atualizar_cadastro(cadastro_id: int, dados, empresa_id: int):
 
 
 def setup_usuarios():
+    # Estrutura do banco (tabelas, colunas e índices) fica nas migrações versionadas
+    aplicar_migracoes()
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT DEFAULT 'operador',
-                empresa_id INTEGER NOT NULL,
-                FOREIGN KEY (empresa_id) REFERENCES empresas (id)
-            )
-        """)
-        
-        # --- NOVA TABELA DE EMPRESAS ---
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS empresas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome_empresa TEXT NOT NULL,
-                cnpj TEXT UNIQUE NOT NULL
-            )
-        """)
-
-        # --- MIGRAÇÃO AUTOMÁTICA DE COLUNAS ---
-        cursor.execute("PRAGMA table_info(usuarios)")
-        cols = [r[1] for r in cursor.fetchall()]
-        if 'role' not in cols:
-            cursor.execute(
-                "ALTER TABLE usuarios ADD COLUMN role TEXT DEFAULT 'operador'")
-            # Atualiza o admin para ter permissão total
-            cursor.execute(
-                "UPDATE usuarios SET role = 'admin' WHERE username = 'admin'")
-        
-        if 'empresa_id' not in cols:
-            cursor.execute("ALTER TABLE usuarios ADD COLUMN empresa_id INTEGER NOT NULL DEFAULT 1")
 
         # Garante que a empresa padrão (ID 1) exista
         cursor.execute("SELECT id FROM empresas WHERE id = 1")
         if not cursor.fetchone():
             cursor.execute("INSERT OR IGNORE INTO empresas (id, nome_empresa, cnpj) VALUES (1, 'Empresa Padrão', '00000000000000')")
 
-        # Criar tabela de configurações (para o layout dinâmico)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS configuracoes (
-                chave TEXT PRIMARY KEY,
-                valor TEXT
-            )
-        """)
-
-        # --- CHAT TABLES ---
-        # Tabela de Protocolos/Conversas
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_protocolos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario_cliente TEXT NOT NULL,
-                assunto TEXT,
-                data_inicio TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'aberto', -- aberto, fechado
-                empresa_id INTEGER NOT NULL
-            )
-        """)
-
-        # Migração: Verificar se a tabela chat_mensagens antiga existe (sem protocolo_id)
-        cursor.execute("PRAGMA table_info(chat_mensagens)")
-        cols_chat = [r[1] for r in cursor.fetchall()]
-        if 'usuario' in cols_chat and 'protocolo_id' not in cols_chat:
-            # Tabela antiga incompatível encontrada. Recriar.
-            cursor.execute("DROP TABLE chat_mensagens")
-
-        # Tabela de Mensagens
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_mensagens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                protocolo_id INTEGER NOT NULL,
-                usuario TEXT NOT NULL,
-                texto TEXT NOT NULL,
-                data_hora TEXT NOT NULL,
-                empresa_id INTEGER NOT NULL,
-                FOREIGN KEY (protocolo_id) REFERENCES chat_protocolos (id)
-            )
-        """)
-
-        # --- ARQUIVOS / NUVEM ---
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS arquivos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome_original TEXT,
-                caminho_salvo TEXT,
-                tamanho TEXT,
-                data_upload TEXT,
-                uploader TEXT,
-                empresa_id INTEGER NOT NULL
-            )
-        """)
-
-        # --- HISTÓRICO / LOGS ---
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS historico_acoes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario TEXT,
-                acao TEXT,
-                detalhes TEXT,
-                data_hora TEXT,
-                empresa_id INTEGER NOT NULL
-            )
-        """)
-
-        # --- MONITORAMENTO / PERFORMANCE ---
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS historico_performance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                data_hora TEXT,
-                cpu_usage REAL,
-                ram_usage REAL,
-                disk_usage REAL,
-                ping_local INTEGER,
-                ping_railway INTEGER
-            )
-        """)
-
         # Criar usuário padrão se não existir
         cursor.execute("SELECT id FROM usuarios WHERE username = 'admin'")
         if not cursor.fetchone():
@@ -371,17 +534,7 @@ def setup_usuarios():
             cursor.execute("INSERT INTO usuarios (username, password_hash, role, empresa_id) VALUES (?, ?, ?, ?)",
                            ('rother', pass_hash_colega, 'operador', 1))
 
-        # --- MIGRAÇÃO DE DADOS EXISTENTES PARA A EMPRESA PADRÃO (ID 1) ---
-        tabelas_para_migrar = ['movimentacoes', 'cadastros', 'chat_protocolos', 'chat_mensagens', 'arquivos', 'historico_acoes']
-        for tabela in tabelas_para_migrar:
-            try:
-                cursor.execute(f"PRAGMA table_info({tabela})")
-                cols = [r[1] for r in cursor.fetchall()]
-                if 'empresa_id' not in cols:
-                    cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN empresa_id INTEGER NOT NULL DEFAULT 1")
-            except sqlite3.OperationalError:
-                # Tabela pode não existir ainda, ignora o erro
-                pass
+    cache_usuarios.invalidar()
 
     # Exporta todos os usuários para o CSV para garantir sincronia
     exportar_usuarios_para_csv()
@@ -394,11 +547,12 @@ def criar_usuario(username, password, role, empresa_id):
             hash_senha = get_hash_senha(password)
             cursor.execute(
                 "INSERT INTO usuarios (username, password_hash, role, empresa_id) VALUES (?, ?, ?, ?)", (username, hash_senha, role, empresa_id))
-            # Salva no backup CSV (Excel)
-            log_usuario_csv(username, password, role, "CRIADO")
-            return {"status": "Usuário criado com sucesso!"}
         except sqlite3.IntegrityError:
             return {"erro": "Nome de usuário já existe nesta empresa."}
+    cache_usuarios.invalidar_usuarios(empresa_id)
+    # Salva no backup CSV (Excel)
+    log_usuario_csv(username, password, role, "CRIADO")
+    return {"status": "Usuário criado com sucesso!"}
 
 
 def listar_usuarios(empresa_id):
@@ -421,7 +575,8 @@ def excluir_usuario(user_id, empresa_id):
             return {"erro": "Não é possível excluir o superusuário admin."}
 
         cursor.execute("DELETE FROM usuarios WHERE id = ? AND empresa_id = ?", (user_id, empresa_id))
-        return {"status": "Usuário excluído."}
+    cache_usuarios.invalidar_usuarios(empresa_id)
+    return {"status": "Usuário excluído."}
 
 
 def atualizar_usuario(user_id, username, password, role, empresa_id):
@@ -451,48 +606,29 @@ def atualizar_usuario(user_id, username, password, role, empresa_id):
         if cursor.rowcount == 0:
             return {"erro": "Usuário não encontrado."}
 
+    cache_usuarios.invalidar_usuarios(empresa_id)
     return {"status": "Usuário atualizado com sucesso!"}
 
 
-def verificar_senha(senha_plana, senha_hash):
-    # Converte para bytes se for string, pois o bcrypt exige bytes
-    if isinstance(senha_plana, str):
-        senha_plana = senha_plana.encode('utf-8')
-    if isinstance(senha_hash, str):
-        senha_hash = senha_hash.encode('utf-8')
-    return bcrypt.checkpw(senha_plana, senha_hash)
-
-
-def get_hash_senha(senha):
-    if isinstance(senha, str):
-        senha = senha.encode('utf-8')
-    hashed = bcrypt.hashpw(senha, bcrypt.gensalt())
-    return hashed.decode('utf-8')
+def atualizar_hash_senha(user_id, empresa_id, senha_hash):
+    """Regrava o hash de um usuário (custo do bcrypt atualizado no login, ver senhas.py)."""
+    with get_db_connection() as conn:
+        conn.execute("UPDATE usuarios SET password_hash = ? WHERE id = ? AND empresa_id = ?",
+                     (senha_hash, user_id, empresa_id))
+    cache_usuarios.invalidar_usuarios(empresa_id)
 
 
 def get_usuario(username: str, empresa_id: int):
-    with get_db_connection() as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM usuarios WHERE username = ? AND empresa_id = ?", (username, empresa_id))
-        return cursor.fetchone()
+    """Registro do usuário (dict) ou None. Lido do cache de autenticação (cache_usuarios.py)."""
+    return cache_usuarios.usuario(username, empresa_id)
 
 def get_empresa_por_cnpj(cnpj: str):
     """Busca uma empresa pelo CNPJ."""
-    with get_db_connection() as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM empresas WHERE cnpj = ?", (cnpj,))
-        return cursor.fetchone()
+    return cache_usuarios.empresa(cnpj=cnpj)
 
 def get_empresa_por_id(empresa_id: int):
     """Busca uma empresa pelo ID (usado para login de admin/dev sem CNPJ)."""
-    with get_db_connection() as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM empresas WHERE id = ?", (empresa_id,))
-        return cursor.fetchone()
+    return cache_usuarios.empresa(empresa_id=empresa_id)
 
 
 def executar_sql_raw(query: str):
@@ -504,6 +640,8 @@ def executar_sql_raw(query: str):
         try:
             cursor.execute(query)
             conn.commit()
+            # O painel SQL pode alterar usuarios/empresas sem passar pelas funções acima
+            cache_usuarios.invalidar()
             if cursor.description:
                 colunas = [description[0]
                            for description in cursor.description]
@@ -551,7 +689,7 @@ def get_messages_by_protocol(protocolo_id, empresa_id):
 
 def save_chat_message(protocolo_id, usuario, texto, empresa_id):
     """Salva uma nova mensagem em um protocolo existente."""
-    fuso = pytz.timezone('America/Sao_Paulo')
+    fuso = FUSO_SP
     data_hora = datetime.now(fuso).strftime("%d/%m %H:%M")
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -559,13 +697,22 @@ def save_chat_message(protocolo_id, usuario, texto, empresa_id):
             "INSERT INTO chat_mensagens (protocolo_id, usuario, texto, data_hora, empresa_id) VALUES (?, ?, ?, ?, ?)",
             (protocolo_id, usuario, texto, data_hora, empresa_id)
         )
+        mensagem_id = cursor.lastrowid
+        cursor.execute(
+            "SELECT usuario_cliente, empresa_id FROM chat_protocolos WHERE id = ?", (protocolo_id,))
+        protocolo = cursor.fetchone()
         conn.commit()
-    return {"status": "Mensagem enviada", "protocolo_id": protocolo_id}
+
+    if protocolo:
+        notificar_chat(protocolo[1], "mensagem", {
+            "id": mensagem_id, "protocolo_id": protocolo_id, "usuario": usuario, "texto": texto,
+            "data_hora": data_hora, "usuario_cliente": protocolo[0], "empresa_id": protocolo[1]})
+    return {"status": "Mensagem enviada", "protocolo_id": protocolo_id, "mensagem_id": mensagem_id}
 
 
 def create_protocol_and_message(usuario, texto, empresa_id):
     """Cria um novo protocolo e adiciona a primeira mensagem."""
-    fuso = pytz.timezone('America/Sao_Paulo')
+    fuso = FUSO_SP
     data_hora = datetime.now(fuso).strftime("%d/%m %H:%M")
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -582,8 +729,47 @@ def create_protocol_and_message(usuario, texto, empresa_id):
             "INSERT INTO chat_mensagens (protocolo_id, usuario, texto, data_hora, empresa_id) VALUES (?, ?, ?, ?, ?)",
             (protocolo_id, usuario, texto, data_hora, empresa_id)
         )
+        mensagem_id = cursor.lastrowid
         conn.commit()
-    return {"status": "Protocolo criado", "protocolo_id": protocolo_id}
+
+    notificar_chat(empresa_id, "protocolo", {
+        "id": protocolo_id, "usuario_cliente": usuario, "assunto": assunto,
+        "data_inicio": data_hora, "status": "aberto", "empresa_id": empresa_id})
+    notificar_chat(empresa_id, "mensagem", {
+        "id": mensagem_id, "protocolo_id": protocolo_id, "usuario": usuario, "texto": texto,
+        "data_hora": data_hora, "usuario_cliente": usuario, "empresa_id": empresa_id})
+    return {"status": "Protocolo criado", "protocolo_id": protocolo_id, "mensagem_id": mensagem_id}
+
+
+def notificar_chat(empresa_id, tipo, dados):
+    """Publica no canal da empresa e no canal global do suporte (dev/admin)."""
+    barramento.publicar(topico_chat(empresa_id), tipo, dados)
+    barramento.publicar(TOPICO_CHAT_SUPORTE, tipo, dados)
+
+
+def listar_mensagens_desde(ultimo_id, empresa_id=None, usuario_cliente=None, limite=500):
+    """Mensagens com id > ultimo_id (reconexão do canal de chat).
+
+    Sem empresa_id/usuario_cliente traz de todos os protocolos (painel do suporte).
+    """
+    query = """
+        SELECT m.id, m.protocolo_id, m.usuario, m.texto, m.data_hora,
+               p.usuario_cliente, p.empresa_id
+        FROM chat_mensagens m
+        JOIN chat_protocolos p ON p.id = m.protocolo_id
+        WHERE m.id > ?
+    """
+    params = [ultimo_id]
+    if empresa_id is not None:
+        query += " AND p.empresa_id = ? AND p.usuario_cliente = ?"
+        params += [empresa_id, usuario_cliente]
+    query += " ORDER BY m.id LIMIT ?"
+    params.append(limite)
+    with get_db_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
 
 
 def list_protocols():
@@ -613,7 +799,13 @@ def update_protocol_status(protocol_id, status, empresa_id):
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE chat_protocolos SET status = ? WHERE id = ? AND empresa_id = ?", (status, protocol_id, empresa_id))
+        atualizado = cursor.rowcount
+        cursor.execute("SELECT usuario_cliente FROM chat_protocolos WHERE id = ?", (protocol_id,))
+        row = cursor.fetchone()
         conn.commit()
+    if atualizado and row:
+        notificar_chat(empresa_id, "protocolo", {
+            "id": protocol_id, "status": status, "usuario_cliente": row[0], "empresa_id": empresa_id})
     return {"status": "updated"}
 
 
@@ -627,8 +819,17 @@ def close_protocols_bulk(protocol_ids, empresa_id):
         placeholders = ','.join('?' for _ in protocol_ids)
         sql = f"UPDATE chat_protocolos SET status = 'fechado' WHERE id IN ({placeholders}) AND empresa_id = ?"
         cursor.execute(sql, protocol_ids + [empresa_id])
+        count = cursor.rowcount
+        cursor.execute(
+            f"SELECT id, usuario_cliente FROM chat_protocolos WHERE id IN ({placeholders}) AND empresa_id = ?",
+            protocol_ids + [empresa_id])
+        fechados = cursor.fetchall()
         conn.commit()
-        return {"count": cursor.rowcount}
+
+    for protocolo_id, usuario_cliente in fechados:
+        notificar_chat(empresa_id, "protocolo", {
+            "id": protocolo_id, "status": "fechado", "usuario_cliente": usuario_cliente, "empresa_id": empresa_id})
+    return {"count": count}
 
 
 def get_global_last_message_id():
@@ -644,87 +845,87 @@ def get_global_last_message_id():
 def salvar_historico_performance(cpu, ram, disk, ping_local, ping_railway):
     """Salva um snapshot da performance do servidor."""
     # Salva em formato ISO com Timezone (ex: 2023-10-27T16:30:00-03:00) para o frontend converter corretamente
-    data_hora = datetime.now().astimezone().isoformat()
-    
+    agora = datetime.now().astimezone()
+    data_hora = agora.isoformat()
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        # GARANTIA: Cria a tabela se não existir (corrige o erro sem precisar reiniciar)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS historico_performance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                data_hora TEXT,
-                cpu_usage REAL,
-                ram_usage REAL,
-                disk_usage REAL,
-                ping_local INTEGER,
-                ping_railway INTEGER
-            )
-        """)
         cursor.execute("""
-            INSERT INTO historico_performance (data_hora, cpu_usage, ram_usage, disk_usage, ping_local, ping_railway)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (data_hora, cpu, ram, disk, ping_local, ping_railway))
+            INSERT INTO historico_performance (data_hora, cpu_usage, ram_usage, disk_usage, ping_local, ping_railway, ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (data_hora, cpu, ram, disk, ping_local, ping_railway, int(agora.timestamp())))
 
 def obter_historico_performance(data_filtro):
-    """Busca o histórico de um dia específico (YYYY-MM-DD)."""
+    """Busca o histórico de um dia específico (YYYY-MM-DD, horário local do servidor)."""
+    inicio, fim = intervalo_de_datas(data_filtro, data_filtro)
     with get_db_connection() as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        
-        # GARANTIA: Cria a tabela se não existir
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS historico_performance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                data_hora TEXT,
-                cpu_usage REAL,
-                ram_usage REAL,
-                disk_usage REAL,
-                ping_local INTEGER,
-                ping_railway INTEGER
-            )
-        """)
-
-        # Filtra pela data (string startswith)
         cursor.execute("""
             SELECT data_hora, cpu_usage, ram_usage, ping_local, ping_railway 
             FROM historico_performance 
-            WHERE data_hora LIKE ? 
-            ORDER BY data_hora ASC
-        """, (f"{data_filtro}%",))
+            WHERE ts >= ? AND ts < ?
+            ORDER BY ts ASC
+        """, (inicio, fim))
         return [dict(row) for row in cursor.fetchall()]
 
 def limpar_historico_performance():
-    """Apaga todo o histórico de performance."""
+    """Apaga todo o histórico de performance (amostras e séries agregadas)."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM historico_performance")
+        cursor.execute("DELETE FROM performance_series")
         return {"status": "Histórico limpo com sucesso!"}
 
+def limpar_eventos_processados(dias=RETENCAO_EVENTOS_DIAS):
+    """Apaga as chaves de idempotência mais antigas que `dias` (o aparelho já recebeu a resposta)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM eventos_processados WHERE criado_ts < ?",
+                       (int(time.time()) - dias * 86400,))
+        return cursor.rowcount
+
 # --- Funções de Histórico / Logs ---
 
-def salvar_arquivo_db(nome_original, caminho_salvo, tamanho, uploader, empresa_id):
-    fuso = pytz.timezone('America/Sao_Paulo')
+def salvar_arquivo_db(nome_original, caminho_salvo, tamanho, uploader, empresa_id, tamanho_bytes=None, sha256=None,
+                      job_id=None):
+    """`sha256` do conteúdo vira o ETag do download (ver transferencias.py). Com `job_id`
+    o arquivo é resultado de um job: fica fora da lista e só sai por /api/jobs/{id}/arquivo."""
+    fuso = FUSO_SP
     data_upload = datetime.now(fuso).strftime("%d/%m/%Y %H:%M")
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO arquivos (nome_original, caminho_salvo, tamanho, data_upload, uploader, empresa_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (nome_original, caminho_salvo, tamanho, data_upload, uploader, empresa_id))
-    return {"status": "Arquivo salvo"}
+            INSERT INTO arquivos (nome_original, caminho_salvo, tamanho, data_upload, uploader, empresa_id,
+                                  tamanho_bytes, sha256, job_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (nome_original, caminho_salvo, tamanho, data_upload, uploader, empresa_id, tamanho_bytes, sha256,
+              job_id))
+    return {"status": "Arquivo salvo", "id": cursor.lastrowid}
+
+
+def formatar_tamanho(tamanho_bytes):
+    """Tamanho legível para a lista de arquivos ("512 B", "1.5 KB", "3.2 MB")."""
+    if tamanho_bytes < 1024:
+        return f"{tamanho_bytes} B"
+    if tamanho_bytes < 1024 * 1024:
+        return f"{round(tamanho_bytes/1024, 1)} KB"
+    return f"{round(tamanho_bytes/(1024*1024), 1)} MB"
 
 def listar_arquivos_db(empresa_id):
     with get_db_connection() as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM arquivos WHERE empresa_id = ? ORDER BY id DESC", (empresa_id,))
+        cursor.execute("SELECT * FROM arquivos WHERE empresa_id = ? AND job_id IS NULL ORDER BY id DESC", (empresa_id,))
         return [dict(row) for row in cursor.fetchall()]
 
-def get_arquivo_por_id(arquivo_id, empresa_id):
+def get_arquivo_por_id(arquivo_id, empresa_id, job_id=None):
+    """Arquivo da lista compartilhada ou, com `job_id`, o gerado por esse job."""
     with get_db_connection() as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM arquivos WHERE id = ? AND empresa_id = ?", (arquivo_id, empresa_id))
+        cursor.execute("SELECT * FROM arquivos WHERE id = ? AND empresa_id = ? AND job_id IS ?",
+                       (arquivo_id, empresa_id, job_id))
         return cursor.fetchone()
 
 def excluir_arquivo_db(arquivo_id, empresa_id):
@@ -733,78 +934,210 @@ def excluir_arquivo_db(arquivo_id, empresa_id):
         cursor.execute("DELETE FROM arquivos WHERE id = ? AND empresa_id = ?", (arquivo_id, empresa_id))
 
 def registrar_log(usuario, acao, empresa_id, detalhes=""):
-    """Registra uma ação no histórico."""
-    fuso = pytz.timezone('America/Sao_Paulo')
-    data_hora = datetime.now(fuso).strftime("%d/%m/%Y %H:%M:%S")
-    
+    """Registra uma ação no histórico (enfileirada e gravada em lote, ver auditoria.py).
+
+    Com a fila cheia pode bloquear: em código async, chamar por executar_io.
+    """
+    agora = datetime.now(FUSO_SP)
+    data_hora = agora.strftime("%d/%m/%Y %H:%M:%S")
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO historico_acoes (usuario, acao, detalhes, data_hora, empresa_id)
-                VALUES (?, ?, ?, ?, ?)
-            """, (usuario, acao, detalhes, data_hora, empresa_id))
+        fila_auditoria.registrar((usuario, acao, detalhes, data_hora, empresa_id, int(agora.timestamp())))
     except Exception as e:
         print(f"Erro ao salvar log: {e}")
 
-def listar_historico(empresa_id, usuario: Optional[str] = None):
-    """Lista as últimas 100 ações do sistema, com filtro opcional por usuário."""
+def _filtros_historico(cursor, empresa_id, usuario=None, acao=None, data_inicio=None, data_fim=None):
+    """Monta (where, params) dos filtros do histórico; None se o período não tem registros."""
+    where = ["empresa_id = ?"]
+    params = [empresa_id]
+    if usuario:
+        where.append("usuario = ?")
+        params.append(usuario)
+    if acao:
+        where.append("acao = ?")
+        params.append(acao)
+
+    if data_inicio or data_fim:
+        inicio, fim = intervalo_de_datas(data_inicio, data_fim, FUSO_SP)
+        # O histórico só recebe inserts, então id cresce junto com data_ts:
+        # o período vira uma faixa de ids (duas buscas em idx_hist_empresa_ts)
+        # e a consulta continua percorrendo o índice por id.
+        if inicio is not None:
+            cursor.execute("""
+                SELECT id FROM historico_acoes WHERE empresa_id = ? AND data_ts >= ?
+                ORDER BY data_ts, id LIMIT 1
+            """, (empresa_id, inicio))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            where.append("id >= ? AND +data_ts >= ?")
+            params += [row[0], inicio]
+        if fim is not None:
+            cursor.execute("""
+                SELECT id FROM historico_acoes WHERE empresa_id = ? AND data_ts < ?
+                ORDER BY data_ts DESC, id DESC LIMIT 1
+            """, (empresa_id, fim))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            where.append("id <= ? AND +data_ts < ?")
+            params += [row[0], fim]
+    return where, params
+
+
+def listar_historico(empresa_id, usuario: Optional[str] = None, acao: Optional[str] = None,
+                     data_inicio=None, data_fim=None, cursor_id=None, limite=LIMITE_PAGINA):
+    """Página do histórico de ações (mais recentes primeiro), paginada por id.
+
+    Filtros opcionais por usuário, ação e período ("YYYY-MM-DD", horário de
+    São Paulo, data_fim inclusiva). Retorna (linhas, next_cursor).
+    """
+    fila_auditoria.descarregar()
+    limite = _limite_pagina(limite)
+
     with get_db_connection() as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        
-        query = "SELECT * FROM historico_acoes"
-        params = []
-        query += " WHERE empresa_id = ?"
-        params.append(empresa_id)
+        filtros = _filtros_historico(cursor, empresa_id, usuario, acao, data_inicio, data_fim)
+        if filtros is None:
+            return [], None
+        where, params = filtros
+        if cursor_id:
+            where.append("id < ?")
+            params.append(cursor_id)
+
+        params.append(limite + 1)
+        cursor.execute(f"""
+            SELECT id, usuario, acao, detalhes, data_hora, empresa_id FROM historico_acoes
+            WHERE {" AND ".join(where)}
+            ORDER BY id DESC LIMIT ?
+        """, params)
+        rows, next_cursor = _pagina(cursor.fetchall(), limite, lambda row: row["id"])
+        return [dict(row) for row in rows], next_cursor
+
+
+def contar_historico(empresa_id, usuario: Optional[str] = None, acao: Optional[str] = None,
+                     data_inicio=None, data_fim=None):
+    """Quantas linhas iterar_historico() vai gerar com os mesmos filtros (progresso da exportação)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        filtros = _filtros_historico(cursor, empresa_id, usuario, acao, data_inicio, data_fim)
+        if filtros is None:
+            return 0
+        where, params = filtros
+        cursor.execute(f"SELECT COUNT(*) FROM historico_acoes WHERE {' AND '.join(where)}", params)
+        return cursor.fetchone()[0]
+
+
+def iterar_historico(empresa_id, usuario: Optional[str] = None, acao: Optional[str] = None,
+                     data_inicio=None, data_fim=None, lote=LOTE_EXPORTACAO):
+    """Gera (data_hora, usuario, acao, detalhes) do histórico filtrado, mais recentes primeiro.
+
+    Lê em lotes por id (keyset), cada lote numa consulta curta: a exportação
+    não segura uma transação de leitura aberta enquanto o cliente baixa.
+    Lança ValueError para data inválida já na primeira iteração.
+    """
+    fila_auditoria.descarregar()
+    with get_db_connection() as conn:
+        filtros = _filtros_historico(conn.cursor(), empresa_id, usuario, acao, data_inicio, data_fim)
+    if filtros is None:
+        return
+    where, params = filtros
+    ultimo_id = None
+    while True:
+        condicoes = where + (["id < ?"] if ultimo_id is not None else [])
+        valores = params + ([ultimo_id] if ultimo_id is not None else []) + [lote]
+        with get_db_connection() as conn:
+            rows = conn.execute(f"""
+                SELECT data_hora, usuario, acao, detalhes, id FROM historico_acoes
+                WHERE {" AND ".join(condicoes)}
+                ORDER BY id DESC LIMIT ?
+            """, valores).fetchall()
+        for row in rows:
+            yield row[:4]
+        if len(rows) < lote:
+            return
+        ultimo_id = rows[-1][4]
+
+
+def iterar_movimentacoes(empresa_id, data_inicio=None, data_fim=None, lote=LOTE_EXPORTACAO):
+    """Gera (placa, tipo, entrada, saida, responsavel, cpf) com entrada no período, em ordem de entrada.
+
+    Período em "YYYY-MM-DD" (data_fim inclusiva); lê em lotes por
+    (entrada_ts, id) usando idx_mov_entrada_ts.
+    """
+    inicio, fim = intervalo_de_datas(data_inicio, data_fim, FUSO_SP)
+    inicio = inicio if inicio is not None else 0
+    fim = fim if fim is not None else 2 ** 62
+    ultimo = (inicio, 0)  # ids começam em 1: inclui quem entrou exatamente em `inicio`
+    while True:
+        with get_db_connection() as conn:
+            rows = conn.execute("""
+                SELECT placa, tipo, entrada, saida, responsavel, cpf_responsavel, entrada_ts, id
+                FROM movimentacoes
+                WHERE empresa_id = ? AND (entrada_ts, id) > (?, ?) AND entrada_ts < ?
+                ORDER BY entrada_ts, id LIMIT ?
+            """, (empresa_id, ultimo[0], ultimo[1], fim, lote)).fetchall()
+        for row in rows:
+            yield row[:6]
+        if len(rows) < lote:
+            return
+        ultimo = (rows[-1][6], rows[-1][7])
 
-        if usuario:
-            query += " AND usuario = ?"
-            params.append(usuario)
-            
-        query += " ORDER BY id DESC LIMIT 100"
-        
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
 
 def listar_usuarios_do_historico(empresa_id):
     """Retorna uma lista única de usuários que possuem registros no histórico."""
+    fila_auditoria.descarregar()
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT DISTINCT usuario FROM historico_acoes WHERE empresa_id = ? ORDER BY usuario ASC", (empresa_id,))
         return [row[0] for row in cursor.fetchall()]
 
-def gerar_excel_historico(empresa_id, usuario: Optional[str] = None):
-    """Gera o caminho de um arquivo Excel (.xlsx) com o histórico, com filtro opcional."""
-    if usuario:
-        safe_usuario = "".join(c for c in usuario if c.isalnum() or c in ('-', '_')).rstrip()
-        filename = f"historico_{safe_usuario}.xlsx"
-    else:
-        filename = "historico_completo.xlsx"
-        
-    arquivo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
-    
-    import pandas as pd
-    
-    with get_db_connection() as conn:
-        query = "SELECT data_hora, usuario, acao, detalhes FROM historico_acoes"
-        params = []
-        query += " WHERE empresa_id = ?"
+# --- Funções de Câmeras (ingestão automática, ver cameras.py) ---
+
+def listar_cameras(empresa_id=None, somente_ativas=False):
+    """Câmeras da empresa (todas as empresas se empresa_id for None, usado pelo serviço de ingestão)."""
+    filtros, params = [], []
+    if empresa_id is not None:
+        filtros.append("empresa_id = ?")
         params.append(empresa_id)
-        if usuario:
-            query += " AND usuario = ?"
-            params.append(usuario)
-        query += " ORDER BY id DESC"
-        
-        df = pd.read_sql_query(query, conn, params=params)
-        
-        df.rename(columns={
-            'data_hora': 'Data/Hora', 'usuario': 'Usuário', 'acao': 'Ação', 'detalhes': 'Detalhes'
-        }, inplace=True)
-
-        df.to_excel(arquivo_path, index=False, engine='openpyxl')
-    
-    return arquivo_path, filename
+    if somente_ativas:
+        filtros.append("ativa = 1")
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    with get_db_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id, empresa_id, nome, url, direcao, tipo, ativa FROM cameras {where} ORDER BY id",
+                       params)
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def salvar_camera(empresa_id, nome, url, direcao, tipo="Carro", ativa=True, camera_id=None):
+    if direcao not in ("entrada", "saida"):
+        return {"erro": "Direção deve ser 'entrada' ou 'saida'."}
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if camera_id is None:
+            cursor.execute("""
+                INSERT INTO cameras (empresa_id, nome, url, direcao, tipo, ativa) VALUES (?, ?, ?, ?, ?, ?)
+            """, (empresa_id, nome, url, direcao, tipo, int(ativa)))
+            return {"status": "Câmera cadastrada.", "id": cursor.lastrowid}
+        cursor.execute("""
+            UPDATE cameras SET nome = ?, url = ?, direcao = ?, tipo = ?, ativa = ?
+            WHERE id = ? AND empresa_id = ?
+        """, (nome, url, direcao, tipo, int(ativa), camera_id, empresa_id))
+        if cursor.rowcount == 0:
+            return {"erro": "Câmera não encontrada."}
+        return {"status": "Câmera atualizada.", "id": camera_id}
+
+
+def excluir_camera(camera_id, empresa_id):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM cameras WHERE id = ? AND empresa_id = ?", (camera_id, empresa_id))
+        if cursor.rowcount == 0:
+            return {"erro": "Câmera não encontrada."}
+        return {"status": "Câmera excluída."}
+
 
 # --- Funções de Configuração de Layout (CSS Dinâmico) ---
 
@@ -815,19 +1148,12 @@ def salvar_css_personalizado(css_text):
         # Upsert (Inserir ou Atualizar)
         cursor.execute(
             "INSERT OR REPLACE INTO configuracoes (chave, valor) VALUES ('custom_css', ?)", (css_text,))
+    cache_config.invalidar()
     return {"status": "Layout atualizado com sucesso!"}
 
 
 def ler_css_personalizado():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        # Garante que a tabela existe (caso chame direto)
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS configuracoes (chave TEXT PRIMARY KEY, valor TEXT)")
-        cursor.execute(
-            "SELECT valor FROM configuracoes WHERE chave = 'custom_css'")
-        row = cursor.fetchone()
-        return row[0] if row else ""
+    return cache_config.obter().css
 
 
 def salvar_config_visual(config_json):
@@ -837,18 +1163,12 @@ def salvar_config_visual(config_json):
         config_str = json.dumps(config_json)
         cursor.execute(
             "INSERT OR REPLACE INTO configuracoes (chave, valor) VALUES ('visual_config', ?)", (config_str,))
+    cache_config.invalidar()
     return {"status": "Configuração visual salva!"}
 
 
 def ler_config_visual():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS configuracoes (chave TEXT PRIMARY KEY, valor TEXT)")
-        cursor.execute(
-            "SELECT valor FROM configuracoes WHERE chave = 'visual_config'")
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else {}
+    return cache_config.obter().visual
 
 # --- Funções de Versão do App ---
 
@@ -860,22 +1180,16 @@ def set_app_version(version, changelog):
             "INSERT OR REPLACE INTO configuracoes (chave, valor) VALUES ('app_version', ?)", (version,))
         cursor.execute(
             "INSERT OR REPLACE INTO configuracoes (chave, valor) VALUES ('app_changelog', ?)", (changelog,))
+    cache_config.invalidar()
     return {"status": "Versão publicada com sucesso!"}
 
 
 def get_app_version():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT valor FROM configuracoes WHERE chave = 'app_version'")
-        version_row = cursor.fetchone()
-        cursor.execute(
-            "SELECT valor FROM configuracoes WHERE chave = 'app_changelog'")
-        changelog_row = cursor.fetchone()
-        return {
-            "version": version_row[0] if version_row else "1.0.0",
-            "changelog": changelog_row[0] if changelog_row else "Versão inicial."
-        }
+    config = cache_config.obter()
+    return {
+        "version": config.versao_app,
+        "changelog": config.changelog
+    }
 
 
 def obter_estatisticas(empresa_id):
@@ -884,48 +1198,63 @@ def obter_estatisticas(empresa_id):
     - sairam_hoje: veículos que tiveram saida na data de hoje
     - visitantes: veículos no pátio com tipo indicando visitante
     - pendentes: veículos no pátio com entrada há mais de 24 horas (considerado pendente)
+
+    no_patio/visitantes/sairam_hoje vêm das tabelas de contadores mantidas por
+    triggers (migração 5), sem varrer o histórico. pendentes depende do relógio,
+    então é contado pelo índice parcial do pátio (custo limitado ao pátio atual).
     """
-    from datetime import datetime, timedelta
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    limite_pendente = int(datetime.now().timestamp()) - 24 * 3600
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT no_patio, visitantes FROM estatisticas_patio WHERE empresa_id = ?", (empresa_id,))
+        row = cursor.fetchone()
+        no_patio, visitantes = row if row else (0, 0)
+
+        cursor.execute(
+            "SELECT total FROM estatisticas_saidas_dia WHERE empresa_id = ? AND dia = ?", (empresa_id, hoje))
+        row = cursor.fetchone()
+        sairam_hoje = row[0] if row else 0
+
+        # Pendentes: entrada > 24 horas (idx_mov_patio_entrada)
+        cursor.execute("""
+            SELECT COUNT(*) FROM movimentacoes
+            WHERE saida IS NULL AND empresa_id = ? AND entrada_ts < ?
+        """, (empresa_id, limite_pendente))
+        pendentes = cursor.fetchone()[0]
+
+    return {
+        "no_patio": no_patio,
+        "sairam_hoje": sairam_hoje,
+        "visitantes": visitantes,
+        "pendentes": pendentes,
+    }
+
+
+def calcular_estatisticas_agregadas(empresa_id):
+    """Mesmos números de obter_estatisticas, calculados direto em movimentacoes
+    por consultas indexadas (usado para conferir/reconciliar os contadores)."""
+    inicio_hoje, fim_hoje = intervalo_do_dia()
+    limite_pendente = int(datetime.now().timestamp()) - 24 * 3600
 
-    # No pátio
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT placa, tipo, entrada, saida FROM movimentacoes WHERE empresa_id = ?", (empresa_id,))
-        rows = cursor.fetchall()
-
-        now = datetime.now()
-        no_patio = 0
-        visitantes = 0
-        pendentes = 0
-        sairam_hoje = 0
-
-        for placa, tipo, entrada_str, saida_str in rows:
-            # contar no pátio
-            if saida_str is None:
-                no_patio += 1
-
-                # visitantes: considerar apenas quando tipo == 'visitante' (case-insensitive)
-                if tipo and isinstance(tipo, str) and tipo.strip().lower() == 'visitante':
-                    visitantes += 1
-
-                # pendentes: entrada > 24 horas
-                try:
-                    entrada_dt = datetime.strptime(
-                        entrada_str, "%d-%m-%Y %H:%M:%S")
-                    if now - entrada_dt > timedelta(hours=24):
-                        pendentes += 1
-                except Exception:
-                    # se não for possível parsear, não conta como pendente
-                    pass
-            else:
-                # checar se saiu hoje
-                try:
-                    saida_dt = datetime.strptime(
-                        saida_str, "%d-%m-%Y %H:%M:%S")
-                    if (saida_dt.date() == now.date()):
-                        sairam_hoje += 1
-                except Exception:
-                    pass
+        cursor.execute("""
+            SELECT COUNT(*),
+                   COALESCE(SUM(CASE WHEN LOWER(TRIM(tipo)) = 'visitante' THEN 1 ELSE 0 END), 0),
+                   COALESCE(SUM(CASE WHEN entrada_ts < ? THEN 1 ELSE 0 END), 0)
+            FROM movimentacoes
+            WHERE saida IS NULL AND empresa_id = ?
+        """, (limite_pendente, empresa_id))
+        no_patio, visitantes, pendentes = cursor.fetchone()
+
+        cursor.execute("""
+            SELECT COUNT(*) FROM movimentacoes
+            WHERE empresa_id = ? AND saida_ts >= ? AND saida_ts < ?
+        """, (empresa_id, inicio_hoje, fim_hoje))
+        sairam_hoje = cursor.fetchone()[0]
 
     return {
         "no_patio": no_patio,
@@ -934,6 +1263,22 @@ def obter_estatisticas(empresa_id):
         "pendentes": pendentes,
     }
 
+
+def reconciliar_estatisticas(empresa_id):
+    """Compara os contadores incrementais com a agregação e corrige se divergirem."""
+    contadores = obter_estatisticas(empresa_id)
+    agregado = calcular_estatisticas_agregadas(empresa_id)
+    if contadores == agregado:
+        return {"status": "Contadores conferidos", "divergencias": {}}
+
+    divergencias = {
+        chave: {"contador": contadores[chave], "real": agregado[chave]}
+        for chave in agregado if contadores[chave] != agregado[chave]
+    }
+    with get_db_connection() as conn:
+        recalcular_estatisticas(conn.cursor(), empresa_id)
+    return {"status": "Contadores recalculados", "divergencias": divergencias}
+
 # --- Funções de Backup/Sync Excel (CSV) ---
 
 
@@ -982,51 +1327,9 @@ def log_usuario_csv(username, password, role, acao):
         print(f"Erro ao salvar log CSV: {e}")
 
 
-def importar_usuarios_csv():
-    """Lê o arquivo CSV e atualiza/cria os usuários no banco de dados."""
-    arquivo = get_backup_file_path()
-    if not os.path.exists(arquivo):
-        return {"erro": "Arquivo usuarios_backup.csv não encontrado."}
-
-    count = 0
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            with open(arquivo, mode='r', encoding='utf-8') as f:
-                reader = csv.DictReader(f, delimiter=';')
-                for row in reader:
-                    user = row.get("Login")  # Antes era "Usuario"
-                    pwd = row.get("Senha")
-                    role = row.get("Cargo")  # Antes era "Role"
-
-                    if user:
-                        # Verifica se usuario existe
-                        cursor.execute(
-                            "SELECT id FROM usuarios WHERE username = ?", (user,))
-                        exists = cursor.fetchone()
-
-                        if exists:
-                            if pwd and pwd != "MANTIDA":
-                                hash_senha = get_hash_senha(pwd)
-                                cursor.execute(
-                                    "UPDATE usuarios SET password_hash = ?, role = ? WHERE username = ?", (hash_senha, role, user))
-                            else:
-                                cursor.execute(
-                                    "UPDATE usuarios SET role = ? WHERE username = ?", (role, user))
-                        else:
-                            if pwd and pwd != "MANTIDA":
-                                hash_senha = get_hash_senha(pwd)
-                                cursor.execute(
-                                    "INSERT INTO usuarios (username, password_hash, role) VALUES (?, ?, ?)", (user, hash_senha, role))
-                        count += 1
-            conn.commit()
-        return {"status": f"Sincronização concluída! {count} registros processados."}
-    except Exception as e:
-        return {"erro": f"Erro ao importar: {str(e)}"}
-
 def get_system_health():
     """Retorna dados técnicos sobre o servidor e banco de dados."""
-    db_path = "estacionamento.db"
+    db_path = DB_PATH
     db_size = 0
     if os.path.exists(db_path):
         db_size = os.path.getsize(db_path) / (1024 * 1024) # Tamanho em MB
@@ -1057,28 +1360,10 @@ def get_system_health():
     }
 
 def criar_backup_sistema():
-    """Cria um arquivo ZIP com todo o código fonte e banco de dados."""
-    pasta_backups = "backups"
-    if not os.path.exists(pasta_backups):
-        os.makedirs(pasta_backups)
-
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    nome_zip = os.path.join(pasta_backups, f"backup_auto_{timestamp}.zip")
-
+    """Backup incremental do código e do banco (ver backup.py) + retenção dos snapshots."""
     try:
-        with zipfile.ZipFile(nome_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Percorre todos os arquivos da pasta atual
-            for root, dirs, files in os.walk("."):
-                # Ignorar pastas que não queremos no backup
-                if 'backups' in root or 'venv' in root or '.git' in root or '__pycache__' in root or 'static' in root:
-                    continue
-                
-                for file in files:
-                    # Salvar apenas arquivos relevantes (código, banco, configs)
-                    if file.endswith(('.py', '.html', '.css', '.js', '.db', '.json', '.csv', '.txt')):
-                        caminho_completo = os.path.join(root, file)
-                        zipf.write(caminho_completo, os.path.relpath(caminho_completo, "."))
-        
-        return {"status": "Backup criado com sucesso!", "arquivo": nome_zip}
+        resultado = criar_snapshot()
+        aplicar_retencao()
+        return resultado
     except Exception as e:
         return {"erro": f"Falha no backup: {str(e)}"}
@@ -0,0 +1,208 @@
+# transferencias.py
+"""Upload de arquivos em blocos, com retomada (rotas /api/arquivos/upload/sessoes).
+
+O upload antigo mandava o arquivo inteiro num multipart: uma queda do 4G no
+meio de uma CNH escaneada ou de um contrato recomeçava do zero, e não havia
+limite de tamanho. Agora:
+
+1. o cliente abre uma sessão com nome e tamanho (recusada acima de
+   MAX_TAMANHO_ARQUIVO) e recebe o id;
+2. manda os blocos em ordem (PUT com ?offset=), cada um com o CRC32 no
+   cabeçalho X-Bloco-Crc32. Bloco corrompido é recusado e reenviado;
+3. se a conexão cai, consulta a sessão (GET), que diz até onde o servidor já
+   gravou, e continua dali. Offset diferente do esperado devolve 409 com o
+   offset certo em Upload-Offset;
+4. no último bloco o arquivo vai para uploads/ e para a tabela arquivos, com o
+   SHA-256 do conteúdo (usado como ETag no download).
+
+As sessões ficam no banco (tabela uploads_sessoes) e os bytes em
+uploads/<id>.parte, então sobrevivem a um reinício do servidor. Cada bloco
+é gravado (com fsync) antes de o offset avançar no banco: o offset nunca
+aponta para bytes que não estão no disco. A gravação roda numa thread de IO
+(executores.executar_io), fora do event loop. Sessões paradas há mais de
+VALIDADE_SESSAO_S são apagadas por limpar_sessoes_expiradas().
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+import zlib
+
+from db import get_db_connection
+from services import formatar_tamanho, salvar_arquivo_db
+
+PASTA_UPLOADS = "uploads"
+MAX_TAMANHO_ARQUIVO = int(os.getenv("MAX_TAMANHO_ARQUIVO_MB", "100")) * 1024 * 1024
+# Sugerido ao cliente; pequeno o bastante para uma queda perder pouco no 4G
+TAMANHO_BLOCO = 1024 * 1024
+MAX_TAMANHO_BLOCO = 8 * 1024 * 1024
+VALIDADE_SESSAO_S = 24 * 3600
+# Cada sessão aberta pode ocupar até MAX_TAMANHO_ARQUIVO em disco
+MAX_SESSOES_POR_USUARIO = 5
+_BLOCO_LEITURA = 1024 * 1024
+
+# Um bloco por vez em cada sessão (reenvio do cliente enquanto o anterior ainda grava)
+_travas = {}
+_travas_lock = threading.Lock()
+
+
+class ErroUpload(Exception):
+    """Erro do protocolo; `status` é o código HTTP e `offset` (se houver) vai em Upload-Offset."""
+
+    def __init__(self, mensagem, status=400, offset=None):
+        super().__init__(mensagem)
+        self.status = status
+        self.offset = offset
+
+
+def _trava(sessao_id):
+    with _travas_lock:
+        return _travas.setdefault(sessao_id, threading.Lock())
+
+
+def _caminho_parte(sessao_id):
+    return os.path.join(PASTA_UPLOADS, f"{sessao_id}.parte")
+
+
+def _limite_mb():
+    return MAX_TAMANHO_ARQUIVO // (1024 * 1024)
+
+
+def verificar_tamanho(tamanho):
+    if tamanho < 0:
+        raise ErroUpload("Tamanho inválido.")
+    if tamanho > MAX_TAMANHO_ARQUIVO:
+        raise ErroUpload(f"Arquivo maior que o limite de {_limite_mb()} MB.", status=413)
+
+
+def _sessao_para_dict(row):
+    sessao_id, nome, tamanho, recebidos = row
+    return {"id": sessao_id, "nome": nome, "tamanho": tamanho, "offset": recebidos,
+            "tamanho_bloco": TAMANHO_BLOCO, "max_tamanho_bloco": MAX_TAMANHO_BLOCO}
+
+
+def criar_sessao(nome_original, tamanho, usuario, empresa_id):
+    verificar_tamanho(tamanho)
+    nome_original = os.path.basename(nome_original or "").strip() or "unknown"
+    agora = int(time.time())
+    sessao_id = uuid.uuid4().hex
+    with get_db_connection() as conn:
+        abertas = conn.execute("""
+            SELECT COUNT(*) FROM uploads_sessoes WHERE usuario = ? AND empresa_id = ? AND atualizado_ts > ?
+        """, (usuario, empresa_id, agora - VALIDADE_SESSAO_S)).fetchone()[0]
+        if abertas >= MAX_SESSOES_POR_USUARIO:
+            raise ErroUpload("Muitos uploads em andamento; conclua ou cancele um antes.", status=429)
+        conn.execute("""
+            INSERT INTO uploads_sessoes (id, empresa_id, usuario, nome_original, tamanho_total, criado_ts, atualizado_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (sessao_id, empresa_id, usuario, nome_original, tamanho, agora, agora))
+    # Arquivo vazio já existe: a sessão pode ser retomada mesmo sem nenhum bloco
+    open(_caminho_parte(sessao_id), "wb").close()
+    return obter_sessao(sessao_id, empresa_id)
+
+
+def obter_sessao(sessao_id, empresa_id):
+    row = get_db_connection().execute("""
+        SELECT id, nome_original, tamanho_total, recebidos FROM uploads_sessoes WHERE id = ? AND empresa_id = ?
+    """, (sessao_id, empresa_id)).fetchone()
+    return _sessao_para_dict(row) if row else None
+
+
+def _concluir(sessao_id, sessao, usuario, empresa_id):
+    """Move a parte para o nome definitivo e registra em arquivos. Devolve o id do arquivo."""
+    parte = _caminho_parte(sessao_id)
+    sha256 = hashlib.sha256()
+    with open(parte, "rb") as f:
+        for bloco in iter(lambda: f.read(_BLOCO_LEITURA), b""):
+            sha256.update(bloco)
+    nome_fisico = f"{uuid.uuid4()}{os.path.splitext(sessao['nome'])[1]}"
+    os.replace(parte, os.path.join(PASTA_UPLOADS, nome_fisico))
+    arquivo_id = salvar_arquivo_db(sessao["nome"], nome_fisico, formatar_tamanho(sessao["tamanho"]), usuario,
+                                   empresa_id, tamanho_bytes=sessao["tamanho"], sha256=sha256.hexdigest())["id"]
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM uploads_sessoes WHERE id = ?", (sessao_id,))
+    return arquivo_id
+
+
+def gravar_bloco(sessao_id, offset, dados, crc32, usuario, empresa_id):
+    """Grava um bloco na posição `offset`. Devolve {"offset": novo} ou, no último
+    bloco, {"status", "arquivo_id"} com o arquivo já registrado."""
+    if zlib.crc32(dados) != crc32:
+        raise ErroUpload("Bloco corrompido (CRC32 não confere); reenvie.")
+    with _trava(sessao_id):
+        sessao = obter_sessao(sessao_id, empresa_id)
+        if not sessao:
+            raise ErroUpload("Sessão de upload não encontrada ou expirada.", status=404)
+        if offset != sessao["offset"]:
+            raise ErroUpload("Offset diferente do esperado.", status=409, offset=sessao["offset"])
+        if offset + len(dados) > sessao["tamanho"]:
+            raise ErroUpload("Bloco passa do tamanho informado na sessão.", status=413, offset=sessao["offset"])
+
+        with open(_caminho_parte(sessao_id), "r+b") as f:
+            f.seek(offset)
+            f.write(dados)
+            # Descarta o que sobrou de uma tentativa que caiu antes de atualizar o banco
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        novo_offset = offset + len(dados)
+        with get_db_connection() as conn:
+            conn.execute("UPDATE uploads_sessoes SET recebidos = ?, atualizado_ts = ? WHERE id = ?",
+                         (novo_offset, int(time.time()), sessao_id))
+
+        if novo_offset < sessao["tamanho"]:
+            return {"offset": novo_offset}
+        arquivo_id = _concluir(sessao_id, sessao, usuario, empresa_id)
+    with _travas_lock:
+        _travas.pop(sessao_id, None)
+    return {"status": "Upload realizado com sucesso!", "arquivo_id": arquivo_id}
+
+
+def _apagar_sessao(sessao_id):
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM uploads_sessoes WHERE id = ?", (sessao_id,))
+    try:
+        os.remove(_caminho_parte(sessao_id))
+    except FileNotFoundError:
+        pass
+    with _travas_lock:
+        _travas.pop(sessao_id, None)
+
+
+def cancelar_sessao(sessao_id, empresa_id):
+    if not obter_sessao(sessao_id, empresa_id):
+        return {"erro": "Sessão de upload não encontrada."}
+    with _trava(sessao_id):
+        _apagar_sessao(sessao_id)
+    return {"status": "Upload cancelado."}
+
+
+def limpar_sessoes_expiradas():
+    limite = int(time.time()) - VALIDADE_SESSAO_S
+    ids = [r[0] for r in get_db_connection().execute(
+        "SELECT id FROM uploads_sessoes WHERE atualizado_ts < ?", (limite,)).fetchall()]
+    for sessao_id in ids:
+        with _trava(sessao_id):
+            _apagar_sessao(sessao_id)
+    return len(ids)
+
+
+def salvar_upload_inteiro(origem, nome_fisico):
+    """Upload antigo (multipart de uma vez): copia com limite de tamanho e calcula o SHA-256.
+    Devolve (tamanho_bytes, sha256)."""
+    caminho = os.path.join(PASTA_UPLOADS, nome_fisico)
+    sha256 = hashlib.sha256()
+    tamanho = 0
+    try:
+        with open(caminho, "wb") as destino:
+            for bloco in iter(lambda: origem.read(_BLOCO_LEITURA), b""):
+                tamanho += len(bloco)
+                verificar_tamanho(tamanho)
+                sha256.update(bloco)
+                destino.write(bloco)
+    except BaseException:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        raise
+    return tamanho, sha256.hexdigest()